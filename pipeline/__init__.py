@@ -0,0 +1,5 @@
+"""
+各 stage 共用的工具
+
+    python -m pipeline        # 依序跑完整條 pipeline
+"""
@@ -0,0 +1,190 @@
+import argparse
+import os
+import runpy
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from pipeline import cache, incremental, instrument, stage_db, stream_stats, timeslot
+from pipeline.stages import RAW_DB, ROOT_PATH, STAGES
+
+
+def fmt_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def raw_hi():
+    """
+    增量更新的上限：原始資料最新一筆所在的區塊（那個區塊還沒收完，先不處理）
+    """
+    conn = sqlite3.connect(stage_db._ro_uri(RAW_DB), uri=True)
+    try:
+        return incremental.latest_bucket(conn)
+    finally:
+        conn.close()
+
+
+def parse_args(argv):
+    """
+    python -m pipeline [stage ...] [--incremental] [--force] [--jobs N]
+                       [--bucket 分鐘] [--agg mean|max|last] [--stream-jobs N]
+
+    --bucket / --agg 設成環境變數，worker process 也看得到（見 timeslot）
+    --stream-jobs 一樣，是 stream_ana 裡再分幾個 process（見 stream_stats），不超過 --jobs
+    """
+    names = [name for name, _, _ in STAGES]
+    parser = argparse.ArgumentParser(prog="python -m pipeline", description="跑整條 pipeline")
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"只跑這幾個 stage（預設全部）：{', '.join(names)}")
+    parser.add_argument("--incremental", action="store_true", help="只處理 watermark 之後的新資料")
+    parser.add_argument("--force", action="store_true", help="不管快取，全部重跑")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bucket", type=int, metavar="分鐘", help="區塊寬度（分鐘，要能整除 60）")
+    parser.add_argument("--agg", choices=timeslot.AGGS, help="區塊內怎麼取值")
+    parser.add_argument("--stream-jobs", type=int, help="stream_ana 分幾個 process")
+    args = parser.parse_args(argv)
+
+    unknown = sorted(set(args.stages) - set(names))
+    if unknown:
+        parser.error(f"沒有這些 stage：{', '.join(unknown)}（可用：{', '.join(names)}）")
+    if args.bucket is not None and (args.bucket <= 0 or 60 % args.bucket != 0):
+        parser.error(f"--bucket 要能整除 60 分鐘：{args.bucket}")
+
+    if args.bucket is not None:
+        os.environ[timeslot.MINUTES_ENV] = str(args.bucket)
+    if args.agg is not None:
+        os.environ[timeslot.AGG_ENV] = args.agg
+    if args.stream_jobs is not None:
+        os.environ[stream_stats.JOBS_ENV] = str(max(1, args.stream_jobs))
+
+    opts = {"update": args.incremental, "force": args.force, "jobs": max(1, args.jobs)}
+    os.environ[stream_stats.RUNNER_JOBS_ENV] = str(opts["jobs"])
+    return set(args.stages), opts
+
+
+def file_size(path):
+    return path.stat().st_size if path.exists() else None
+
+
+def run_stage(name, script, hi=None):
+    """
+    在 worker process 裡跑一個 stage；hi 有給就是增量更新
+    return: instrument 的統計（時間、筆數、每句 SQL）
+    """
+    instrument.begin(name)
+    if hi is None:
+        runpy.run_path(str(script), run_name="__main__")
+    else:
+        runpy.run_path(str(script))["update"](hi)
+    return instrument.end()
+
+
+def main():
+    only, opts = parse_args(sys.argv[1:])
+    update = opts["update"]
+    results = {}
+    t_start = time.perf_counter()
+    run_id = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    mode = "incremental" if update else "full"
+
+    bucket = timeslot.current()     # 設定有錯在這裡就先報錯
+    print(f"🕒 時間區塊：{bucket}")
+
+    hi = raw_hi() if update else None
+    if update:
+        print(f"🔄 增量更新到 {hi}")
+
+    raw_fp = cache.raw_digest(RAW_DB)
+    scripts = {name: ROOT_PATH / script for name, script, _ in STAGES}
+    deps = {name: d for name, _, d in STAGES}
+    dst_dbs = {
+        name: runpy.run_path(str(script))["DST_DB"]
+        for name, script in scripts.items()
+    }
+
+    # 沒選到的 stage 當作已經完成（直接用現有的檔）
+    done = {name for name in scripts if only and name not in only}
+    waiting = [name for name, _, _ in STAGES if name not in done]
+    running = {}
+    fps = {}
+    started = {}
+    all_stats = []
+
+    # 上游都完成的 stage 就丟進 process pool，彼此獨立的分支會同時跑
+    with ProcessPoolExecutor(max_workers=opts["jobs"]) as pool:
+        while waiting or running:
+            for name in [n for n in waiting if set(deps[n]) <= done]:
+                waiting.remove(name)
+                dst = dst_dbs[name]
+
+                upstream = (
+                    [cache.stored(dst_dbs[d]) for d in deps[name]]
+                    if deps[name] else [raw_fp]
+                )
+                fps[name] = cache.fingerprint(scripts[name], upstream)
+
+                # 增量更新一定要跑；更新完不記 fingerprint，之後完整跑會重建
+                if not update and not opts["force"] and cache.is_fresh(dst, fps[name]):
+                    print(f"\n⏭️ stage {name} 沒有變動，沿用 {dst.name}")
+                    results[name] = (dst.name, None, 0.0)
+                    done.add(name)
+                    continue
+
+                print(f"\n▶️ stage {name}（{scripts[name].relative_to(ROOT_PATH)}）")
+                started[name] = (
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    file_size(dst),
+                )
+                running[pool.submit(run_stage, name, scripts[name], hi)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stats = future.result()
+                dst = dst_dbs[name]
+
+                if not update:
+                    cache.mark(dst, fps[name])
+
+                started_at, size_before = started[name]
+                instrument.save(
+                    run_id, mode, started_at, stats, size_before, file_size(dst)
+                )
+                all_stats.append(stats)
+
+                print(f"\n✅ stage {name} 完成（{stats['wall']:.1f}s）")
+                results[name] = (dst.name, file_size(dst), stats["wall"])
+                done.add(name)
+
+    print("\n📊 本次寫出的 stage 檔")
+    for name, _, _ in STAGES:
+        if name not in results:
+            continue
+        db_name, size, elapsed = results[name]
+        size_str = "沿用" if size is None else fmt_size(size)
+        print(f"  {name:<12}{db_name:<14}{size_str:>12}{elapsed:>9.1f}s")
+
+    total = sum(size for _, size, _ in results.values() if size is not None)
+    print(f"  合計寫出 {fmt_size(total)}，總耗時 {time.perf_counter() - t_start:.1f}s")
+
+    if all_stats:
+        print("\n🐢 最慢的 SQL")
+        for stage, s in instrument.slowest(all_stats):
+            sql = s["sql"] if len(s["sql"]) <= 60 else s["sql"][:57] + "..."
+            print(
+                f"  {stage:<12}{s['wall']:>8.2f}s ×{s['calls']:<7}"
+                f" 寫 {s['written']:<8} {sql}"
+            )
+        print(f"  （完整紀錄：{instrument.RUNS_DB.name} / {instrument.LOG_PATH.relative_to(ROOT_PATH)}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+pipeline 效能測試
+
+python -m pipeline.bench [--scales small,medium] [--threshold 1.5] [--save-baseline]
+
+每個規模：
+1. 用 pipeline.synth 產生假資料（bench/data/<規模>.db，產生過就沿用）
+2. 把 pipeline / ver_* 的腳本複製到 bench/work/<規模>/，在那裡完整跑一次
+   （--force --jobs 1，不會動到專案裡真正的 data.db / stage 檔）
+3. 各 stage 的時間直接讀那次的 pipeline_runs.db
+4. dashboard 的讀取函式（load_platform_df 等）拿掉 @st.cache_data，不開
+   streamlit 直接呼叫計時
+
+結果連同 git 版本寫進 bench/results.jsonl；有 bench/baseline.json 的話，
+比 baseline 慢超過 threshold 倍（而且多超過 MIN_DELTA 秒）就回傳失敗。
+"""
+import argparse
+import ast
+import json
+import math
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pipeline import stage_db
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+BENCH_PATH = ROOT_PATH / "bench"
+DATA_PATH = BENCH_PATH / "data"
+WORK_PATH = BENCH_PATH / "work"
+RESULTS_LOG = BENCH_PATH / "results.jsonl"
+BASELINE = BENCH_PATH / "baseline.json"
+
+# 規模 → pipeline.synth 的參數
+SCALES = {
+    "small": {"channels": 50, "months": 2},
+    "medium": {"channels": 300, "months": 6},
+    "large": {"channels": 2000, "months": 12},
+}
+
+SEED = 0
+MIN_DELTA = 0.2          # 秒；差不到這麼多的不算退步
+TIMEOUT = 2 * 60 * 60    # 整條 pipeline 最多跑多久
+
+# 要複製到 bench 工作目錄的東西
+COPY_GLOBS = ["pipeline/*.py", "ver_*/*.py", "data_construct.sql"]
+
+# (dashboard 腳本, 函式, 參數)；參數裡的 CHANNEL 會換成資料裡第一個頻道
+CHANNEL = object()
+LOADERS = [
+    ("ver_3/3_5_dataframe.py", "load_platform_df", ("yt_time_profile", "yt_diff")),
+    ("ver_3/3_5_dataframe.py", "load_platform_df", ("tw_time_profile", "tw_diff")),
+    ("ver_3/3_3_time_graph.py", "load_time_profile", ("yt_time_profile", CHANNEL)),
+    ("ver_3/3_3_time_graph.py", "load_time_profile", ("tw_time_profile", CHANNEL)),
+    ("ver_3/3_4_all_time_graph.py", "load_global_time_profile", ()),
+]
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=ROOT_PATH, capture_output=True, text=True
+        ).stdout.strip()
+
+    rev = git("rev-parse", "--short", "HEAD") or "unknown"
+    if git("status", "--porcelain", "--untracked-files=no"):
+        rev += "-dirty"
+    return rev
+
+
+def make_data(scale):
+    """
+    產生（或沿用）這個規模的假資料
+    """
+    params = SCALES[scale]
+    db = DATA_PATH / f"{scale}_{params['channels']}ch_{params['months']}m_s{SEED}.db"
+    if db.exists():
+        return db
+
+    DATA_PATH.mkdir(parents=True, exist_ok=True)
+    print(f"🧪 產生 {scale} 假資料（{params['channels']} 頻道 / {params['months']} 個月）")
+    subprocess.run(
+        [
+            sys.executable, "-m", "pipeline.synth", str(db),
+            "--channels", str(params["channels"]),
+            "--months", str(params["months"]),
+            "--seed", str(SEED),
+        ],
+        cwd=ROOT_PATH, check=True, stdout=subprocess.DEVNULL,
+    )
+    return db
+
+
+def make_workdir(scale, data_db):
+    """
+    bench/work/<規模>/：目前的腳本 + 假資料（symlink 成 data.db）
+    """
+    work = WORK_PATH / scale
+    if work.exists():
+        shutil.rmtree(work)
+
+    for pattern in COPY_GLOBS:
+        for src in ROOT_PATH.glob(pattern):
+            dst = work / src.relative_to(ROOT_PATH)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(src, dst)
+
+    (work / "data.db").symlink_to(data_db.resolve())
+    return work
+
+
+def run_pipeline(work):
+    """
+    在工作目錄完整跑一次，回傳 {stage: 統計}
+    """
+    log = work / "bench.log"
+    with log.open("w", encoding="utf-8") as f:
+        proc = subprocess.run(
+            [sys.executable, "-m", "pipeline", "--force", "--jobs", "1"],
+            cwd=work, stdout=f, stderr=subprocess.STDOUT, timeout=TIMEOUT,
+        )
+    if proc.returncode != 0:
+        raise RuntimeError(f"pipeline 執行失敗，請看 {log}")
+
+    conn = sqlite3.connect(work / "pipeline_runs.db")
+    try:
+        rows = conn.execute("""
+            SELECT stage, wall_s, cpu_s, rows_read, rows_written, size_after
+            FROM pipeline_runs
+            WHERE run_id = (SELECT MAX(run_id) FROM pipeline_runs)
+        """).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        stage: {
+            "wall": wall, "cpu": cpu,
+            "rows_read": read, "rows_written": written, "size": size,
+        }
+        for stage, wall, cpu, read, written, size in rows
+    }
+
+
+def _loaded_names(node):
+    return {
+        n.id for n in ast.walk(node)
+        if isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load)
+    }
+
+
+def extract_function(script, func_name):
+    """
+    從 dashboard 腳本抽出 func_name 跟它用到的 import / 常數 / 函式
+    （不執行 streamlit 的畫面部分，也拿掉 @st.cache_data），回傳可以呼叫的函式
+    """
+    tree = ast.parse(script.read_text(encoding="utf-8"))
+
+    defs = {}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                name = (alias.asname or alias.name).split(".")[0]
+                defs[name] = node
+        elif isinstance(node, ast.FunctionDef):
+            node.decorator_list = []    # @st.cache_data
+            defs[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id.isupper():
+                    defs[target.id] = node
+
+    # 從目標函式往回找所有用到的定義
+    needed, todo = set(), [func_name]
+    while todo:
+        name = todo.pop()
+        if name in needed or name not in defs:
+            continue
+        needed.add(name)
+        todo.extend(_loaded_names(defs[name]))
+
+    body = []
+    for node in tree.body:
+        if any(defs.get(n) is node for n in needed):
+            body.append(node)
+
+    module = ast.Module(body=body, type_ignores=[])
+    ns = {"__file__": str(script), "__name__": "bench_loader"}
+    exec(compile(module, str(script), "exec"), ns)
+    return ns[func_name]
+
+
+def first_channel(work):
+    with stage_db.connect(work / "ver_3" / "data_3_2.db") as conn:
+        row = conn.execute(
+            "SELECT channel_id FROM yt_time_profile ORDER BY channel_id LIMIT 1"
+        ).fetchone()
+    return row[0] if row else None
+
+
+def time_loaders(work, repeat=3):
+    """
+    dashboard 讀取函式各跑 repeat 次，取最快的
+    """
+    channel = first_channel(work)
+    results = {}
+    for script, func_name, args in LOADERS:
+        func = extract_function(work / script, func_name)
+        args = tuple(channel if a is CHANNEL else a for a in args)
+
+        best = math.inf
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            func(*args)
+            best = min(best, time.perf_counter() - t0)
+
+        key = f"{func_name}({', '.join(map(str, args))})"
+        results[key] = {"wall": best}
+    return results
+
+
+def raw_rows(data_db):
+    conn = sqlite3.connect(stage_db._ro_uri(data_db), uri=True)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM main").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def bench_scale(scale):
+    data_db = make_data(scale)
+    rows = raw_rows(data_db)
+    print(f"\n▶️ {scale}（main {rows:,} 筆）")
+
+    work = make_workdir(scale, data_db)
+    t0 = time.perf_counter()
+    stages = run_pipeline(work)
+    print(f"  ✅ pipeline 完成（{time.perf_counter() - t0:.1f}s）")
+
+    loaders = time_loaders(work)
+    print("  ✅ dashboard 讀取完成")
+
+    return {"scale": scale, "rows": rows, "stages": stages, "loaders": loaders}
+
+
+def compare(result, baseline, threshold):
+    """
+    跟 baseline 比，回傳退步的項目 [(名稱, baseline 秒數, 這次秒數)]
+    """
+    base = baseline.get(result["scale"])
+    if not base:
+        return []
+
+    slower = []
+    for kind in ("stages", "loaders"):
+        for name, stat in result[kind].items():
+            old = base.get(kind, {}).get(name)
+            if old is None:
+                continue
+            new = stat["wall"]
+            if new > old * threshold and new - old > MIN_DELTA:
+                slower.append((name, old, new))
+    return slower
+
+
+def print_scaling(results):
+    """
+    各 stage 的秒數，以及相鄰規模之間的成長指數（1 ≈ 線性，2 ≈ 平方）
+    """
+    if not results:
+        return
+
+    print("\n📊 各規模耗時（秒）／成長指數")
+    header = "".join(f"{r['scale']:>12}" for r in results)
+    print(f"  {'stage':<48}{header}   指數")
+
+    names = list(results[0]["stages"]) + list(results[0]["loaders"])
+    for name in names:
+        walls = [
+            r["stages"].get(name, r["loaders"].get(name, {})).get("wall")
+            for r in results
+        ]
+        cells = "".join(
+            f"{w:>12.2f}" if w is not None else f"{'-':>12}" for w in walls
+        )
+
+        exps = []
+        for (a, wa), (b, wb) in zip(
+            zip(results, walls), zip(results[1:], walls[1:])
+        ):
+            if wa and wb and wa > 0.01 and b["rows"] > a["rows"]:
+                exps.append(math.log(wb / wa) / math.log(b["rows"] / a["rows"]))
+        exp_str = " ".join(f"{e:.2f}" for e in exps)
+        warn = " ⚠️" if any(e > 1.3 for e in exps) else ""
+
+        print(f"  {name[:48]:<48}{cells}   {exp_str}{warn}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pipeline 效能測試")
+    parser.add_argument("--scales", default="small", help="逗號分隔：" + ",".join(SCALES))
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--save-baseline", action="store_true")
+    opts = parser.parse_args()
+
+    scales = [s.strip() for s in opts.scales.split(",") if s.strip()]
+    for s in scales:
+        if s not in SCALES:
+            raise ValueError(f"沒有這個規模：{s}（可用：{', '.join(SCALES)}）")
+
+    rev = git_revision()
+    started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+
+    results = []
+    regressions = []
+    for scale in scales:
+        result = bench_scale(scale)
+        results.append(result)
+        regressions += [
+            (scale, *r) for r in compare(result, baseline, opts.threshold)
+        ]
+
+        BENCH_PATH.mkdir(exist_ok=True)
+        with RESULTS_LOG.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(
+                {"rev": rev, "started_at": started_at, **result},
+                ensure_ascii=False,
+            ) + "\n")
+
+    print_scaling(results)
+
+    if opts.save_baseline:
+        for r in results:
+            baseline[r["scale"]] = {
+                "rev": rev,
+                "rows": r["rows"],
+                "stages": {k: v["wall"] for k, v in r["stages"].items()},
+                "loaders": {k: v["wall"] for k, v in r["loaders"].items()},
+            }
+        BASELINE.write_text(json.dumps(baseline, ensure_ascii=False, indent=2))
+        print(f"\n💾 已更新 {BASELINE.relative_to(ROOT_PATH)}（{rev}）")
+
+    if regressions:
+        print(f"\n❌ 比 baseline 慢超過 {opts.threshold} 倍：")
+        for scale, name, old, new in regressions:
+            print(f"  {scale:<8}{name:<48}{old:>8.2f}s → {new:.2f}s")
+        sys.exit(1)
+
+    print(f"\n🎉 bench 完成（{rev}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+stage 快取（content hash）
+
+fingerprint = 腳本原始碼（SQL、參數都寫在裡面）
+            + 腳本用到的 pipeline 模組原始碼（包含那些模組再 import 的）
+            + 有用到 timeslot 的話，這次的區塊設定
+            + 上游 stage 檔記錄的 fingerprint（1_0 則是原始 data.db 的摘要）
+
+stage 跑完把 fingerprint 寫進自己的 _stage_meta；下次算出來一樣就直接沿用。
+上游重跑過 fingerprint 就會變，下游跟著失效，所以只改 ver_4 的 SQL 時，
+ver_1 / ver_3 都不用重算。
+"""
+import ast
+import hashlib
+import sqlite3
+from pathlib import Path
+
+from pipeline import stage_db, timeslot
+
+FINGERPRINT_KEY = "fingerprint"
+
+PIPELINE_PATH = Path(__file__).resolve().parent
+
+
+def _pipeline_imports(source):
+    """
+    原始碼裡 from pipeline import xxx / from pipeline.xxx import ... 的模組名稱
+    """
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if not isinstance(node, ast.ImportFrom):
+            continue
+        if node.module == "pipeline":
+            names.update(alias.name for alias in node.names)
+        elif node.module and node.module.startswith("pipeline."):
+            names.add(node.module.split(".")[1])
+    return names
+
+
+def _pipeline_closure(source):
+    """
+    腳本直接和間接用到的 pipeline 模組（例如 flags → quantiles → stage_db）
+    """
+    seen = set()
+    todo = _pipeline_imports(source)
+    while todo:
+        name = todo.pop()
+        module = PIPELINE_PATH / f"{name}.py"
+        if name in seen or not module.exists():
+            continue
+        seen.add(name)
+        todo |= _pipeline_imports(module.read_text(encoding="utf-8"))
+    return sorted(seen)
+
+
+def script_digest(script):
+    """
+    腳本 + 它直接和間接用到的 pipeline 模組
+    """
+    h = hashlib.sha256()
+    source = Path(script).read_text(encoding="utf-8")
+    h.update(source.encode("utf-8"))
+
+    modules = _pipeline_closure(source)
+    for name in modules:
+        module = PIPELINE_PATH / f"{name}.py"
+        h.update(name.encode("utf-8"))
+        h.update(module.read_bytes())
+
+    # --bucket / --agg 換了要重跑
+    if "timeslot" in modules:
+        h.update(str(timeslot.current()).encode("utf-8"))
+
+    return h.hexdigest()
+
+
+def raw_digest(db_path):
+    """
+    原始資料庫的摘要：各表的 schema、筆數、最大 rowid
+    爬蟲只會往後加資料，這樣就夠判斷有沒有變；手動改過舊資料請用 --force
+    """
+    h = hashlib.sha256()
+    conn = sqlite3.connect(stage_db._ro_uri(db_path), uri=True)
+    try:
+        tables = conn.execute("""
+            SELECT name, sql
+            FROM sqlite_master
+            WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+            ORDER BY name
+        """).fetchall()
+
+        for name, sql in tables:
+            count, max_id = conn.execute(
+                f'SELECT COUNT(*), MAX(rowid) FROM "{name}"'
+            ).fetchone()
+            h.update(f"{name}\n{sql}\n{count}\n{max_id}\n".encode("utf-8"))
+    finally:
+        conn.close()
+
+    return h.hexdigest()
+
+
+def fingerprint(script, upstream):
+    """
+    upstream: 上游的 fingerprint（或 raw_digest）
+    上游有任何一個沒有 fingerprint（例如單獨手動跑過）就回傳 None，不使用快取
+    """
+    if any(fp is None for fp in upstream):
+        return None
+
+    h = hashlib.sha256()
+    h.update(script_digest(script).encode("utf-8"))
+    for fp in upstream:
+        h.update(fp.encode("utf-8"))
+    return h.hexdigest()
+
+
+def stored(dst_db):
+    """
+    stage 檔裡記錄的 fingerprint（檔案不存在回傳 None）
+    """
+    if not Path(dst_db).exists():
+        return None
+    return stage_db.read_meta(dst_db, FINGERPRINT_KEY)
+
+
+def is_fresh(dst_db, fp):
+    return fp is not None and stored(dst_db) == fp
+
+
+def mark(dst_db, fp):
+    if fp is not None:
+        stage_db.write_meta(dst_db, FINGERPRINT_KEY, fp)
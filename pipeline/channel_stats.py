@@ -0,0 +1,382 @@
+"""
+各頻道的統計量（channel_acc）
+
+channel_acc 存每個頻道、每種數值的 (筆數 n, 平均 mean, 離均差平方和 m2, 最小, 最大)，
+(n, mean, m2) 就是 Welford 演算法的狀態；兩份狀態可以用 Chan 的公式合併，
+也可以反過來扣掉一部分，所以：
+    新資料進來（增量更新）  accumulate：只掃新的那段 main，併進去
+    排除異常值（1_4 / 3_1） subtract：  只看被標記的那幾筆，扣出來
+都不用重掃整張 main。變異數 = m2 / n，不會像 E[x²] − E[x]² 那樣相減變成負數。
+最小 / 最大扣不回來，被排除的剛好是邊界時，只對那些頻道回 main 重查一次。
+
+每個平台（platforms.PLATFORMS）兩種數值（都是 *_number != 0 的那幾筆，ln 再限定觀看數 > 0）：
+    yt      youtube        yt_ln   ln(youtube)
+    tw      twitch         tw_ln   ln(twitch)
+欄位 / SQL 都依平台清單產生，main 一樣只掃一次（每個平台一欄）。
+
+channel_acc 的來源：
+    1_3  掃 data_1_2 的 main 建立
+    1_4  複製 1_3 的，扣掉標記的異常值（1_5 直接用這份）
+    3_1  複製 1_3 的（只留 3_0 main 裡的子午頻道），扣掉標記的異常值
+
+重建 channel_avg 的 stage（1_3 / 1_5 / 3_1）一律 JOIN STATS_SQL，
+從裡面拿筆數 / 平均 / 標準差 / ln 平均 / ln 標準差 / 幾何平均。
+"""
+import numpy as np
+
+from pipeline import platforms
+
+# 每個平台兩種數值：<key>（觀看數）、<key>_ln（ln 觀看數）
+METRICS = tuple(f"{key}{suffix}" for key in platforms.KEYS for suffix in ("", "_ln"))
+FIELDS = ("n", "mean", "m2", "min", "max")
+
+CHUNK_ROWS = 1_000_000
+
+
+def _acc_columns(p):
+    return f"""
+    {p.key}_n        INTEGER NOT NULL,   -- {p.stream_id} != 0 的筆數
+    {p.key}_mean     REAL,               -- n = 0 時 mean / min / max 為 NULL
+    {p.key}_m2       REAL NOT NULL,      -- Σ(x − mean)²
+    {p.key}_min      REAL,
+    {p.key}_max      REAL,
+    {p.key}_ln_n     INTEGER NOT NULL,   -- 其中 {p.viewers} > 0 的筆數
+    {p.key}_ln_mean  REAL,
+    {p.key}_ln_m2    REAL NOT NULL,
+    {p.key}_ln_min   REAL,
+    {p.key}_ln_max   REAL"""
+
+
+_ACC_COLUMNS_SQL = ",\n".join(_acc_columns(p) for p in platforms.PLATFORMS)
+
+ACC_SCHEMA = f"""
+CREATE TABLE channel_acc (
+    channel_id TEXT PRIMARY KEY,
+{_ACC_COLUMNS_SQL}
+);
+"""
+
+ACC_COLUMNS = [f"{m}_{f}" for m in METRICS for f in FIELDS]
+
+
+def _stats_columns(key):
+    return f"""
+    {key}_n,
+    {key}_mean,
+    sqrt({key}_m2 / NULLIF({key}_n, 0))       AS {key}_std,
+    {key}_min,
+    {key}_max,
+    {key}_ln_mean,
+    sqrt({key}_ln_m2 / NULLIF({key}_ln_n, 0)) AS {key}_ln_std,
+    exp({key}_ln_mean)                     AS {key}_geo_mean"""
+
+
+_STATS_COLUMNS_SQL = ",\n".join(_stats_columns(key) for key in platforms.KEYS)
+
+# 由 channel_acc 算出的統計值（母體標準差；沒資料的是 NULL），finalize 的 SQL 直接 JOIN 這個
+STATS_SQL = f"""
+SELECT
+    channel_id,
+{_STATS_COLUMNS_SQL}
+FROM channel_acc
+"""
+
+# 每筆 main 要看的值（每個平台一欄，欄名是平台的 key）：沒開台的平台是 NULL
+VALUES_SQL = ",\n".join(
+    f"    {platforms.value_sql(p, '{p}')} AS {p.key}" for p in platforms.PLATFORMS
+)
+
+
+def create_acc(conn):
+    """
+    在本 stage 建立空的 channel_acc（上游若已有同名表，改用本地這份）
+    """
+    conn.rebuild("channel_acc")
+    conn.execute(ACC_SCHEMA)
+
+
+def copy_acc(conn, where=None):
+    """
+    把上游的 channel_acc 複製成本 stage 的（之後 subtract / accumulate 改本地這份）
+    where: 只複製符合的頻道（條件裡的表名指向上游）
+    """
+    upstream = conn.upstream_table("channel_acc")
+    create_acc(conn)
+
+    cols = ", ".join(ACC_COLUMNS)
+    cur = conn.execute(f"""
+        INSERT INTO main.channel_acc (channel_id, {cols})
+        SELECT channel_id, {cols} FROM {upstream}
+        {"" if where is None else f"WHERE {where}"}
+    """)
+    return cur.rowcount
+
+
+def moments(inverse, n_groups, x):
+    """
+    依分組算 (n, mean, m2, min, max)：先算每組平均，再加總離均差平方（兩段式，數值穩定）
+    inverse: 每筆資料屬於第幾組
+    return: shape (5, n_groups)，沒資料的組 min / max 是 NaN
+    """
+    n = np.bincount(inverse, minlength=n_groups).astype(float)
+    total = np.bincount(inverse, weights=x, minlength=n_groups)
+    mean = np.divide(total, n, out=np.zeros(n_groups), where=n > 0)
+    d = x - mean[inverse]
+    m2 = np.bincount(inverse, weights=d * d, minlength=n_groups)
+
+    lo = np.full(n_groups, np.inf)
+    hi = np.full(n_groups, -np.inf)
+    np.minimum.at(lo, inverse, x)
+    np.maximum.at(hi, inverse, x)
+    empty = n == 0
+    lo[empty] = hi[empty] = np.nan
+
+    return np.array([n, mean, m2, lo, hi])
+
+
+def merge(a, b):
+    """
+    合併兩份狀態（Chan et al. 的平行版 Welford），任一邊 n = 0 也可以
+    """
+    na, ma, m2a, lo_a, hi_a = a
+    nb, mb, m2b, lo_b, hi_b = b
+    n = na + nb
+    w = np.divide(nb, n, out=np.zeros(len(n)), where=n > 0)
+    delta = mb - ma
+    return np.array([
+        n,
+        ma + delta * w,
+        m2a + m2b + delta * delta * na * w,
+        np.fmin(lo_a, lo_b),
+        np.fmax(hi_a, hi_b),
+    ])
+
+
+def unmerge(total, part):
+    """
+    merge 的反運算：total 扣掉 part（part 必須是 total 的一部分）
+    min / max 原樣留著，邊界有沒有被扣到由呼叫端判斷
+    """
+    n, mean, m2, lo, hi = total
+    nb, mb, m2b, _, _ = part
+    na = n - nb
+    ma = np.divide(n * mean - nb * mb, na, out=np.zeros(len(n)), where=na > 0)
+    delta = mb - ma
+    w = np.divide(na * nb, n, out=np.zeros(len(n)), where=n > 0)
+    # 相減會有捨入誤差，剩很少筆時可能變成極小的負數
+    m2a = np.maximum(m2 - m2b - delta * delta * w, 0)
+
+    empty = na == 0
+    m2a[empty] = 0
+    lo, hi = lo.copy(), hi.copy()
+    lo[empty] = hi[empty] = np.nan
+    return np.array([na, ma, m2a, lo, hi])
+
+
+def _group_moments(group, values, n_groups):
+    """
+    一批資料（組別, 各平台的值）→ {數值: shape (5, n_groups)}
+    """
+    out = {}
+    for col, prefix in enumerate(platforms.KEYS):
+        x = values[:, col]
+        on = ~np.isnan(x)
+        x, g = x[on], group[on]
+
+        pos = x > 0
+        out[prefix] = moments(g, n_groups, x)
+        out[f"{prefix}_ln"] = moments(g[pos], n_groups, np.log(x[pos]))
+    return out
+
+
+def _read_acc(conn):
+    """
+    目前的 channel_acc → (頻道 → 第幾欄, {數值: shape (5, 頻道數)})
+    """
+    if "channel_acc" in getattr(conn, "sources", ()):
+        raise RuntimeError("channel_acc 還在上游，請完整跑一次 pipeline")
+
+    have = {row[1] for row in conn.execute("PRAGMA main.table_info(channel_acc)")}
+    if not have.issuperset(ACC_COLUMNS):
+        raise RuntimeError("channel_acc 是舊的格式，請完整跑一次 pipeline")
+
+    rows = conn.execute(
+        f"SELECT channel_id, {', '.join(ACC_COLUMNS)} FROM main.channel_acc"
+    ).fetchall()
+
+    index = {row[0]: i for i, row in enumerate(rows)}
+    table = np.array([row[1:] for row in rows], dtype=float)
+    table = table.reshape(len(rows), len(ACC_COLUMNS))
+
+    k = len(FIELDS)
+    state = {}
+    for j, m in enumerate(METRICS):
+        s = table[:, k * j:k * j + k].T.copy()
+        s[1] = np.nan_to_num(s[1])     # mean 的 NULL（n = 0）當 0，合併時權重是 0
+        state[m] = s
+    return index, state
+
+
+def _grow(index, state):
+    grow = len(index) - state[METRICS[0]].shape[1]
+    if not grow:
+        return state
+
+    pad = np.zeros((len(FIELDS), grow))
+    pad[3:] = np.nan
+    return {m: np.hstack([s, pad]) for m, s in state.items()}
+
+
+def accumulate(conn, window, on_chunk=None):
+    """
+    把 window 內 main 的各頻道統計量併進 channel_acc（可以一直往上加）
+
+    main 只掃一次：頻道先換成整數編號（TEMP 表），分批把 (編號, 各平台的值) 讀進
+    NumPy，每批依頻道算統計量，再跟 channel_acc 原本的狀態合併
+
+    on_chunk(names, group, values): 同一批資料還要做別的統計時用（例如 quantiles.Sketch.add），
+                                    group 是 names 的編號，values 每個平台一欄，沒開台是 NaN
+    """
+    index, state = _read_acc(conn)
+
+    conn.execute("DROP TABLE IF EXISTS temp.acc_channel")
+    conn.execute("""
+        CREATE TEMP TABLE acc_channel (
+            k       INTEGER PRIMARY KEY,
+            channel TEXT NOT NULL UNIQUE
+        )
+    """)
+    conn.execute(f"""
+        INSERT INTO temp.acc_channel (channel)
+        SELECT DISTINCT channel FROM main WHERE {window.where_ts()}
+    """)
+
+    names = [name for (name,) in conn.execute(
+        "SELECT channel FROM temp.acc_channel ORDER BY k"
+    )]
+    slots = np.array([index.setdefault(name, len(index)) for name in names], dtype=int)
+    state = _grow(index, state)
+
+    cur = conn.execute(f"""
+        SELECT
+            c.k - 1,
+            {VALUES_SQL.format(p="m.")}
+        FROM main m
+        JOIN temp.acc_channel c
+            ON c.channel = m.channel
+        WHERE {window.where_ts("m.")}
+    """)
+
+    while rows := cur.fetchmany(CHUNK_ROWS):
+        chunk = np.array(rows, dtype=float)
+        group = chunk[:, 0].astype(int)
+        part = _group_moments(group, chunk[:, 1:], len(names))
+        for m in METRICS:
+            state[m][:, slots] = merge(state[m][:, slots], part[m])
+        if on_chunk is not None:
+            on_chunk(names, group, chunk[:, 1:])
+
+    conn.execute("DROP TABLE temp.acc_channel")
+    _write_acc(conn, index, state, slots)
+
+
+def subtract(conn, rows):
+    """
+    rows: 已經從 main 排除（軟刪除）的 (channel, 各平台的值)；從 channel_acc 扣掉
+    """
+    index, state = _read_acc(conn)
+
+    names = sorted({row[0] for row in rows})
+    missing = [name for name in names if name not in index]
+    if missing:
+        raise RuntimeError(f"channel_acc 沒有這些頻道，無法扣除：{missing[:5]}")
+
+    local = {name: i for i, name in enumerate(names)}
+    group = np.array([local[row[0]] for row in rows], dtype=int)
+    values = np.array([row[1:] for row in rows], dtype=float)
+    part = _group_moments(group, values, len(names))
+
+    slots = np.array([index[name] for name in names], dtype=int)
+    edge = np.zeros(len(names), dtype=bool)
+    for m in METRICS:
+        before = state[m][:, slots]
+        state[m][:, slots] = unmerge(before, part[m])
+        # 排除的剛好是最小 / 最大值，邊界要重查
+        edge |= (part[m][3] <= before[3]) | (part[m][4] >= before[4])
+
+    if edge.any():
+        _refresh_edges(conn, state, slots[edge], [n for n, e in zip(names, edge) if e])
+
+    _write_acc(conn, index, state, slots)
+
+
+def _refresh_edges(conn, state, slots, names):
+    """
+    對 names 這幾個頻道回 main 重查最小 / 最大（走 (channel, …) 開頭的 index）
+    """
+    marks = ", ".join("?" * len(names))
+    bounds = []
+    for p in platforms.PLATFORMS:
+        raw = p.viewers
+        on = f"{p.stream_id} != 0"
+        bounds += [
+            f"MIN(CASE WHEN {on} THEN {raw} END)",
+            f"MAX(CASE WHEN {on} THEN {raw} END)",
+            f"MIN(CASE WHEN {on} AND {raw} > 0 THEN {raw} END)",
+            f"MAX(CASE WHEN {on} AND {raw} > 0 THEN {raw} END)",
+        ]
+    found = {
+        row[0]: row[1:]
+        for row in conn.execute(f"""
+            SELECT
+                channel,
+                {", ".join(bounds)}
+            FROM main
+            WHERE channel IN ({marks})
+            GROUP BY channel
+        """, names)
+    }
+
+    # 每個數值一組 (最小, 最大)，順序跟 METRICS 一樣
+    width = 2 * len(METRICS)
+    edges = np.array(
+        [found.get(name, (None,) * width) for name in names], dtype=float
+    ).reshape(len(names), width)
+    ln = [2 * j + i for j, m in enumerate(METRICS) if m.endswith("_ln") for i in (0, 1)]
+    edges[:, ln] = np.log(edges[:, ln])
+
+    for j, m in enumerate(METRICS):
+        state[m][3, slots] = edges[:, 2 * j]
+        state[m][4, slots] = edges[:, 2 * j + 1]
+
+
+def _write_acc(conn, index, state, slots):
+    """
+    把 slots 這幾個頻道的狀態寫回 channel_acc
+    """
+    if len(slots) == 0:
+        return
+    names = sorted(index, key=index.get)
+
+    cols = []
+    for m in METRICS:
+        n, mean, m2, lo, hi = state[m][:, slots]
+        has = n > 0
+        cols += [
+            n.astype(np.int64).tolist(),
+            np.where(has, mean, np.nan).tolist(),
+            m2.tolist(),
+            np.where(has, lo, np.nan).tolist(),
+            np.where(has, hi, np.nan).tolist(),
+        ]
+
+    rows = [
+        (names[i], *(None if v != v else v for v in values))   # NaN → NULL
+        for i, *values in zip(slots.tolist(), *cols)
+    ]
+    marks = ", ".join("?" * (1 + len(ACC_COLUMNS)))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO main.channel_acc (channel_id, {', '.join(ACC_COLUMNS)}) "
+        f"VALUES ({marks})",
+        rows
+    )
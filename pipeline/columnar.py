@@ -0,0 +1,280 @@
+"""
+Parquet 匯出 / 讀取（notebook、dashboard 用）
+
+pd.read_sql 一列一列從 SQLite 轉成 Python 物件再組回欄位，資料一多就很慢。
+這裡把常用的表匯出成 Parquet（欄式、每個欄位分開壓縮），讀的時候只讀要的欄位、
+只讀條件可能符合的 row group，直接是 Arrow 的欄位，轉 pandas 不用逐列轉換。
+
+    python -m pipeline.columnar [資料集 ...] [--out parquet/] [--since 2025-12]
+
+    OUT/<資料集>/month=2025-12/platform=yt/part-0.parquet   （hive 分割）
+
+資料集（DATASETS）：
+    main              1_5 的 main（過濾異常值之後，2_x 用的那份），長格式：一個有開台的平台一列
+    channel_avg       1_5 的 channel_avg
+    stream_analysis   stream_ana 的每場統計，platform 換成平台 key
+    time_profile      2_1 / 2_2 的 *_time_profile（全部頻道），接成一張、多 platform 欄
+    only_time_profile 3_2 的 *_time_profile（子午）
+    time_global_profile  3_2 的 time_global_profile
+
+有 month 的資料集依 (month, platform) 分資料夾，同一個檔裡依 (channel, ts) 排好，
+每 ROW_GROUP_ROWS 筆一個 row group：指定月份 / 平台只打開那幾個資料夾，
+指定頻道靠 row group 的 min / max 跳過不相干的。channel 存成 dictionary
+（每個檔只存一次頻道 id，讀成 pandas 是 category）。
+
+--since YYYY-MM 只重寫那個月之後的分割（爬蟲只會往後加資料），
+其他資料集很小，每次整個重寫。
+
+pyarrow 不是 pipeline 的必要套件，只有用到這裡才需要：pip install pyarrow
+"""
+import argparse
+import shutil
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from pipeline import platforms, stage_db, timeslot
+from pipeline.stages import ROOT_PATH
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+DEFAULT_OUT = ROOT_PATH / "parquet"
+
+CHUNK_ROWS = 1_000_000
+ROW_GROUP_ROWS = 64 * 1024
+
+# 讀成 dictionary 的欄位
+DICTIONARY_COLUMNS = ("channel", "channel_id", "channel_name")
+
+
+class Source(NamedTuple):
+    db: str     # 相對於 repo 的 stage 檔
+    sql: str    # {since} 換成 --since 的條件（沒給是 1）
+
+
+class Dataset(NamedTuple):
+    sources: tuple
+    partition: tuple      # 分割欄位（month 要由 SQL 算出來）
+    sort: tuple           # 檔內排序（row group 的 min / max 才有用）
+
+
+def _profile_sources(db, keys):
+    return tuple(
+        Source(db, f"""
+            SELECT '{key}' AS platform, channel_id, channel_name, time,
+                   live_count, avg_viewers, diff_percent
+            FROM {key}_time_profile
+        """)
+        for key in keys
+    )
+
+
+DATASETS = {
+    "main": Dataset(
+        (Source("ver_1/data_1_5.db", """
+            SELECT
+                substr(date, 1, 7) AS month,
+                platform, channel, stream_id, date, time, ts, slot, viewers
+            FROM obs
+            WHERE {since}
+        """),),
+        partition=("month", "platform"),
+        sort=("channel", "ts"),
+    ),
+    "channel_avg": Dataset(
+        (Source("ver_1/data_1_5.db", "SELECT * FROM channel_avg"),),
+        partition=(),
+        sort=("channel_id",),
+    ),
+    "stream_analysis": Dataset(
+        (Source("ver_100/data_3_0.db", """
+            SELECT
+                substr(s.start_time, 1, 7) AS month,
+                p.platform, s.stream_id, s.channel,
+                s.start_time, s.end_time,
+                s.avg_viewers, s.max_viewers, s.max_time, s.min_viewers, s.min_time,
+                s.expected_points, s.actual_points, s.missing_points
+            FROM stream_analysis s
+            JOIN temp.platform p
+                ON p.label = s.platform
+            WHERE {since}
+        """),),
+        partition=("month", "platform"),
+        sort=("channel", "start_time"),
+    ),
+    "time_profile": Dataset(
+        _profile_sources("ver_2/data_2_1.db", ("yt",))
+        + _profile_sources("ver_2/data_2_2.db", ("tw",)),
+        partition=("platform",),
+        sort=("channel_id", "time"),
+    ),
+    "only_time_profile": Dataset(
+        _profile_sources("ver_3/data_3_2.db", platforms.KEYS),
+        partition=("platform",),
+        sort=("channel_id", "time"),
+    ),
+    "time_global_profile": Dataset(
+        (Source("ver_3/data_3_2.db", "SELECT * FROM time_global_profile"),),
+        partition=(),
+        sort=("time",),
+    ),
+}
+
+# --since 的條件（依資料集的時間欄位）
+SINCE_SQL = {
+    "main": "ts >= {ts}",
+    "stream_analysis": "s.start_time >= '{start}'",
+}
+
+
+def _require():
+    if pa is None:
+        raise ImportError("匯出 / 讀取 Parquet 需要 pyarrow：pip install pyarrow")
+
+
+def _partitioning(spec):
+    return ds.partitioning(
+        pa.schema([(col, pa.string()) for col in spec.partition]),
+        flavor="hive",
+    )
+
+
+def _read_source(source, since):
+    """
+    一個 Source → Arrow table（分批讀 cursor，一批轉成一組欄位）
+    """
+    conn = stage_db.connect(ROOT_PATH / source.db)
+    try:
+        platforms.register(conn)
+        cur = conn.execute(source.sql.format(since=since))
+        names = [d[0] for d in cur.description]
+        batches = []
+        while rows := cur.fetchmany(CHUNK_ROWS):
+            batches.append(pa.table(dict(zip(names, map(list, zip(*rows))))))
+    finally:
+        conn.close()
+
+    if not batches:
+        return None
+    return pa.concat_tables(batches, promote_options="permissive")
+
+
+def _encode(table):
+    """
+    頻道欄位轉成 dictionary
+    """
+    for i, name in enumerate(table.column_names):
+        if name in DICTIONARY_COLUMNS:
+            table = table.set_column(i, name, pc.dictionary_encode(table.column(i)))
+    return table
+
+
+def export(name, out_dir=DEFAULT_OUT, since=None):
+    """
+    把資料集 name 寫到 out_dir/name；since（YYYY-MM）只重寫那個月之後的分割
+    return: 寫了幾筆
+    """
+    _require()
+    spec = DATASETS[name]
+    target = Path(out_dir) / name
+
+    since_sql = "1"
+    if since is not None and name in SINCE_SQL:
+        since_sql = SINCE_SQL[name].format(
+            ts=timeslot.to_ts(f"{since}-01 00:00"), start=f"{since}-01"
+        )
+    elif target.exists():
+        shutil.rmtree(target)
+
+    parts = [_read_source(source, since_sql) for source in spec.sources]
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return 0
+
+    table = pa.concat_tables(parts, promote_options="permissive")
+    table = _encode(table.sort_by([(col, "ascending") for col in spec.partition + spec.sort]))
+
+    ds.write_dataset(
+        table,
+        target,
+        format="parquet",
+        partitioning=_partitioning(spec) if spec.partition else None,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        min_rows_per_group=min(ROW_GROUP_ROWS, max(1, len(table))),
+        max_rows_per_group=ROW_GROUP_ROWS,
+    )
+    return len(table)
+
+
+def dataset(name, out_dir=DEFAULT_OUT):
+    """
+    資料集 name 的 pyarrow.dataset（還沒讀任何資料）
+    """
+    _require()
+    spec = DATASETS[name]
+    return ds.dataset(
+        Path(out_dir) / name,
+        format="parquet",
+        partitioning=_partitioning(spec) if spec.partition else None,
+    )
+
+
+def load(name, columns=None, months=None, platform=None, channels=None,
+         where=None, out_dir=DEFAULT_OUT):
+    """
+    讀資料集 name 成 Arrow table，只讀 columns 這些欄位
+
+    months    ["2025-12", ...]：只打開這幾個月的分割
+    platform  "yt" / ["yt", "tw"]
+    channels  頻道 id 的 list（用 row group 的 min / max 跳過）
+    where     其他 pyarrow.compute 的條件，會跟上面的 AND 起來
+
+        df = columnar.load("main", ["channel", "ts", "viewers"], platform="yt").to_pandas()
+    """
+    data = dataset(name, out_dir)
+
+    conds = [] if where is None else [where]
+    if months is not None:
+        conds.append(pc.field("month").isin(list(months)))
+    if platform is not None:
+        keys = [platform] if isinstance(platform, str) else list(platform)
+        conds.append(pc.field("platform").isin(keys))
+    if channels is not None:
+        col = "channel_id" if "channel_id" in data.schema.names else "channel"
+        conds.append(pc.field(col).isin(list(channels)))
+
+    cond = None
+    for c in conds:
+        cond = c if cond is None else cond & c
+    return data.to_table(columns=columns, filter=cond)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="匯出 Parquet")
+    parser.add_argument("names", nargs="*", help=f"資料集（預設全部）：{', '.join(DATASETS)}")
+    parser.add_argument("--out", default=str(DEFAULT_OUT))
+    parser.add_argument("--since", help="YYYY-MM：有分月份的資料集只重寫這個月之後")
+    opts = parser.parse_args()
+
+    names = opts.names or list(DATASETS)
+    for name in names:
+        if name not in DATASETS:
+            raise SystemExit(f"沒有這個資料集：{name}")
+
+    _require()
+    print(f"📦 匯出 Parquet → {opts.out}")
+    for name in names:
+        t0 = time.perf_counter()
+        rows = export(name, opts.out, opts.since)
+        print(f"  ✅ {name}：{rows:,} 筆（{time.perf_counter() - t0:.1f}s）")
+    print("🎉 完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+頻道 × 日期 × 時段的觀看數立方體（memory-mapped .npy）
+
+time_profile / 4_0 / 4_1 問的都是同一個格子上的問題：某頻道某天某個時段有沒有開台、
+多少人看。SQL 每問一次就要 GROUP BY 一次；這裡把一個 stage 的 main 一次攤成
+稠密陣列，之後的統計都是沿著某幾個軸的向量化化簡。
+
+    OUT/
+        index.json       來源、區塊寬度、channels / dates / times（各軸的標籤）、平台
+        yt.npy           float32 (頻道, 日期, 時段) 的平均觀看數，沒開台是 NaN（看資料用）
+        yt_n.npy         該格的筆數 / 觀看數總和（化簡都用這兩個，結果跟 SQL 一樣）
+        yt_sum.npy
+        yt_ln_n.npy      觀看數 > 0 的 ln 筆數 / 總和（幾何平均用）
+        yt_ln_sum.npy
+        tw*.npy
+        live_n.npy       該格有幾筆有開台（任一平台），跟 4_0 的 live_count 一樣算筆數
+
+同一格可能有好幾筆（同一個區塊換了 stream、重複寫入），所以存的是筆數和總和，
+不是一個值：profile / concurrency / 幾何平均都跟 SQL 用同樣的筆數。
+日期軸是來源 main 第一天到最後一天的每一天（沒資料的日子整天都是 NaN / 0）。
+讀的是 stage_db.connect 看到的 main，軟刪除的列不算：
+1_5 的 main 是 2_x 用的那份，3_1 的是 3_2 / 4_x 用的那份。
+
+    python -m pipeline.cube ver_3/data_3_1.db [--out DIR] [--overwrite]
+
+    c = cube.Cube("ver_1/data_1_5.cube")
+    c.profile("yt")        # (頻道, 時段) 的 (筆數, 平均)，同 2_1 的 yt_time_acc
+    c.concurrency()        # (日期, 時段) 的筆數，3_1 的 cube 同 4_0 的 live_count
+    c.geo_mean("yt", ("channel", "date"))   # 各時段的幾何平均
+
+建立時每個陣列直接寫進 memmap 檔，化簡一次讀 BLOCK_CHANNELS 個頻道，
+各塊的 (筆數, 總和) 直接相加；記憶體只跟一批 / 一塊的大小有關，不會整個陣列讀進來。
+"""
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pipeline import platforms, stage_db
+
+AXES = ("channel", "date", "slot")
+
+DAY_MINUTES = 24 * 60
+
+CHUNK_ROWS = 1_000_000
+BLOCK_CHANNELS = 64
+
+INDEX_FILE = "index.json"
+
+# 每個平台的統計量陣列（檔名是 {平台 key}_{欄位}.npy）
+MOMENTS = {
+    "n": np.uint16,
+    "sum": np.float64,
+    "ln_n": np.uint16,
+    "ln_sum": np.float64,
+}
+LIVE = "live_n"
+
+
+def default_out(db_path):
+    """
+    data_3_1.db → 同一個資料夾的 data_3_1.cube/
+    """
+    return Path(db_path).with_suffix(".cube")
+
+
+def _add(grid, cells, values):
+    """
+    cells（不重複）這幾格加上 values
+    """
+    flat = grid.reshape(-1)
+    flat[cells] += values.astype(grid.dtype)
+
+
+def build(db_path, out_dir):
+    """
+    db_path 的 main → out_dir 的 index.json + 各陣列
+    """
+    out_dir = Path(out_dir)
+    conn = stage_db.connect(db_path)
+    try:
+        minutes = conn.execute("SELECT minutes FROM time_bucket").fetchone()[0]
+        times = [t for (t,) in conn.execute("SELECT time FROM time_slots ORDER BY slot")]
+        channels = [c for (c,) in conn.execute("SELECT DISTINCT channel FROM main ORDER BY channel")]
+        lo, hi = conn.execute("SELECT MIN(ts), MAX(ts) FROM main").fetchone()
+        if lo is None:
+            raise ValueError(f"{db_path} 的 main 是空的")
+
+        day0 = lo // DAY_MINUTES
+        n_days = hi // DAY_MINUTES - day0 + 1
+        dates = np.datetime_as_string(
+            np.arange(day0, day0 + n_days).astype("datetime64[D]")
+        ).tolist()
+        shape = (len(channels), n_days, len(times))
+        names = np.array(channels, dtype=object)
+
+        # 新建的 memmap 檔內容都是 0
+        out_dir.mkdir(parents=True)
+        grids = {
+            f"{p.key}_{field}": np.lib.format.open_memmap(
+                out_dir / f"{p.key}_{field}.npy", mode="w+", dtype=dtype, shape=shape
+            )
+            for p in platforms.PLATFORMS
+            for field, dtype in MOMENTS.items()
+        }
+        grids[LIVE] = np.lib.format.open_memmap(
+            out_dir / f"{LIVE}.npy", mode="w+", dtype=np.uint16, shape=shape
+        )
+
+        # 一次掃 main，每個平台一個值欄（沒開台是 NULL）
+        values = ", ".join(platforms.value_sql(p) for p in platforms.PLATFORMS)
+        on_any = " OR ".join(f"{p.stream_id} != 0" for p in platforms.PLATFORMS)
+        cur = conn.execute(f"SELECT channel, ts, {values} FROM main WHERE {on_any}")
+        while rows := cur.fetchmany(CHUNK_ROWS):
+            channel, ts, *cols = zip(*rows)
+            ts = np.array(ts, dtype=np.int64)
+            cell = (
+                np.searchsorted(names, np.array(channel, dtype=object)) * n_days
+                + (ts // DAY_MINUTES - day0)
+            ) * len(times) + (ts % DAY_MINUTES) // minutes
+            cells, inv = np.unique(cell, return_inverse=True)
+            _add(grids[LIVE], cells, np.bincount(inv, minlength=len(cells)))
+
+            for p, col in zip(platforms.PLATFORMS, cols):
+                x = np.array(col, dtype=np.float64)      # NULL → NaN
+                live = ~np.isnan(x)
+                pos = live & (np.where(live, x, 0) > 0)
+                for field, weights, where in (
+                    ("n", None, live),
+                    ("sum", x, live),
+                    ("ln_n", None, pos),
+                    ("ln_sum", np.log(x, where=pos, out=np.zeros_like(x)), pos),
+                ):
+                    _add(grids[f"{p.key}_{field}"], cells, np.bincount(
+                        inv[where],
+                        weights=None if weights is None else weights[where],
+                        minlength=len(cells),
+                    ))
+
+        # 看資料用的平均（NaN = 沒開台），一塊一塊算
+        for p in platforms.PLATFORMS:
+            mean = np.lib.format.open_memmap(
+                out_dir / f"{p.key}.npy", mode="w+", dtype=np.float32, shape=shape
+            )
+            n, s = grids[f"{p.key}_n"], grids[f"{p.key}_sum"]
+            cells = 0
+            for lo in range(0, len(channels), BLOCK_CHANNELS):
+                part = slice(lo, lo + BLOCK_CHANNELS)
+                live = n[part] > 0
+                cells += int(live.sum())
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    mean[part] = np.where(live, s[part] / n[part], np.nan)
+            mean.flush()
+            del mean
+            print(f"  ✅ {p.label}：{cells:,} 格有開台")
+
+        for grid in grids.values():
+            grid.flush()
+        del grids
+    finally:
+        conn.close()
+
+    index = {
+        "source": str(Path(db_path).resolve()),
+        "minutes": minutes,
+        "platforms": list(platforms.KEYS),
+        "channels": channels,
+        "dates": dates,
+        "times": times,
+    }
+    (out_dir / INDEX_FILE).write_text(
+        json.dumps(index, ensure_ascii=False, indent=1), encoding="utf-8"
+    )
+    return out_dir
+
+
+class Cube:
+    """
+    build 的結果（唯讀 memory-map）
+
+    channels / dates / times 是各軸的標籤，viewers[平台 key] 是 (頻道, 日期, 時段) 的平均
+    （NaN = 沒開台），arrays 是化簡用的統計量陣列（{key}_n、{key}_sum…、live_n）。
+    化簡的 axes 用軸名（AXES），回傳的陣列依序保留沒被化簡的軸；
+    channels 可以只算某幾個頻道（名稱的 list，例如子午的頻道）。
+    """
+
+    def __init__(self, out_dir):
+        out_dir = Path(out_dir)
+        index = json.loads((out_dir / INDEX_FILE).read_text(encoding="utf-8"))
+        self.source = index["source"]
+        self.minutes = index["minutes"]
+        self.channels = np.array(index["channels"], dtype=object)
+        self.dates = np.array(index["dates"])
+        self.times = np.array(index["times"])
+
+        def load(name):
+            return np.load(out_dir / f"{name}.npy", mmap_mode="r")
+
+        self.viewers = {key: load(key) for key in index["platforms"]}
+        self.arrays = {
+            f"{key}_{field}": load(f"{key}_{field}")
+            for key in index["platforms"]
+            for field in MOMENTS
+        }
+        self.arrays[LIVE] = load(LIVE)
+
+    @property
+    def shape(self):
+        return (len(self.channels), len(self.dates), len(self.times))
+
+    def rows(self, channels=None):
+        """
+        頻道名稱 → 第幾列（None = 全部）
+        """
+        if channels is None:
+            return np.arange(len(self.channels))
+        rows = np.searchsorted(self.channels, np.array(channels, dtype=object))
+        rows = np.minimum(rows, len(self.channels) - 1)
+        missing = self.channels[rows] != np.array(channels, dtype=object)
+        if missing.any():
+            raise KeyError(f"cube 裡沒有這些頻道：{list(np.array(channels)[missing])}")
+        return rows
+
+    def _reduce(self, names, axes, channels):
+        """
+        arrays 裡 names 這幾個陣列沿 axes 加總；一次讀一塊頻道，
+        化簡掉頻道軸就各塊相加，沒有就依序接起來
+        """
+        axes = tuple(AXES.index(a) for a in axes)
+        rows = self.rows(channels)
+        if len(rows) == 0:
+            raise ValueError("沒有任何頻道")
+
+        parts = []
+        for lo in range(0, len(rows), BLOCK_CHANNELS):
+            part = rows[lo:lo + BLOCK_CHANNELS]
+            parts.append([
+                self.arrays[name][part].sum(axis=axes, dtype=np.float64)
+                for name in names
+            ])
+
+        if 0 in axes:
+            return [sum(cols) for cols in zip(*parts)]
+        return [np.concatenate(cols) for cols in zip(*parts)]
+
+    def moments(self, key, axes, channels=None, ln=False):
+        """
+        沿 axes 化簡的 (筆數, 總和)；ln=True 是觀看數 > 0 的 ln（同 time_profile 的 ln_n / ln_sum）
+        """
+        fields = ("ln_n", "ln_sum") if ln else ("n", "sum")
+        n, s = self._reduce([f"{key}_{f}" for f in fields], axes, channels)
+        return n.astype(np.int64), s
+
+    def mean(self, key, axes, channels=None):
+        """
+        沿 axes 的平均（沒有資料是 NaN）
+        """
+        n, s = self.moments(key, axes, channels)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return s / n
+
+    def geo_mean(self, key, axes, channels=None):
+        """
+        沿 axes 的幾何平均（只算觀看數 > 0 的筆）
+        """
+        n, s = self.moments(key, axes, channels, ln=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.exp(s / n)
+
+    def profile(self, key, channels=None):
+        """
+        各頻道各時段（跨日期）的 (筆數, 平均)，形狀 (頻道, 時段)
+        """
+        n, s = self.moments(key, ("date",), channels)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return n, s / n
+
+    def concurrency(self, channels=None):
+        """
+        每天每個時段有開台的筆數（任一平台），形狀 (日期, 時段)
+        跟 4_0 的 live_count 一樣：同一個頻道同一格有兩筆（換了 stream）算兩次
+        """
+        (n,) = self._reduce([LIVE], ("channel",), channels)
+        return n.astype(np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="頻道 × 日期 × 時段的觀看數立方體")
+    parser.add_argument("db", help="來源 stage 檔（例如 ver_3/data_3_1.db）")
+    parser.add_argument("--out", help="輸出資料夾（預設是同名的 .cube/）")
+    parser.add_argument("--overwrite", action="store_true")
+    opts = parser.parse_args()
+
+    out = Path(opts.out) if opts.out else default_out(opts.db)
+    if out.exists():
+        if not opts.overwrite:
+            raise FileExistsError(f"{out} 已存在（要覆蓋請加 --overwrite）")
+        shutil.rmtree(out)
+
+    print(f"🧊 建立 cube {opts.db} → {out}")
+    t0 = time.perf_counter()
+    build(opts.db, out)
+    print(f"🎉 完成（{time.perf_counter() - t0:.1f}s）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+main 的軟刪除（main_flags）
+
+異常值不再 DELETE 出 main，而是在 main_flags (id, flags) 記一筆，
+stage_db 接 main 的 TEMP VIEW 會排除 main_flags 裡的 id，所以下游看到的
+main 跟以前刪完的一樣，main 本身也不用整張搬進 1_4 / 3_1。
+
+flags 是排除原因的 bit，同一筆可以同時有好幾個原因：
+    YT_SIGMA_25  1_4  YT 超過 ±2.5σ（ln）
+    TW_SIGMA_25  1_4  TW 超過 ±2.5σ（ln）
+    YT_LOW_3     3_1  YT 低於 -3σ（ln）
+    TW_LOW_3     3_1  TW 低於 -3σ（ln）
+
+mark() 一次掃 window 內的 main，把所有規則的 z 分數一起算完，
+被標記的列連同 channel_stats 要扣的值一起回傳。
+
+規則的條件裡可以用：
+    {z}   ln 空間的 (x − 平均) / σ
+    {rz}  ln 空間的 (x − 中位數) / (1.4826 × MAD)，不受少數爆量影響
+          （avg_table 要有 1_3 channel_avg 的 *_ln_median / *_ln_mad）
+"""
+from pipeline import channel_stats, platforms, quantiles, stage_db
+
+YT_SIGMA_25 = 1
+TW_SIGMA_25 = 2
+YT_LOW_3 = 4
+TW_LOW_3 = 8
+
+FLAGS_TABLE = "main" + stage_db.FLAGS_SUFFIX
+
+# ln 空間的 z 分數，觀看數 0 或 σ = 0 時不判斷（NULL）
+Z_SQL = {
+    p.key: f"""
+        CASE WHEN m.{p.viewers} > 0 AND c.{p.key}_ln_std > 0
+             THEN (ln(m.{p.viewers}) - c.{p.key}_ln_avg) / c.{p.key}_ln_std END
+    """
+    for p in platforms.PLATFORMS
+}
+
+# ln 空間的 robust z 分數（中位數 / MAD，見 quantiles）
+ROBUST_Z_SQL = {
+    p.key: f"""
+        CASE WHEN m.{p.viewers} > 0 AND c.{p.key}_ln_mad > 0
+             THEN (ln(m.{p.viewers}) - c.{p.key}_ln_median) / ({quantiles.MAD_SCALE} * c.{p.key}_ln_mad) END
+    """
+    for p in platforms.PLATFORMS
+}
+
+
+def mark(conn, window, avg_table, rules):
+    """
+    window 內的 main 照 rules 標記進 main_flags（本 stage 要先 soft_delete("main")）
+
+    avg_table: 提供各平台 *_ln_avg / *_ln_std 的表
+    rules:     [(bit, 平台 key, 條件)]，條件裡的 {z} / {rz} 換成該平台的 z 分數
+    return:    ({bit: 筆數}, 新標記的 [(channel, 各平台的值)]，給 channel_stats.subtract)
+    """
+    if FLAGS_TABLE not in conn.local:
+        raise RuntimeError(f"本 stage 沒有 {FLAGS_TABLE}，請完整跑一次 pipeline")
+
+    bits = " | ".join(
+        f"(CASE WHEN {cond.format(z=Z_SQL[platform], rz=ROBUST_Z_SQL[platform])} THEN {bit} ELSE 0 END)"
+        for bit, platform, cond in rules
+    )
+
+    # main 的 view 已經排除舊的 flags，這裡只會標到新的
+    conn.execute("DROP TABLE IF EXISTS temp.new_flags")
+    conn.execute(f"""
+        CREATE TEMP TABLE new_flags AS
+        SELECT *
+        FROM (
+            SELECT
+                m.id,
+                m.channel,
+                {channel_stats.VALUES_SQL.format(p="m.")},
+                {bits} AS flags
+            FROM main m
+            JOIN {avg_table} c
+                ON c.channel_id = m.channel
+            WHERE {window.where_ts("m.")}
+        )
+        WHERE flags != 0
+    """)
+
+    counts = {
+        bit: conn.execute(
+            f"SELECT COUNT(*) FROM new_flags WHERE flags & {bit}"
+        ).fetchone()[0]
+        for bit, _, _ in rules
+    }
+    rows = conn.execute(
+        f"SELECT channel, {', '.join(platforms.KEYS)} FROM new_flags"
+    ).fetchall()
+
+    conn.execute(f"""
+        INSERT INTO main."{FLAGS_TABLE}" (id, flags)
+        SELECT id, flags FROM new_flags WHERE true
+        ON CONFLICT (id) DO UPDATE SET flags = flags | excluded.flags
+    """)
+    conn.execute("DROP TABLE temp.new_flags")
+    conn.commit()
+
+    return counts, rows
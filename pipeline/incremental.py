@@ -0,0 +1,159 @@
+"""
+增量更新（watermark）
+
+watermark = 還沒處理的第一個時間區塊開頭（"YYYY-MM-DD HH:MM"），
+記在每個 stage 檔的 _stage_meta。
+
+完整跑和增量更新用同一條規則：hi 是原始資料最新一筆所在區塊的開頭，
+最新那個區塊可能還沒收完，留給下一次。完整跑時 1_0 只收 hi 之前的資料、
+watermark 記成 hi，後面的 stage 照抄上游的；增量更新每個 stage 只處理 [watermark, hi)。
+
+區塊平均、去重複都是在同一個區塊內做，所以一次處理整數個區塊就不會
+跟舊資料互相影響；已經處理過的區塊如果又補進舊資料，要完整重跑才會算進去。
+區塊寬度（timeslot）換了也要完整重跑，增量更新會檢查。
+"""
+import re
+
+from pipeline import stage_db, timeslot
+
+WATERMARK_KEY = "watermark"
+BUCKET_KEY = "bucket"
+
+_WATERMARK_RE = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+
+
+def bucket_start(date_str, time_str):
+    """
+    date_str: YYYY-MM-DD
+    time_str: HH:MM 或 HH:MM:SS
+    return:   該筆資料所在區塊的開頭（YYYY-MM-DD HH:MM）
+    """
+    return timeslot.current().floor(date_str, time_str)
+
+
+class Window:
+    """
+    要處理的時間範圍 [lo, hi)，lo / hi 為 None 代表不設限
+    """
+
+    def __init__(self, lo=None, hi=None):
+        for v in (lo, hi):
+            if v is not None and not _WATERMARK_RE.fullmatch(v):
+                raise ValueError(f"watermark 格式錯誤：{v}")
+        self.lo = lo
+        self.hi = hi
+
+    def where(self, prefix=""):
+        """
+        SQL 條件；time 不管是 HH:MM:SS 還是 HH:MM，跟區塊開頭用字串比較都對
+        """
+        key = f"({prefix}date || ' ' || {prefix}time)"
+        cond = []
+        if self.lo is not None:
+            cond.append(f"{key} >= '{self.lo}'")
+        if self.hi is not None:
+            cond.append(f"{key} < '{self.hi}'")
+        return " AND ".join(cond) if cond else "1"
+
+    def where_ts(self, prefix=""):
+        """
+        同 where()，給有 ts 欄位的表（1_1 之後的 main）用：整數比較，可以走 idx_main_ts
+        """
+        cond = []
+        if self.lo is not None:
+            cond.append(f"{prefix}ts >= {timeslot.to_ts(self.lo)}")
+        if self.hi is not None:
+            cond.append(f"{prefix}ts < {timeslot.to_ts(self.hi)}")
+        return " AND ".join(cond) if cond else "1"
+
+    def __str__(self):
+        return f"[{self.lo or '最早'}, {self.hi or '最新'})"
+
+
+ALL = Window()
+
+
+def latest_bucket(conn, table='"main"'):
+    """
+    table 最新一筆資料所在區塊的開頭（沒有資料回傳 None）
+    """
+    date_str, time_str = conn.execute(f"""
+        SELECT date, time
+        FROM {table}
+        ORDER BY date DESC, time DESC
+        LIMIT 1
+    """).fetchone() or (None, None)
+
+    if date_str is None:
+        return None
+    return bucket_start(date_str, time_str)
+
+
+def mark_full_run(conn, watermark=None):
+    """
+    完整跑完之後記錄 watermark：沒給就抄上游 stage 的
+    """
+    conn.set_meta(BUCKET_KEY, str(timeslot.current()))
+
+    if watermark is None:
+        marks = [
+            stage_db.read_meta(src, WATERMARK_KEY) for src in conn.src_dbs
+        ]
+        marks = [m for m in marks if m is not None]
+        if not marks:
+            return
+        watermark = min(marks)
+
+    conn.set_meta(WATERMARK_KEY, watermark)
+
+
+def open_update(dst_db, *src_dbs, hi):
+    """
+    增量更新用：打開既有的 stage 檔，回傳 (conn, window)
+    已經是最新的話回傳 (None, None)
+    """
+    conn = stage_db.open_stage(dst_db, *src_dbs, fresh=False)
+
+    lo = conn.get_meta(WATERMARK_KEY)
+    if lo is None:
+        conn.close()
+        raise RuntimeError(f"{dst_db.name} 沒有 watermark，請先完整跑一次 pipeline")
+
+    built = conn.get_meta(BUCKET_KEY) or str(timeslot.Bucket())
+    if built != str(timeslot.current()):
+        conn.close()
+        raise RuntimeError(
+            f"{dst_db.name} 是用 {built} 的區塊建的，現在設定是 {timeslot.current()}，"
+            "請完整跑一次 pipeline"
+        )
+
+    if hi is None or lo >= hi:
+        print(f"✅ {dst_db.name} 已是最新（watermark {lo}）")
+        conn.close()
+        return None, None
+
+    # 增量更新用 SELECT * 把上游的 main 接在後面：上游多了欄位（例如 1_1 加的
+    # ts / slot）而本地的 main 是舊格式的話接不上
+    if "main" in conn.upstream and "main" not in conn.sources:
+        local = {r[1] for r in conn.execute('PRAGMA main.table_info("main")')}
+        upstream = {
+            r[1] for r in conn.execute(
+                f'PRAGMA {conn.upstream["main"]}.table_info("main")'
+            )
+        }
+        if upstream - local:
+            conn.close()
+            raise RuntimeError(
+                f"{dst_db.name} 的 main 少了上游的欄位 {sorted(upstream - local)}，"
+                "請完整跑一次 pipeline"
+            )
+
+    window = Window(lo, hi)
+    print(f"🔄 {dst_db.name} 增量更新 {window}")
+    return conn, window
+
+
+def finish_update(conn, window):
+    conn.commit()
+    conn.set_meta(WATERMARK_KEY, window.hi)
+    conn.close()
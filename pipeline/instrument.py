@@ -0,0 +1,189 @@
+"""
+stage / SQL 的執行紀錄
+
+stage_db 的連線每跑一句 SQL 都會記在這裡（同一句 SQL 合併成一筆：次數、
+wall / CPU 時間、讀出筆數、寫入筆數）。runner 跑完一個 stage 之後把結果寫進
+pipeline_runs.db 的 pipeline_runs / pipeline_statements，並另外寫一行 JSON log。
+
+讀出筆數 = fetch 回 Python 的筆數；INSERT ... SELECT 在 SQLite 裡面讀的列不會算進來。
+寫入筆數 = cursor.rowcount（UPDATE / DELETE / INSERT）。
+"""
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+RUNS_DB = ROOT_PATH / "pipeline_runs.db"
+LOG_PATH = ROOT_PATH / "logs" / "pipeline_runs.jsonl"
+
+SQL_PREVIEW = 300     # 存進表的 SQL 最多幾個字
+TOP_N = 5             # 跑完列出最慢的幾句
+
+_SPACES_RE = re.compile(r"\s+")
+
+_current = None
+
+
+class StageStats:
+    """
+    一個 stage 這次執行的統計
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.statements = {}
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.wall = None
+        self.cpu = None
+
+    def add(self, sql, wall, cpu, read=0, written=0, calls=1):
+        stat = self.statements.get(sql)
+        if stat is None:
+            stat = self.statements[sql] = {
+                "calls": 0, "wall": 0.0, "cpu": 0.0, "read": 0, "written": 0
+            }
+        stat["calls"] += calls
+        stat["wall"] += wall
+        stat["cpu"] += cpu
+        stat["read"] += read
+        stat["written"] += written
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.wall0
+        self.cpu = time.process_time() - self.cpu0
+
+        # 同一句 SQL 只是空白不同的合併起來
+        merged = {}
+        for sql, stat in self.statements.items():
+            key = _SPACES_RE.sub(" ", sql).strip()
+            if key in merged:
+                for k, v in stat.items():
+                    merged[key][k] += v
+            else:
+                merged[key] = dict(stat)
+        self.statements = merged
+
+        return {
+            "stage": self.stage,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "read": sum(s["read"] for s in merged.values()),
+            "written": sum(s["written"] for s in merged.values()),
+            "statements": [
+                {"sql": sql, **stat}
+                for sql, stat in sorted(
+                    merged.items(), key=lambda kv: kv[1]["wall"], reverse=True
+                )
+            ],
+        }
+
+
+def begin(stage):
+    global _current
+    _current = StageStats(stage)
+
+
+def end():
+    """
+    結束記錄，回傳可以 pickle 的 dict（給 runner 的主 process 寫檔）
+    """
+    global _current
+    stats, _current = _current, None
+    return None if stats is None else stats.finish()
+
+
+def record(sql, wall, cpu, read=0, written=0, calls=1):
+    if _current is not None:
+        _current.add(sql, wall, cpu, read, written, calls)
+
+
+RUNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id       TEXT NOT NULL,     -- 同一次 python -m pipeline 共用
+    stage        TEXT NOT NULL,
+    mode         TEXT NOT NULL,     -- full / incremental
+    started_at   TEXT NOT NULL,
+    wall_s       REAL NOT NULL,
+    cpu_s        REAL NOT NULL,     -- stage 所在 process 的 CPU 時間
+    rows_read    INTEGER NOT NULL,
+    rows_written INTEGER NOT NULL,
+    size_before  INTEGER,           -- 跑之前的 stage 檔大小（沒有檔案為 NULL）
+    size_after   INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pipeline_statements (
+    run_pk       INTEGER NOT NULL REFERENCES pipeline_runs(id),
+    sql          TEXT NOT NULL,
+    calls        INTEGER NOT NULL,
+    wall_s       REAL NOT NULL,
+    cpu_s        REAL NOT NULL,
+    rows_read    INTEGER NOT NULL,
+    rows_written INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_runs_stage ON pipeline_runs(stage, started_at);
+"""
+
+
+def save(run_id, mode, started_at, stats, size_before, size_after):
+    """
+    寫進 pipeline_runs.db + JSON log（只在 runner 的主 process 呼叫）
+    """
+    conn = sqlite3.connect(RUNS_DB)
+    try:
+        conn.executescript(RUNS_SCHEMA)
+        cur = conn.execute("""
+            INSERT INTO pipeline_runs (
+                run_id, stage, mode, started_at,
+                wall_s, cpu_s, rows_read, rows_written,
+                size_before, size_after
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            run_id, stats["stage"], mode, started_at,
+            stats["wall"], stats["cpu"], stats["read"], stats["written"],
+            size_before, size_after
+        ))
+        conn.executemany("""
+            INSERT INTO pipeline_statements (
+                run_pk, sql, calls, wall_s, cpu_s, rows_read, rows_written
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (
+                cur.lastrowid, s["sql"][:SQL_PREVIEW], s["calls"],
+                s["wall"], s["cpu"], s["read"], s["written"]
+            )
+            for s in stats["statements"]
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+    LOG_PATH.parent.mkdir(exist_ok=True)
+    with LOG_PATH.open("a", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "run_id": run_id,
+            "mode": mode,
+            "started_at": started_at,
+            "size_before": size_before,
+            "size_after": size_after,
+            **stats,
+        }, ensure_ascii=False) + "\n")
+
+
+def slowest(all_stats, n=TOP_N):
+    """
+    這次所有 stage 裡最慢的 n 句 SQL：[(stage, stat), ...]
+    """
+    rows = [
+        (stats["stage"], s)
+        for stats in all_stats
+        for s in stats["statements"]
+    ]
+    rows.sort(key=lambda r: r[1]["wall"], reverse=True)
+    return rows[:n]
@@ -0,0 +1,95 @@
+"""
+平台（YT / TW）的定義
+
+main 是寬表：每個平台一組 stream id 欄（0 / NULL = 沒開台）和觀看數欄。
+PLATFORMS 是唯一的平台清單，channel_stats / quantiles / flags / time_profile、
+stream 分析和各 stage 依平台展開的欄位 / SQL 都由這裡產生；
+要加一個平台，main 加兩欄、這裡加一行。
+輸出給 dashboard 的表維持寬的 yt_* / tw_* 欄位。
+
+長格式：register() 在連線上建 TEMP 的 platform（維度表）和 obs view
+
+    platform (k, platform, label, name)
+    obs      (id, channel, date, time, ts, slot, k, platform, label, stream_id, viewers)
+
+main 的每一筆、每個有開台的平台是 obs 的一筆。obs 是 main CROSS JOIN platform，
+main 在外層只掃一次（platform 只有幾列），不是每個平台各掃一次再 UNION；
+WHERE ts / channel 的條件一樣會用到 main 的 index。
+
+什麼時候用哪一種：
+    分組統計（channel_stats / flags / time_profile / 1_1 / 4_0）
+        直接讀 main，每個平台一組 CASE 欄位（value_sql），一次掃描所有平台一起算；
+        比 obs 再 GROUP BY 平台快很多（不用多一倍的列、也不用排序）
+    要一個平台一個平台照順序讀的（stream 分析、timeslot 重取樣）
+        讀 obs WHERE k = ?，同一句 SQL 跑每個平台
+"""
+from typing import NamedTuple
+
+
+class Platform(NamedTuple):
+    key: str         # 欄位 / 表名前綴（yt_avg、yt_time_acc）
+    label: str       # stream_analysis / stream_gaps 的 platform
+    name: str        # 顯示用
+    viewers: str     # main 的觀看數欄
+    stream_id: str   # main 的 stream id 欄
+
+
+PLATFORMS = (
+    Platform("yt", "YT", "YouTube", "youtube", "yt_number"),
+    Platform("tw", "TW", "Twitch", "twitch", "tw_number"),
+)
+
+KEYS = tuple(p.key for p in PLATFORMS)
+BY_KEY = {p.key: p for p in PLATFORMS}
+
+# obs 從 main 帶過來的欄位（有的才帶，原始 data.db 沒有 ts / slot）
+OBS_COLUMNS = ("id", "channel", "date", "time", "ts", "slot")
+
+
+def value_sql(p, prefix=""):
+    """
+    平台 p 的觀看數，沒開台是 NULL
+    """
+    return f"CASE WHEN {prefix}{p.stream_id} != 0 THEN {prefix}{p.viewers} END"
+
+
+def _case_k(field):
+    whens = " ".join(f"WHEN {k} THEN m.{getattr(p, field)}" for k, p in enumerate(PLATFORMS, 1))
+    return f"CASE p.k {whens} END"
+
+
+def register(conn):
+    """
+    在這個連線上建 TEMP 的 platform / obs（已經有就不動）
+    """
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS platform (
+            k        INTEGER PRIMARY KEY,
+            platform TEXT NOT NULL UNIQUE,   -- 欄位前綴（yt / tw）
+            label    TEXT NOT NULL,          -- YT / TW
+            name     TEXT NOT NULL
+        )
+    """)
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.platform (k, platform, label, name) VALUES (?, ?, ?, ?)",
+        [(k, p.key, p.label, p.name) for k, p in enumerate(PLATFORMS, 1)]
+    )
+
+    have = {row[1] for row in conn.execute('PRAGMA table_info("main")')}
+    cols = ", ".join(f"m.{c}" for c in OBS_COLUMNS if c in have)
+    conn.execute(f"""
+        CREATE TEMP VIEW IF NOT EXISTS obs AS
+        SELECT *
+        FROM (
+            SELECT
+                {cols},
+                p.k,
+                p.platform,
+                p.label,
+                {_case_k("stream_id")} AS stream_id,
+                {_case_k("viewers")} AS viewers
+            FROM main m
+            CROSS JOIN temp.platform p
+        )
+        WHERE stream_id != 0
+    """)
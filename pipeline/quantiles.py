@@ -0,0 +1,231 @@
+"""
+各頻道的分位數（channel_sketch）
+
+平均 / 標準差會被少數 raid、聯動的爆量拉走，所以另外為每個頻道、每個平台
+維護一份 t-digest：把排序後的資料壓成最多約 DELTA / 2 個質心 (mean, weight)，
+靠近兩端的質心小（p5 / p95 準），中間的大。不管頻道有幾筆資料，
+每份 sketch 的大小都有上限；兩份 sketch 合併 = 質心放在一起再壓一次，
+所以跟 channel_acc 一樣可以增量往上加（但扣不回來）。
+
+數值跟 channel_stats 的 ln 一樣：*_number != 0 且觀看數 > 0 的 ln(觀看數)，
+ln 是單調的，分位數換回人數直接 exp 就好。main 不另外掃：Sketch.add 掛在
+channel_stats.accumulate 上，讀進來的每一批順便併進 sketch。
+
+由 sketch 算出的值放在 channel_quantile（finalize 的 SQL 直接 JOIN）：
+    p5 / p50 / p95   人數
+    ln_median        ln 空間的中位數
+    ln_mad           ln 空間的 MAD（中位數絕對偏差），×1.4826 ≈ σ
+
+channel_sketch 只在 1_3 維護（data_1_2 的 main，也就是過濾異常值之前），
+1_3 的 channel_avg 帶著這些欄位，1_4 / 3_1 判斷異常值的規則可以改用
+flags 的 {rz}（中位數 / MAD 的 z 分數）。
+"""
+import numpy as np
+
+from pipeline import platforms
+
+PLATFORMS = platforms.KEYS
+
+# t-digest 的壓縮參數：質心數上限約 DELTA / 2
+DELTA = 200
+
+# MAD → σ（常態分布時）
+MAD_SCALE = 1.4826
+
+SKETCH_SCHEMA = """
+CREATE TABLE channel_sketch (
+    channel_id TEXT NOT NULL,
+    platform   TEXT NOT NULL,   -- 平台 key（yt / tw）
+    mean       REAL NOT NULL,   -- 質心（ln 觀看數）
+    weight     REAL NOT NULL    -- 質心代表的筆數
+);
+"""
+
+
+def _quantile_columns(key):
+    return f"""
+    {key}_p5        REAL,   -- 人數
+    {key}_p50       REAL,
+    {key}_p95       REAL,
+    {key}_ln_median REAL,   -- ln 空間
+    {key}_ln_mad    REAL"""
+
+
+_QUANTILE_COLUMNS_SQL = ",\n".join(_quantile_columns(key) for key in PLATFORMS)
+
+QUANTILE_SCHEMA = f"""
+CREATE TABLE channel_quantile (
+    channel_id   TEXT PRIMARY KEY,
+{_QUANTILE_COLUMNS_SQL}
+);
+"""
+
+QUANTILE_COLUMNS = [
+    f"{p}_{f}" for p in PLATFORMS for f in ("p5", "p50", "p95", "ln_median", "ln_mad")
+]
+
+def create_sketch(conn):
+    """
+    在本 stage 建立空的 channel_sketch / channel_quantile
+    """
+    conn.rebuild("channel_sketch")
+    conn.rebuild("channel_quantile")
+    conn.execute(SKETCH_SCHEMA)
+    conn.execute("""
+        CREATE INDEX main.idx_channel_sketch
+        ON channel_sketch(channel_id, platform)
+    """)
+    conn.execute(QUANTILE_SCHEMA)
+
+
+def compress(mean, weight, delta=DELTA):
+    """
+    t-digest 壓縮：依 mean 排序，用 k1 尺度 k(q) = δ/2π · asin(2q − 1)
+    把同一個整數 k 區間的點併成一個質心（兩端 k 變化快，質心自然比較小）
+    return: (mean, weight)，依 mean 排序
+    """
+    if len(mean) == 0:
+        return mean, weight
+
+    order = np.argsort(mean, kind="stable")
+    mean, weight = mean[order], weight[order]
+
+    cum = np.cumsum(weight)
+    q = (cum - weight / 2) / cum[-1]
+    k = np.floor(delta / (2 * np.pi) * np.arcsin(2 * q - 1))
+
+    starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+    w = np.add.reduceat(weight, starts)
+    m = np.add.reduceat(mean * weight, starts) / w
+    return m, w
+
+
+def quantile(mean, weight, q):
+    """
+    由質心內插出分位數 q（可以是 array）；質心放在自己那段累積權重的中點
+    """
+    if len(mean) == 0:
+        return np.full(np.shape(q), np.nan)
+
+    cum = np.cumsum(weight)
+    return np.interp(np.asarray(q) * cum[-1], cum - weight / 2, mean)
+
+
+def mad(mean, weight, median):
+    """
+    中位數絕對偏差：質心內插出的累積分布 F 是分段線性的，
+    G(d) = F(median + d) − F(median − d) 也是，轉折點就在各質心到中位數的距離；
+    算出每個轉折點的 G，再內插出 G(d) = 0.5 的 d
+    """
+    if len(mean) == 0:
+        return np.nan
+
+    cum = np.cumsum(weight)
+    mid = (cum - weight / 2) / cum[-1]
+
+    d = np.unique(np.abs(mean - median))
+    g = np.interp(median + d, mean, mid) - np.interp(median - d, mean, mid)
+    return float(np.interp(0.5, g, d))
+
+
+class Sketch:
+    """
+    各頻道的 sketch（只讀進有新資料的頻道）
+
+        sketch = quantiles.Sketch(conn)
+        channel_stats.accumulate(conn, window, on_chunk=sketch.add)
+        sketch.save()
+
+    記憶體只跟「一批的筆數 + 頻道數 × DELTA」有關
+    """
+
+    def __init__(self, conn):
+        if "channel_sketch" in getattr(conn, "sources", ()):
+            raise RuntimeError("channel_sketch 還在上游，請完整跑一次 pipeline")
+        self.conn = conn
+        self.state = {}
+
+    def _load(self, names):
+        """
+        names 裡還沒讀過的頻道，從 channel_sketch 讀進來（沒有就是空的）
+        """
+        names = [name for name in names if (name, PLATFORMS[0]) not in self.state]
+        if not names:
+            return
+
+        found = {}
+        marks = ", ".join("?" * len(names))
+        for name, platform, m, w in self.conn.execute(f"""
+            SELECT channel_id, platform, mean, weight
+            FROM main.channel_sketch
+            WHERE channel_id IN ({marks})
+            ORDER BY channel_id, platform, mean
+        """, names):
+            found.setdefault((name, platform), []).append((m, w))
+
+        for name in names:
+            for platform in PLATFORMS:
+                rows = np.array(found.get((name, platform), []), dtype=float)
+                rows = rows.reshape(len(rows), 2)
+                self.state[(name, platform)] = (rows[:, 0], rows[:, 1])
+
+    def add(self, names, group, values):
+        """
+        一批資料（names 的編號, 各平台的值；沒開台是 NaN）併進 sketch
+        """
+        self._load(names)
+
+        for col, platform in enumerate(PLATFORMS):
+            x = values[:, col]
+            pos = x > 0
+            g, x = group[pos], np.log(x[pos])
+
+            order = np.argsort(g, kind="stable")
+            g, x = g[order], x[order]
+            bounds = np.searchsorted(g, np.arange(len(names) + 1))
+
+            for i in np.flatnonzero(np.diff(bounds)):
+                part = x[bounds[i]:bounds[i + 1]]
+                m, w = self.state[(names[i], platform)]
+                self.state[(names[i], platform)] = compress(
+                    np.concatenate([m, part]),
+                    np.concatenate([w, np.ones(len(part))]),
+                )
+
+    def save(self):
+        """
+        有動到的頻道整份寫回 channel_sketch，並重算它們的 channel_quantile
+        """
+        if not self.state:
+            return
+
+        names = sorted({name for name, _ in self.state})
+        marks = ", ".join("?" * len(names))
+        self.conn.execute(
+            f"DELETE FROM main.channel_sketch WHERE channel_id IN ({marks})", names
+        )
+        self.conn.executemany(
+            "INSERT INTO main.channel_sketch (channel_id, platform, mean, weight) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (name, platform, m, w)
+                for (name, platform), (means, weights) in self.state.items()
+                for m, w in zip(means.tolist(), weights.tolist())
+            ]
+        )
+
+        rows = []
+        for name in names:
+            row = [name]
+            for platform in PLATFORMS:
+                m, w = self.state[(name, platform)]
+                p5, p50, p95 = quantile(m, w, [0.05, 0.5, 0.95])
+                row += [*np.exp([p5, p50, p95]).tolist(), float(p50), mad(m, w, p50)]
+            rows.append(tuple(None if v != v else v for v in row))   # NaN → NULL
+
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO main.channel_quantile "
+            f"(channel_id, {', '.join(QUANTILE_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * (1 + len(QUANTILE_COLUMNS)))})",
+            rows
+        )
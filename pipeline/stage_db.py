@@ -0,0 +1,424 @@
+"""
+stage 資料庫
+
+每個 stage 只把自己「新產生 / 有改動」的表寫進自己的 data_x_x.db，
+上游的 stage 檔一律唯讀 ATTACH，再用 TEMP VIEW 把表名接回來，
+所以 stage 裡的 SQL 照樣可以寫 FROM main、JOIN channel_avg。
+
+每個 stage 檔裡的 _stage_lineage 記錄「沒有存在本地的表在哪個上游檔」，
+之後用 connect() 打開任何一個中間檔，都能看到當時完整的資料。
+_stage_meta 則是 stage 自己的設定值（例如增量更新的 watermark）。
+
+軟刪除：stage 可以不搬整張表，只建一張 <表名>_flags（id → 原因 bit）記錄要排除的列，
+之後本 stage 和下游接這張表的 TEMP VIEW 都會自動排除 flags 裡的 id。
+"""
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from pipeline import instrument
+
+LINEAGE_TABLE = "_stage_lineage"
+META_TABLE = "_stage_meta"
+FLAGS_SUFFIX = "_flags"
+
+
+def _ro_uri(path):
+    return Path(path).resolve().as_uri() + "?mode=ro"
+
+
+def _local_tables(conn, schema="main"):
+    rows = conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'"
+    )
+    return [
+        name for (name,) in rows
+        if not name.startswith(("sqlite_", "_stage_"))
+    ]
+
+
+def resolve_tables(db_path):
+    """
+    站在 db_path 這個 stage 看得到的所有表
+    return: {表名: 實際存放的 db 檔（絕對路徑）}
+    """
+    db_path = Path(db_path).resolve()
+
+    conn = sqlite3.connect(_ro_uri(db_path), uri=True)
+    try:
+        tables = {}
+
+        has_lineage = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (LINEAGE_TABLE,)
+        ).fetchone()
+        if has_lineage:
+            for name, rel in conn.execute(f"SELECT name, db FROM {LINEAGE_TABLE}"):
+                tables[name] = (db_path.parent / rel).resolve()
+
+        # 本地的表永遠蓋過上游
+        for name in _local_tables(conn):
+            tables[name] = db_path
+    finally:
+        conn.close()
+
+    return tables
+
+
+def read_meta(db_path, key):
+    """
+    讀某個 stage 檔的 _stage_meta（沒有就回傳 None，例如原始的 data.db）
+    """
+    conn = sqlite3.connect(_ro_uri(db_path), uri=True)
+    try:
+        has_meta = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (META_TABLE,)
+        ).fetchone()
+        if not has_meta:
+            return None
+
+        row = conn.execute(
+            f"SELECT value FROM {META_TABLE} WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def write_meta(db_path, key, value):
+    """
+    寫某個 stage 檔的 _stage_meta（stage 已經跑完、沒有開著的連線時用）
+    """
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=rw", uri=True)
+    try:
+        conn.execute(
+            f"INSERT OR REPLACE INTO {META_TABLE} (key, value) VALUES (?, ?)",
+            (key, value)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class StageCursor(sqlite3.Cursor):
+    """
+    每句 SQL 的時間 / 筆數都記到 instrument（fetch 的時間算在前一句 SQL 上）
+    """
+
+    _sql = None
+
+    def _measure(self, sql, run, *args, calls=1):
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        result = run(*args)
+        instrument.record(
+            sql,
+            time.perf_counter() - wall0,
+            time.process_time() - cpu0,
+            written=max(self.rowcount, 0),
+            calls=calls,
+        )
+        self._sql = sql
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._measure(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._measure(sql, super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._measure(sql_script, super().executescript, sql_script)
+
+    def _fetch(self, run, *args):
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        rows = run(*args)
+        if self._sql is not None:
+            instrument.record(
+                self._sql,
+                time.perf_counter() - wall0,
+                time.process_time() - cpu0,
+                read=len(rows) if isinstance(rows, list) else int(rows is not None),
+                calls=0,
+            )
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class StageConnection(sqlite3.Connection):
+    """
+    sqlite3.Connection + 上游表的對照
+
+    sources:  還接在上游的表（表名 → ATTACH 的 alias，有 TEMP VIEW）
+    upstream: 所有上游的表，包含已經搬進本地的（增量更新要回頭讀上游時用）
+    local:    本地的表
+
+    cursor / execute 一律走 StageCursor，所以 stage 裡的 SQL 都會被記錄
+    """
+
+    def cursor(self, factory=StageCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def _attach_sources(self, tables, local=()):
+        self.sources = {}
+        self.upstream = {}
+        self.local = set(local)
+        aliases = {}
+
+        for name, path in tables.items():
+            if path not in aliases:
+                alias = f"src{len(aliases)}"
+                self.execute(f"ATTACH DATABASE ? AS {alias}", (_ro_uri(path),))
+                aliases[path] = alias
+
+            alias = aliases[path]
+            self.upstream[name] = alias
+            if name not in self.local:
+                self.sources[name] = alias
+
+        for name in self.sources:
+            self._create_view(name)
+
+    def _flags_schema(self, name):
+        """
+        name 的軟刪除表在哪（main / 上游 alias），沒有就是 None
+        """
+        flags = name + FLAGS_SUFFIX
+        if flags in self.local:
+            return "main"
+        return self.sources.get(flags)
+
+    def _keep_where(self, name, prefix=""):
+        """
+        排除軟刪除列的條件（沒有 flags 就是 1）
+        """
+        schema = self._flags_schema(name)
+        if schema is None:
+            return "1"
+        return f'{prefix}id NOT IN (SELECT id FROM {schema}."{name}{FLAGS_SUFFIX}")'
+
+    def _create_view(self, name, replace=False):
+        if replace:
+            self.execute(f'DROP VIEW temp."{name}"')
+
+        where = self._keep_where(name)
+        self.execute(
+            f'CREATE TEMP VIEW "{name}" AS SELECT * FROM {self.sources[name]}."{name}"'
+            + ("" if where == "1" else f" WHERE {where}")
+        )
+
+    def upstream_table(self, name):
+        """
+        上游那份表的完整名稱（例如 src2."main"），本地已經有同名表時用
+        上游有軟刪除時是排除掉那些列的子查詢
+        """
+        table = f'{self.upstream[name]}."{name}"'
+        flags = name + FLAGS_SUFFIX
+        if flags in self.upstream and flags not in self.local:
+            return (
+                f"(SELECT * FROM {table} WHERE id NOT IN "
+                f'(SELECT id FROM {self.upstream[flags]}."{flags}"))'
+            )
+        return table
+
+    def get_meta(self, key):
+        row = self.execute(
+            f"SELECT value FROM main.{META_TABLE} WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.execute(
+            f"INSERT OR REPLACE INTO main.{META_TABLE} (key, value) VALUES (?, ?)",
+            (key, value)
+        )
+        self.commit()
+
+    def take(self, name, drop_where=None, unique=None):
+        """
+        把上游的表搬進這個 stage（之後就能直接 UPDATE / DELETE 本地這份）
+
+        drop_where: 跟原本 DELETE FROM ... WHERE 一樣的條件，符合的列不搬
+                    （條件裡的表名還是指向上游）
+        unique:     自然鍵（欄位或運算式的 list），先建 UNIQUE INDEX 再用
+                    INSERT OR IGNORE 依 rowid 順序搬，同一個鍵只留第一筆；
+                    index 留在本地，之後增量 INSERT OR IGNORE 一樣擋得住
+        return: 搬進來的筆數
+        """
+        alias = self.sources[name]
+
+        create_sql = self.execute(
+            f"SELECT sql FROM {alias}.sqlite_master WHERE type = 'table' AND name = ?",
+            (name,)
+        ).fetchone()[0]
+        self.execute(create_sql)
+
+        verb, order = "INSERT", ""
+        if unique is not None:
+            self.execute(
+                f'CREATE UNIQUE INDEX main."uq_{name}_key" '
+                f'ON "{name}" ({", ".join(unique)})'
+            )
+            verb, order = "INSERT OR IGNORE", "ORDER BY rowid"
+
+        # 上游軟刪除的列不搬，搬完本地這份就是乾淨的，flags 不再套用
+        where = self._keep_where(name)
+        if drop_where is not None:
+            where += f" AND ({drop_where}) IS NOT 1"
+        cur = self.execute(
+            f'{verb} INTO main."{name}" SELECT * FROM {alias}."{name}" WHERE {where} {order}'
+        )
+
+        self.sources[name] = alias
+        self.rebuild(name)
+        self._detach(name + FLAGS_SUFFIX)
+
+        return cur.rowcount
+
+    def soft_delete(self, name):
+        """
+        建立本 stage 的 <name>_flags (id, flags)，之後 name 的 view 會排除裡面的 id，
+        下游接 name 時也一樣（name 本身不用搬進來）
+        上游已經有的 flags 一起複製過來，再往上加
+        return: flags 表名
+        """
+        flags = name + FLAGS_SUFFIX
+        upstream = self.sources.get(flags)
+
+        self._detach(flags)
+        self.execute(f"""
+            CREATE TABLE main."{flags}" (
+                id    INTEGER PRIMARY KEY,
+                flags INTEGER NOT NULL      -- 排除原因（bit）
+            )
+        """)
+        if upstream is not None:
+            self.execute(
+                f'INSERT INTO main."{flags}" SELECT id, flags FROM {upstream}."{flags}"'
+            )
+        self.local.add(flags)
+
+        if name in self.sources:
+            self._create_view(name, replace=True)
+        self.commit()
+        return flags
+
+    def rebuild(self, name):
+        """
+        這個表由本 stage 重新建立：拿掉上游接過來的 view，之後的表名都指向本地
+        """
+        self.local.add(name)
+        self._detach(name)
+
+    def _detach(self, name):
+        """
+        拿掉上游接過來的 view 和 lineage
+        """
+        if self.sources.pop(name, None) is None:
+            return
+
+        self.execute(f'DROP VIEW temp."{name}"')
+        self.execute(f"DELETE FROM main.{LINEAGE_TABLE} WHERE name = ?", (name,))
+        self.commit()
+
+
+def open_stage(dst_db, *src_dbs, fresh=True):
+    """
+    建立（重建）一個 stage 檔，src_dbs 依序唯讀 ATTACH，後面的蓋過前面的
+
+    fresh=False: 沿用既有的 stage 檔（增量更新），本地的表保留，
+                 上游一樣重新 ATTACH
+    """
+    dst_db = Path(dst_db).resolve()
+
+    tables = {}
+    for src in src_dbs:
+        if not Path(src).exists():
+            raise FileNotFoundError(f"找不到來源資料庫：{src}")
+        tables.update(resolve_tables(src))
+
+    if not fresh:
+        if not dst_db.exists():
+            raise FileNotFoundError(f"找不到 {dst_db.name}，請先完整跑一次 pipeline")
+
+        conn = sqlite3.connect(
+            dst_db.as_uri() + "?mode=rw", uri=True, factory=StageConnection
+        )
+        conn.src_dbs = [Path(src).resolve() for src in src_dbs]
+        conn._attach_sources(tables, local=set(_local_tables(conn)))
+        return conn
+
+    if dst_db.exists():
+        dst_db.unlink()   # 直接刪掉舊檔
+        print(f"⚠️ 已刪除舊的 {dst_db.name}")
+
+    conn = sqlite3.connect(
+        dst_db.as_uri() + "?mode=rwc", uri=True, factory=StageConnection
+    )
+
+    conn.execute(f"""
+    CREATE TABLE {LINEAGE_TABLE} (
+        name TEXT PRIMARY KEY,
+        db   TEXT NOT NULL     -- 相對於本檔的路徑
+    );
+    """)
+    conn.execute(f"""
+    CREATE TABLE {META_TABLE} (
+        key   TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """)
+    conn.executemany(
+        f"INSERT INTO {LINEAGE_TABLE} (name, db) VALUES (?, ?)",
+        [
+            (name, os.path.relpath(path, dst_db.parent))
+            for name, path in tables.items()
+        ]
+    )
+    conn.commit()
+
+    conn.src_dbs = [Path(src).resolve() for src in src_dbs]
+    conn._attach_sources(tables)
+    return conn
+
+
+def connect(db_path):
+    """
+    唯讀打開某個 stage 檔，上游的表一樣接成 TEMP VIEW（dashboard / 檢查中間結果用）
+    """
+    db_path = Path(db_path).resolve()
+    if not db_path.exists():
+        raise FileNotFoundError(f"找不到資料庫：{db_path}")
+
+    tables = resolve_tables(db_path)
+
+    conn = sqlite3.connect(_ro_uri(db_path), uri=True, factory=StageConnection)
+    conn._attach_sources(
+        {name: path for name, path in tables.items() if path != db_path},
+        local={name for name, path in tables.items() if path == db_path},
+    )
+    return conn
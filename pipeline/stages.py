@@ -0,0 +1,31 @@
+"""
+pipeline 的所有 stage（依執行順序）與它們真正讀的上游
+"""
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+RAW_DB = ROOT_PATH / "data.db"
+
+# (stage 名稱, stage 腳本, 上游 stage)；沒有上游的讀原始 data.db
+STAGES = [
+    ("1_0", "ver_1/1_0_problem_main_data.py", []),
+    ("1_1", "ver_1/1_1_time_justify.py", ["1_0"]),
+    ("1_2", "ver_1/1_2_dele_duplicate.py", ["1_1"]),
+    ("1_3", "ver_1/1_3_count_avg.py", ["1_2"]),
+    ("1_4", "ver_1/1_4_dele_extreme.py", ["1_3"]),
+    ("1_5", "ver_1/1_5_new_avg.py", ["1_4"]),
+
+    ("2_1", "ver_2/2_1_yt_by_time.py", ["1_5"]),
+    ("2_2", "ver_2/2_2_tw_by_time.py", ["1_5"]),
+    ("2_3", "ver_2/2_3_time_avg_pct.py", ["2_1", "2_2"]),
+    ("2_7", "ver_2/2_7_weekday_slot.py", ["1_5"]),
+
+    ("3_0", "ver_3/3_0_only.py", ["1_3"]),
+    ("3_1", "ver_3/3_1_dele_reavg.py", ["3_0"]),
+    ("3_2", "ver_3/3_2_time_only.py", ["3_1"]),
+
+    ("4_0", "ver_4/4_0_time_sum.py", ["3_2"]),
+    ("4_1", "ver_4/4_1_sum_count.py", ["4_0"]),
+
+    ("stream_ana", "ver_100/stream_ana_db.py", ["1_2"]),
+]
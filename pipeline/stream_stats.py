@@ -0,0 +1,228 @@
+"""
+每場 stream 的統計（stream_analysis 用）
+
+main 依 (stream id, 頻道, ts) 排好之後，同一場是連續的一段，
+summarize 用 NumPy 分組一次算完一段裡所有 stream 的開始 / 結束、平均 / 最大 / 最小、
+最大 / 最小值第一次出現的時間和筆數。
+
+find_gaps 在同一段資料上找每場中間缺的區塊：相鄰兩筆的 ts 差超過一個區塊寬度，
+中間就是一段連續缺漏（每段一筆，stream_gaps 用）。
+
+scan 分批讀 cursor，每批最後一場可能還沒讀完，留到下一批接著算，
+記憶體只跟 CHUNK_ROWS 有關。
+
+並行（jobs > 1）：頻道排序後依筆數切成 jobs 段連續的範圍，每個 process 自己唯讀打開
+stage 檔，只讀 channel BETWEEN 第一個 AND 最後一個頻道（每段只綁兩個參數），
+回傳每場 / 每段缺漏一筆的陣列；最後依 (stream id, 頻道) 排回跟單一 process 一樣的順序，
+由呼叫的人一次寫入。stream_ana 本身是 runner 的一個 worker，
+所以 process 數不超過 python -m pipeline 的 --jobs。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pipeline import platforms, stage_db
+
+CHUNK_ROWS = 1_000_000
+
+JOBS_ENV = "PIPELINE_STREAM_JOBS"
+RUNNER_JOBS_ENV = "PIPELINE_JOBS"     # runner 的 --jobs（上限）
+
+# summarize 回傳的欄位（每場一筆）
+FIELDS = (
+    "stream_id", "channel",
+    "start_ts", "end_ts",
+    "sum", "max", "max_ts", "min", "min_ts",
+    "points",
+)
+
+# find_gaps 回傳的欄位（每段缺漏一筆）
+GAP_FIELDS = ("stream_id", "channel", "start_ts", "end_ts", "points")
+
+
+def jobs():
+    """
+    stream 分析要用幾個 process（--stream-jobs，預設 1 = 不開 process）
+    由 runner 跑的時候不超過它的 --jobs
+    """
+    n = max(1, int(os.environ.get(JOBS_ENV, 1)))
+    limit = os.environ.get(RUNNER_JOBS_ENV)
+    if limit is not None:
+        n = min(n, max(1, int(limit)))
+    return n
+
+
+def stream_starts(sid, channel):
+    """
+    每場的開頭位置：stream id 或頻道換了（同一個 id 可能在好幾個頻道）
+    """
+    return np.flatnonzero(np.r_[
+        True, (sid[1:] != sid[:-1]) | (channel[1:] != channel[:-1])
+    ])
+
+
+def summarize(sid, channel, ts, viewers):
+    """
+    一段已經排好、每場都完整的資料 → {欄位: 每場一個值的陣列}
+    """
+    starts = stream_starts(sid, channel)
+    ends = np.r_[starts[1:], len(sid)]
+    points = ends - starts
+
+    max_v = np.maximum.reduceat(viewers, starts)
+    min_v = np.minimum.reduceat(viewers, starts)
+
+    # 最大 / 最小值第一次出現的時間（每場內已經依時間排好）
+    def first_time(target):
+        hit = np.flatnonzero(viewers == np.repeat(target, points))
+        return ts[hit[np.searchsorted(hit, starts)]]
+
+    return {
+        "stream_id": sid[starts],
+        "channel": channel[starts],
+        "start_ts": ts[starts],
+        "end_ts": ts[ends - 1],
+        "sum": np.add.reduceat(viewers, starts),
+        "max": max_v,
+        "max_ts": first_time(max_v),
+        "min": min_v,
+        "min_ts": first_time(min_v),
+        "points": points,
+    }
+
+
+def find_gaps(sid, channel, ts, minutes):
+    """
+    一段已經排好、每場都完整的資料 → {欄位: 每段缺漏一個值的陣列}
+    start_ts / end_ts 是第一個 / 最後一個缺的區塊，points 是缺幾個區塊
+    """
+    step = np.diff(ts)
+    same = (sid[1:] == sid[:-1]) & (channel[1:] == channel[:-1])
+    at = np.flatnonzero(same & (step > minutes))
+
+    return {
+        "stream_id": sid[at],
+        "channel": channel[at],
+        "start_ts": ts[at] + minutes,
+        "end_ts": ts[at + 1] - minutes,
+        "points": step[at] // minutes - 1,
+    }
+
+
+def _analyze(cols, minutes):
+    return summarize(*cols), find_gaps(*cols[:3], minutes)
+
+
+def scan(cur, minutes):
+    """
+    cur:     SELECT stream_id, channel, ts, viewers FROM obs（單一平台）... ORDER BY stream_id, channel, ts
+    minutes: 區塊寬度（找缺漏用）
+    分批 yield (summarize, find_gaps) 的結果（每場只會出現一次）
+    """
+    carry = None
+    while rows := cur.fetchmany(CHUNK_ROWS):
+        sid, channel, ts, viewers = zip(*rows)
+        cols = (
+            np.array(sid, dtype=np.int64),
+            np.array(channel, dtype=object),
+            np.array(ts, dtype=np.int64),
+            np.array(viewers, dtype=np.int64),
+        )
+        if carry is not None:
+            cols = tuple(np.concatenate(pair) for pair in zip(carry, cols))
+
+        done = stream_starts(*cols[:2])[-1]
+        carry = tuple(col[done:] for col in cols)
+        if done:
+            yield _analyze(tuple(col[:done] for col in cols), minutes)
+
+    if carry is not None:
+        yield _analyze(carry, minutes)
+
+
+def _concat(parts, fields):
+    return {f: np.concatenate([p[f] for p in parts]) for f in fields}
+
+
+def _sorted(cols, *keys):
+    """
+    依 keys（前面的優先）排序
+    """
+    order = np.lexsort(tuple(
+        cols[k].astype(str) if cols[k].dtype == object else cols[k]
+        for k in reversed(keys)
+    ))
+    return {f: col[order] for f, col in cols.items()}
+
+
+def channel_ranges(conn, n_jobs):
+    """
+    頻道依名稱排好，按 main 的筆數切成最多 n_jobs 段連續的範圍
+    return: [(第一個頻道, 最後一個頻道), ...]
+    """
+    rows = conn.execute(
+        "SELECT channel, COUNT(*) FROM main GROUP BY channel ORDER BY channel"
+    ).fetchall()
+    if not rows:
+        return []
+
+    names = [name for name, _ in rows]
+    total = np.cumsum([n for _, n in rows])
+    # 第 i 段到累計筆數到 total * i / n_jobs 的那個頻道為止
+    ends = np.searchsorted(total, total[-1] * np.arange(1, n_jobs) / n_jobs)
+    starts = np.unique(np.r_[0, ends + 1])
+    starts = starts[starts < len(names)].tolist()
+    return [
+        (names[lo], names[hi - 1])
+        for lo, hi in zip(starts, starts[1:] + [len(names)])
+    ]
+
+
+def _scan_partition(db_path, sql, minutes, channels):
+    """
+    worker：唯讀打開 db_path，只讀 channels = (第一個, 最後一個) 這段頻道
+    （sql 裡的兩個 ? 依序綁這兩個值）
+    """
+    conn = stage_db.connect(db_path)
+    try:
+        platforms.register(conn)
+        parts = list(scan(conn.execute(sql, channels), minutes))
+    finally:
+        conn.close()
+    if not parts:
+        return None
+    streams, gaps = zip(*parts)
+    return _concat(streams, FIELDS), _concat(gaps, GAP_FIELDS)
+
+
+def scan_parallel(conn, db_path, sql, minutes, n_jobs):
+    """
+    sql 同 scan，但 WHERE 裡要有 channel BETWEEN ? AND ?（只有這兩個參數）
+    頻道依 channel_ranges 切給 n_jobs 個 process（分法固定），
+    回傳 (summarize, find_gaps) 的結果，依 (stream id, 頻道[, 時間]) 排好
+    """
+    partitions = channel_ranges(conn, n_jobs)
+    if not partitions:
+        return None
+
+    with ProcessPoolExecutor(max_workers=len(partitions)) as pool:
+        parts = [
+            part
+            for part in pool.map(
+                _scan_partition,
+                [db_path] * len(partitions),
+                [sql] * len(partitions),
+                [minutes] * len(partitions),
+                partitions,
+            )
+            if part is not None
+        ]
+    if not parts:
+        return None
+
+    streams, gaps = zip(*parts)
+    return (
+        _sorted(_concat(streams, FIELDS), "stream_id", "channel"),
+        _sorted(_concat(gaps, GAP_FIELDS), "stream_id", "channel", "start_ts"),
+    )
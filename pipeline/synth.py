@@ -0,0 +1,364 @@
+"""
+產生假的 data.db（照 data_construct.sql 的 schema），拿來測 pipeline 的速度
+
+python -m pipeline.synth OUT.db [--channels 200] [--months 6] [--seed 0] ...
+
+- 每個頻道有自己的 YT / TW 基準人數（log-normal），每場直播再加上
+  場次偏移、時段效果、每筆的雜訊
+- 爬蟲大約每 15 分鐘抓一次，秒數隨機（HH:MM:SS），偶爾漏抓
+- 故意放進：重複的資料、stream id 為 0 的資料、極端值（很高 / 很低）
+- main.yt_number / tw_number 對應 stream.id；接續的直播記在 same_stream
+
+用 numpy 一次產生一整批，再 executemany 寫進去，1 億筆大約幾分鐘。
+"""
+import argparse
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+SCHEMA_SQL = ROOT_PATH / "data_construct.sql"
+
+SLOT_SECONDS = 15 * 60
+SLOTS_PER_DAY = 24 * 60 * 60 // SLOT_SECONDS
+CHUNK_ROWS = 2_000_000      # 每批大約寫幾筆 main
+
+GROUPS = ["子午", "其他", None]
+GROUP_P = [0.3, 0.5, 0.2]
+
+
+def _time_table():
+    """
+    一天中每一秒的 HH:MM:SS 字串（用秒數直接查表，不用每筆 strftime）
+    """
+    return np.array(
+        [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)],
+        dtype=object,
+    )
+
+
+def _date_table(start, days):
+    return np.array(
+        [(start + timedelta(days=d)).isoformat() for d in range(days)],
+        dtype=object,
+    )
+
+
+def make_channels(rng, n):
+    """
+    頻道參數：YT / TW 的 log 平均、每場開 YT / TW 的機率
+    """
+    yt_mu = rng.normal(5.0, 1.2, n)
+    tw_mu = yt_mu - rng.normal(1.2, 0.6, n)
+
+    kind = rng.choice(3, n, p=[0.5, 0.35, 0.15])     # 0 = 只有 YT，1 = 雙平台，2 = 以 TW 為主
+    p_yt = np.select([kind == 0, kind == 1, kind == 2], [0.97, 0.9, 0.2])
+    p_tw = np.select([kind == 0, kind == 1, kind == 2], [0.02, 0.7, 0.95])
+
+    return {
+        "id": np.array([f"UC{i:06d}" for i in range(n)], dtype=object),
+        "name": np.array([f"vtuber_{i}" for i in range(n)], dtype=object),
+        "group": rng.choice(np.array(GROUPS, dtype=object), n, p=GROUP_P),
+        "yt_mu": yt_mu,
+        "tw_mu": tw_mu,
+        "p_yt": p_yt,
+        "p_tw": p_tw,
+        "rate": rng.gamma(2.0, 0.3, n),     # 每天平均開幾場
+    }
+
+
+def make_broadcasts(rng, ch, total_slots, zero_id_rate):
+    """
+    每場直播：頻道、開始時段、長度（時段數）、YT / TW 的 stream id
+    """
+    days = total_slots / SLOTS_PER_DAY
+    counts = rng.poisson(ch["rate"] * days)
+    channel = np.repeat(np.arange(len(counts)), counts)
+    n = len(channel)
+
+    # 大多在晚上開台
+    hour = rng.normal(20.5, 3.5, n) % 24
+    day = rng.integers(0, max(int(days), 1), n)
+    start = day * SLOTS_PER_DAY + (hour * 4).astype(np.int64)
+    length = np.clip(rng.lognormal(2.4, 0.5, n).astype(np.int64), 2, 48)
+
+    order = np.lexsort((channel, start))
+    channel, start, length = channel[order], start[order], length[order]
+
+    has_yt = rng.random(n) < ch["p_yt"][channel]
+    has_tw = rng.random(n) < ch["p_tw"][channel]
+
+    # 兩個平台都沒有 → stream id 全是 0 的資料（1_0 會刪掉）
+    no_id = rng.random(n) < zero_id_rate
+    has_yt &= ~no_id
+    has_tw &= ~no_id
+    fallback = ~(has_yt | has_tw) & ~no_id
+    has_yt |= fallback
+
+    n_entry = has_yt.astype(np.int64) + has_tw
+    base = np.cumsum(n_entry) - n_entry + 1
+    yt_id = np.where(has_yt, base, 0)
+    tw_id = np.where(has_tw, base + has_yt, 0)
+
+    return {
+        "channel": channel,
+        "start": start,
+        "length": length,
+        "yt_id": yt_id,
+        "tw_id": tw_id,
+        "offset": rng.normal(0, 0.3, n),    # 這場比平常好 / 差
+    }
+
+
+def make_rows(rng, ch, bc, sel, opts):
+    """
+    把 sel 這幾場直播展開成 main 的資料列（已經依時間排序）
+    return: (seconds, channel, youtube, twitch, yt_number, tw_number)
+    """
+    length = bc["length"][sel]
+    idx = np.repeat(sel, length)
+    first = np.cumsum(length) - length
+    k = np.arange(len(idx)) - np.repeat(first, length)
+    slot = bc["start"][idx] + k
+
+    # 漏抓
+    keep = rng.random(len(idx)) >= opts.missing_rate
+    idx, slot = idx[keep], slot[keep]
+    n = len(idx)
+
+    channel = bc["channel"][idx]
+    yt_number = bc["yt_id"][idx]
+    tw_number = bc["tw_id"][idx]
+
+    # 時段效果：晚上 9 點左右最高
+    tod = 0.25 * np.cos(2 * np.pi * ((slot % SLOTS_PER_DAY) - 84) / SLOTS_PER_DAY)
+    level = bc["offset"][idx] + tod
+
+    youtube = np.exp(ch["yt_mu"][channel] + level + rng.normal(0, 0.35, n))
+    twitch = np.exp(ch["tw_mu"][channel] + level + rng.normal(0, 0.45, n))
+
+    # 極端值：少數特別高（被推薦 / 合作）或接近 0（斷線）
+    spike = rng.random(n) < opts.outlier_rate
+    youtube[spike] *= rng.uniform(5, 30, spike.sum())
+    drop = rng.random(n) < opts.outlier_rate
+    youtube[drop] = rng.integers(0, 5, drop.sum())
+    twitch[rng.random(n) < opts.outlier_rate] = 0
+
+    youtube = np.where(yt_number != 0, youtube, 0).astype(np.int64)
+    twitch = np.where(tw_number != 0, twitch, 0).astype(np.int64)
+
+    # 偶爾抓到 stream id 但是沒填（0）
+    glitch = rng.random(n) < opts.zero_id_rate / 4
+    yt_number = np.where(glitch, 0, yt_number)
+
+    seconds = slot * SLOT_SECONDS + _jitter(rng, opts.jitter, n)
+
+    # 重複的資料（同一次爬蟲寫了兩次）
+    times = 1 + (rng.random(n) < opts.dup_rate)
+    cols = [
+        np.repeat(c, times)
+        for c in (seconds, channel, youtube, twitch, yt_number, tw_number)
+    ]
+
+    order = np.argsort(cols[0], kind="stable")
+    return [c[order] for c in cols]
+
+
+def write_streamers(conn, ch):
+    conn.executemany(
+        """
+        INSERT INTO streamer (channel_id, channel_name, yt_url, tw_url, `group`)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                cid, name,
+                f"https://www.youtube.com/channel/{cid}" if p_yt > 0.5 else None,
+                f"https://www.twitch.tv/{name}" if p_tw > 0.5 else None,
+                group,
+            )
+            for cid, name, group, p_yt, p_tw in zip(
+                ch["id"], ch["name"], ch["group"], ch["p_yt"], ch["p_tw"]
+            )
+        ]
+    )
+
+
+def write_streams(conn, ch, bc, slot_str):
+    """
+    stream：每場直播每個平台一筆；same_stream：同頻道斷線 1 小時內又開的
+    """
+    start = bc["start"]
+    end = start + bc["length"] - 1
+    names = ch["name"][bc["channel"]]
+
+    n = 0
+    for sid, kind, url in (
+        (bc["yt_id"], "youtube", "https://www.youtube.com/watch?v="),
+        (bc["tw_id"], "twitch", "https://www.twitch.tv/videos/"),
+    ):
+        has = sid != 0
+        conn.executemany("""
+            INSERT INTO stream (id, channel_name, name, type, url, start_time, end_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, zip(
+            sid[has].tolist(),
+            names[has].tolist(),
+            [f"stream #{i}" for i in sid[has]],
+            [kind] * int(has.sum()),
+            [f"{url}{i}" for i in sid[has]],
+            slot_str[start[has]].tolist(),
+            slot_str[end[has]].tolist(),
+        ))
+        n += int(has.sum())
+
+    order = np.lexsort((start, bc["channel"]))
+    c = bc["channel"][order]
+    s, e = start[order], end[order]
+    yt = bc["yt_id"][order]
+
+    cont = (
+        (c[1:] == c[:-1])
+        & (s[1:] - e[:-1] <= 4)
+        & (yt[1:] != 0) & (yt[:-1] != 0)
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO same_stream (from_id, to_id, time) VALUES (?, ?, ?)",
+        zip(
+            yt[1:][cont].tolist(),
+            yt[:-1][cont].tolist(),
+            slot_str[s[1:][cont]].tolist(),
+        )
+    )
+    return n
+
+
+def _jitter(rng, jitter, n):
+    """
+    每輪爬蟲晚了幾秒：0 ~ jitter - 1（jitter = 0 就是都準時）
+    """
+    return rng.integers(0, max(jitter, 1), n)
+
+
+def write_working(conn, rng, total_slots, start_dt, jitter):
+    """
+    working：爬蟲每一輪的開始 / 結束時間
+    """
+    begin = np.arange(total_slots) * SLOT_SECONDS + _jitter(rng, jitter, total_slots)
+    timer = rng.uniform(20, 120, total_slots).round(2)
+
+    def fmt(sec):
+        return (start_dt + timedelta(seconds=float(sec))).strftime("%Y-%m-%d %H:%M:%S")
+
+    conn.executemany(
+        'INSERT INTO working (time, finish, timer, kind, "create") VALUES (?, ?, ?, ?, ?)',
+        [
+            (fmt(b), fmt(b + t), float(t), "auto", None)
+            for b, t in zip(begin, timer)
+        ]
+    )
+
+
+def generate(out, opts):
+    rng = np.random.default_rng(opts.seed)
+    start = date.fromisoformat(opts.start)
+    start_dt = datetime.combine(start, datetime.min.time())
+    days = opts.months * 30
+    total_slots = days * SLOTS_PER_DAY
+
+    conn = sqlite3.connect(out)
+    conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;")
+    conn.executescript(SCHEMA_SQL.read_text(encoding="utf-8"))
+
+    time_str = _time_table()
+    date_str = _date_table(start, days + 2)
+
+    # 每個時段開頭的 "YYYY-MM-DD HH:MM:SS"（stream 的開始 / 結束時間用）
+    slot = np.arange(total_slots + 2 * SLOTS_PER_DAY)
+    slot_str = date_str[slot // SLOTS_PER_DAY] + " " + time_str[
+        slot % SLOTS_PER_DAY * SLOT_SECONDS
+    ]
+
+    ch = make_channels(rng, opts.channels)
+    bc = make_broadcasts(rng, ch, total_slots, opts.zero_id_rate)
+    print(f"📺 {opts.channels} 個頻道、{days} 天、{len(bc['channel'])} 場直播")
+
+    write_streamers(conn, ch)
+    n_stream = write_streams(conn, ch, bc, slot_str)
+    write_working(conn, rng, total_slots, start_dt, opts.jitter)
+    conn.commit()
+    print(f"✅ streamer / stream（{n_stream} 筆）/ working / same_stream 完成")
+
+    # 一次展開一批直播，每批大約 CHUNK_ROWS 筆
+    # 一場直播都沒有（頻道很少、期間很短）就只有 [0]，main 是空的
+    rows_per = np.cumsum(bc["length"])
+    n_rows = rows_per[-1] if len(rows_per) else 0
+    edges = np.unique(np.concatenate([
+        [0],
+        np.searchsorted(rows_per, np.arange(CHUNK_ROWS, n_rows, CHUNK_ROWS)),
+        [len(rows_per)],
+    ]))
+
+    total = 0
+    t0 = time.perf_counter()
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        sec, channel, yt, tw, yt_n, tw_n = make_rows(
+            rng, ch, bc, np.arange(lo, hi), opts
+        )
+
+        conn.executemany(
+            """
+            INSERT INTO main (date, time, channel, youtube, twitch, yt_number, tw_number)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            zip(
+                date_str[sec // 86400].tolist(),
+                time_str[sec % 86400].tolist(),
+                ch["id"][channel].tolist(),
+                yt.tolist(), tw.tolist(), yt_n.tolist(), tw_n.tolist(),
+            )
+        )
+        conn.commit()
+
+        total += len(sec)
+        rate = total / (time.perf_counter() - t0)
+        print(f"  ⏳ main 已寫入 {total:,} 筆（{rate:,.0f} 筆/秒）")
+
+    conn.close()
+    print(f"🎉 完成：{out}（main {total:,} 筆）")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="產生測試用的 data.db")
+    parser.add_argument("out", type=Path)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--start", default="2025-01-01")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dup-rate", type=float, default=0.05)
+    parser.add_argument("--missing-rate", type=float, default=0.05)
+    parser.add_argument("--outlier-rate", type=float, default=0.005)
+    parser.add_argument("--zero-id-rate", type=float, default=0.02)
+    parser.add_argument("--jitter", type=int, default=240, help="每輪爬蟲最多晚幾秒")
+    parser.add_argument("--overwrite", action="store_true")
+    opts = parser.parse_args()
+
+    if opts.channels < 0 or opts.months < 0:
+        parser.error("--channels / --months 不能是負的")
+    if not 0 <= opts.jitter <= SLOT_SECONDS:
+        parser.error(f"--jitter 要在 0 ~ {SLOT_SECONDS} 秒之間（超過就跑到下一個時段了）")
+
+    if opts.out.exists():
+        if not opts.overwrite:
+            raise FileExistsError(f"{opts.out} 已存在（要覆蓋請加 --overwrite）")
+        opts.out.unlink()
+
+    generate(opts.out, opts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+(頻道, 時段) 的統計量（yt_time_acc / tw_time_acc）
+
+2_1 / 2_2 / 3_2 的 time_profile 都是「每個頻道 × 每個時段」的筆數、平均，
+先累加成 *_time_acc (channel_id, slot, n, sum[, ln_n, ln_sum])，
+finalize 再拿 channel_avg × time_slots 去 LEFT JOIN 這張小表補 0。
+
+accumulate 只掃一次 main：用整數 slot 分組，
+(channel, slot, 各平台的 stream id / 觀看數) 的 covering index
+（timeslot.index_main）剛好是分組的順序，不用排序也不用回表；
+要算的平台在同一次掃描裡一起算完，再各自併進自己的 *_time_acc。
+"""
+from pipeline import platforms
+
+
+def create_acc(conn, keys, ln=False):
+    """
+    建立 keys（平台 key）各自的 *_time_acc；ln=True 多存觀看數 > 0 的 ln 筆數 / 總和
+    """
+    for p in keys:
+        conn.execute(f"""
+        CREATE TABLE {p}_time_acc (
+            channel_id TEXT,
+            slot INTEGER,
+            n INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            {"ln_n INTEGER NOT NULL, ln_sum REAL NOT NULL," if ln else ""}
+            PRIMARY KEY (channel_id, slot)
+        );
+        """)
+
+
+def accumulate(conn, window, keys, ln=False):
+    """
+    把 window 內 main 的資料依 (頻道, slot) 加進各平台的 *_time_acc
+    """
+    cols = []
+    for p in keys:
+        v = platforms.value_sql(platforms.BY_KEY[p])
+        cols += [f"COUNT({v}) AS {p}_n", f"TOTAL({v}) AS {p}_sum"]
+        if ln:
+            cols += [f"COUNT(ln({v})) AS {p}_ln_n", f"TOTAL(ln({v})) AS {p}_ln_sum"]
+
+    on_any = " OR ".join(f"{platforms.BY_KEY[p].stream_id} != 0" for p in keys)
+
+    conn.execute("DROP TABLE IF EXISTS temp.time_part")
+    conn.execute(f"""
+    CREATE TEMP TABLE time_part AS
+    SELECT
+        channel,
+        slot,
+        {", ".join(cols)}
+    FROM main
+    WHERE ({on_any}) AND {window.where_ts()}
+    GROUP BY channel, slot
+    """)
+
+    fields = ["n", "sum"] + (["ln_n", "ln_sum"] if ln else [])
+    for p in keys:
+        conn.execute(f"""
+        INSERT INTO {p}_time_acc (channel_id, slot, {", ".join(fields)})
+        SELECT channel, slot, {", ".join(f"{p}_{f}" for f in fields)}
+        FROM temp.time_part
+        WHERE {p}_n > 0
+        ON CONFLICT (channel_id, slot) DO UPDATE SET
+            {", ".join(f"{f} = {f} + excluded.{f}" for f in fields)}
+        """)
+
+    conn.execute("DROP TABLE temp.time_part")
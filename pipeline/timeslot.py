@@ -0,0 +1,505 @@
+"""
+時間區塊（重取樣）
+
+區塊寬度和每個區塊怎麼取值由環境變數決定（runner 的 --bucket / --agg 會設定），
+沒設就跟原本一樣：15 分鐘、平均。
+    PIPELINE_BUCKET_MINUTES   5 / 10 / 15 / 30 / 60（要能整除 60）
+    PIPELINE_BUCKET_AGG       mean（平均，無條件捨去成整數）/ max / last（區塊內最後一筆）
+
+1_1 依設定把時間離散化，並把定義寫成兩張表，下游經由 lineage 都看得到：
+    time_bucket (minutes, agg)
+    time_slots  (time, slot)    一天所有區塊的開頭 HH:MM 和它是第幾格
+2_1 / 2_2 / 3_2 / stream_ana 一律讀這兩張表，不再自己算。
+
+1_1 也在 main 加上兩個整數欄位，之後的 stage 比較 / 分組都用它們，不用再拆字串：
+    ts    區塊開頭的 epoch 分鐘（date / time 當成 UTC）
+    slot  一天中的第幾格（15 分鐘就是 0–95）
+
+另外有 NumPy 版的離散化 / 分組取值，給探索用（pipeline 不會呼叫）：不用重跑 pipeline，
+直接把 1_1 的輸入（預設 data_1_0.db，也就是 1_0 過濾之後）換一種區塊設定重取樣。
+分組跟 1_1 一樣，--check 拿同一組設定跑出來的 stage 檔對一次，確認兩邊結果相同：
+    python -m pipeline.timeslot OUT [--src ver_1/data_1_0.db] [--minutes 60] [--agg max]
+    python -m pipeline.timeslot OUT --minutes 15 --check ver_1/data_1_1.db
+"""
+import argparse
+import calendar
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+from pipeline import platforms, stage_db
+
+MINUTES_ENV = "PIPELINE_BUCKET_MINUTES"
+AGG_ENV = "PIPELINE_BUCKET_AGG"
+
+DEFAULT_MINUTES = 15
+DEFAULT_AGG = "mean"
+AGGS = ("mean", "max", "last")
+
+CHUNK_ROWS = 1_000_000
+
+# 原始資料是 HH:MM:SS，1_1 之後是 HH:MM
+_CANONICAL_GLOB = "[0-9][0-9]:[0-9][0-9]*"
+
+
+class Bucket:
+    """
+    一種區塊定義：寬度（分鐘）+ 區塊內的取值方式
+    """
+
+    def __init__(self, minutes=DEFAULT_MINUTES, agg=DEFAULT_AGG):
+        minutes = int(minutes)
+        if minutes <= 0 or 60 % minutes != 0:
+            raise ValueError(f"區塊寬度要能整除 60 分鐘：{minutes}")
+        if agg not in AGGS:
+            raise ValueError(f"不支援的取值方式：{agg}（可用：{', '.join(AGGS)}）")
+        self.minutes = minutes
+        self.agg = agg
+
+    def __str__(self):
+        return f"{self.minutes}min/{self.agg}"
+
+    def __eq__(self, other):
+        return isinstance(other, Bucket) and str(self) == str(other)
+
+    @classmethod
+    def read(cls, conn, schema=None):
+        """
+        stage 裡記錄的區塊定義（1_1 之前 / 舊的 stage 檔沒有，就是預設值）
+        schema: ATTACH 進來的另一個檔
+        """
+        table = f"{schema}.time_bucket" if schema else "time_bucket"
+        try:
+            row = conn.execute(f"SELECT minutes, agg FROM {table}").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        return cls(*row) if row else cls()
+
+    @property
+    def per_day(self):
+        return 24 * 60 // self.minutes
+
+    def slots(self):
+        """
+        一天所有區塊的開頭：["00:00", "00:15", ...]
+        """
+        return [
+            f"{m // 60:02d}:{m % 60:02d}"
+            for m in range(0, 24 * 60, self.minutes)
+        ]
+
+    def block_hhmm(self, time_str):
+        """
+        time_str: HH:MM:SS（或 HH:MM）
+        return:   所在區塊的開頭 HH:MM
+        """
+        h, m = map(int, time_str.split(":")[:2])
+        return f"{h:02d}:{m // self.minutes * self.minutes:02d}"
+
+    def floor(self, date_str, time_str):
+        """
+        return: 所在區塊的開頭 YYYY-MM-DD HH:MM
+        """
+        return f"{date_str} {self.block_hhmm(time_str)}"
+
+    def next(self, start):
+        """
+        start: YYYY-MM-DD HH:MM → 下一個區塊的開頭
+        """
+        dt = datetime.strptime(start, "%Y-%m-%d %H:%M")
+        return (dt + timedelta(minutes=self.minutes)).strftime("%Y-%m-%d %H:%M")
+
+    def slot_of(self, time_str):
+        h, m = map(int, time_str.split(":")[:2])
+        return (h * 60 + m) // self.minutes
+
+    def expected_points(self, start_ts, end_ts):
+        """
+        start_ts ~ end_ts（epoch 分鐘，兩端都算）之間應該有幾個區塊
+        """
+        return (end_ts - start_ts) // self.minutes + 1
+
+    # ── SQL ──────────────────────────────
+
+    def register(self, conn):
+        """
+        讓 sql() 用到的函式在這個連線上可以用
+        """
+        conn.create_function("bucket_hhmm", 1, self.block_hhmm, deterministic=True)
+
+    def sql(self, col="time"):
+        """
+        離散化的 SQL；正常格式直接用字串算，其他格式交給 bucket_hhmm（結果一樣）
+        """
+        return f"""
+        CASE
+            WHEN {col} GLOB '{_CANONICAL_GLOB}'
+            THEN substr({col}, 1, 3) || printf('%02d', CAST(substr({col}, 4, 2) AS INTEGER) / {self.minutes} * {self.minutes})
+            ELSE bucket_hhmm({col})
+        END
+        """
+
+    def window_sql(self, col, partition, order_col="time", tie_col="id"):
+        """
+        區塊內取值的 window function：每一筆都拿到所在分組的值
+        （last 依 order_col 取最後一筆；同一個時間有好幾筆就取 tie_col 最大的，
+        也就是最後寫進來的，跟 NumPy 版一樣）
+        """
+        over = f"PARTITION BY {partition}"
+        if self.agg == "mean":
+            return f"CAST(AVG({col}) OVER ({over}) AS INTEGER)"
+        if self.agg == "max":
+            return f"MAX({col}) OVER ({over})"
+        return f"FIRST_VALUE({col}) OVER ({over} ORDER BY {order_col} DESC, {tie_col} DESC)"
+
+    def write_tables(self, conn):
+        """
+        把區塊定義寫進 stage：time_bucket + time_slots
+        """
+        conn.execute("""
+        CREATE TABLE time_bucket (
+            minutes INTEGER NOT NULL,
+            agg TEXT NOT NULL
+        );
+        """)
+        conn.execute(
+            "INSERT INTO time_bucket (minutes, agg) VALUES (?, ?)",
+            (self.minutes, self.agg)
+        )
+
+        conn.execute("""
+        CREATE TABLE time_slots (
+            time TEXT PRIMARY KEY,
+            slot INTEGER NOT NULL UNIQUE
+        );
+        """)
+        conn.executemany(
+            "INSERT INTO time_slots (time, slot) VALUES (?, ?)",
+            [(t, i) for i, t in enumerate(self.slots())]
+        )
+        conn.commit()
+
+    def ts_sql(self, date_col="date", time_col="time"):
+        """
+        已經離散化的 date / time → ts（epoch 分鐘）
+        """
+        return f"CAST(strftime('%s', {date_col} || ' ' || {time_col}) AS INTEGER) / 60"
+
+    def slot_sql(self, time_col="time"):
+        """
+        已經離散化的 time → slot
+        """
+        return (
+            f"(CAST(substr({time_col}, 1, 2) AS INTEGER) * 60"
+            f" + CAST(substr({time_col}, 4, 2) AS INTEGER)) / {self.minutes}"
+        )
+
+
+def to_ts(start):
+    """
+    YYYY-MM-DD HH:MM → ts（epoch 分鐘）
+    """
+    dt = datetime.strptime(start, "%Y-%m-%d %H:%M")
+    return calendar.timegm(dt.timetuple()) // 60
+
+
+def from_ts(ts):
+    """
+    ts → YYYY-MM-DD HH:MM
+    """
+    return datetime.fromtimestamp(ts * 60, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def from_ts_array(ts):
+    """
+    from_ts 的陣列版：ts 陣列 → YYYY-MM-DD HH:MM 字串陣列
+    """
+    minutes = np.asarray(ts, dtype=np.int64).astype("datetime64[m]")
+    if minutes.size == 0:
+        # np.char.replace 遇到空陣列會出錯（沒有缺漏的那一批）
+        return np.array([], dtype=str)
+    return np.char.replace(np.datetime_as_string(minutes, unit="m"), "T", " ")
+
+
+TIME_COLUMNS = {"ts": "INTEGER", "slot": "INTEGER"}
+
+
+def missing_columns(conn, table="main"):
+    have = {row[1] for row in conn.execute(f'PRAGMA main.table_info("{table}")')}
+    return [col for col in TIME_COLUMNS if col not in have]
+
+
+def migrate(conn, table="main"):
+    """
+    main 還沒有 ts / slot 就加上去
+    """
+    for col in missing_columns(conn, table):
+        conn.execute(f'ALTER TABLE main."{table}" ADD COLUMN {col} {TIME_COLUMNS[col]}')
+
+
+def index_main(conn):
+    """
+    main 的整數時間 index：
+    ts             增量更新的範圍查詢
+    channel, slot  頻道 × 時段的統計（含人數欄位，不用回表）
+    """
+    conn.execute('CREATE INDEX IF NOT EXISTS main.idx_main_ts ON "main"(ts);')
+    values = ", ".join(f"{p.stream_id}, {p.viewers}" for p in platforms.PLATFORMS)
+    conn.execute(f"""
+    CREATE INDEX IF NOT EXISTS main.idx_main_channel_slot
+    ON "main"(channel, slot, {values});
+    """)
+    conn.commit()
+
+
+def current():
+    """
+    這次執行的區塊定義（環境變數）
+    """
+    return Bucket(
+        os.environ.get(MINUTES_ENV, DEFAULT_MINUTES),
+        os.environ.get(AGG_ENV, DEFAULT_AGG),
+    )
+
+
+# ── NumPy ──────────────────────────────
+
+def second_of_day(times):
+    """
+    times: HH:MM 或 HH:MM:SS 字串陣列
+    return: 一天中的第幾秒（int32 陣列）
+    """
+    raw = np.asarray(times, dtype="S8")
+    d = raw.view(np.uint8).reshape(len(raw), 8).astype(np.int32) - ord("0")
+    colon = ord(":") - ord("0")
+
+    digit = (d >= 0) & (d <= 9)
+    ok = (d[:, 2] == colon) & digit[:, [0, 1, 3, 4]].all(axis=1)
+    has_sec = (d[:, 5] == colon) & digit[:, 6] & digit[:, 7]
+
+    out = (
+        (d[:, 0] * 10 + d[:, 1]) * 3600
+        + (d[:, 3] * 10 + d[:, 4]) * 60
+        + np.where(has_sec, d[:, 6] * 10 + d[:, 7], 0)
+    )
+
+    # 沒補零之類的格式逐筆處理
+    for i in np.flatnonzero(~ok):
+        parts = list(map(int, raw[i].decode().split(":"))) + [0]
+        out[i] = parts[0] * 3600 + parts[1] * 60 + parts[2]
+    return out
+
+
+def aggregate(keys, values, order, agg):
+    """
+    依 keys 分組取值
+    keys:   每筆資料的分組（int64）
+    values: 數值（float，不可以有 NaN）
+    order:  last 用的先後順序（一樣的話，後面的那筆算最後）
+    return: (分組, 每組筆數, 每組的值)，分組由小到大
+    """
+    groups, inverse, counts = np.unique(
+        keys, return_inverse=True, return_counts=True
+    )
+
+    if agg == "mean":
+        sums = np.bincount(inverse, weights=values, minlength=len(groups))
+        out = np.trunc(sums / counts)     # 跟 CAST(AVG(x) AS INTEGER) 一樣
+    elif agg == "max":
+        out = np.full(len(groups), -np.inf)
+        np.maximum.at(out, inverse, values)
+    else:
+        idx = np.lexsort((order, inverse))
+        last = np.r_[inverse[idx][1:] != inverse[idx][:-1], True]
+        out = values[idx[last]]
+
+    return groups, counts, out
+
+
+def resample_platform(chunks, bucket):
+    """
+    chunks: [(channel, stream_id, date, time, viewers) 各欄陣列, ...]
+    return: 每個 (stream, 頻道, 日期, 區塊) 一筆的欄位陣列
+
+    分組跟 1_1 的 window_sql 一樣是 (日期, 區塊, stream id)：同一個 stream id
+    出現在好幾個頻道（連動）時併在一起算，每個頻道各一筆、值都一樣；
+    points 是算出這個值用了幾筆
+    """
+    channel, sid, date, times, viewers = (
+        np.concatenate(cols) for cols in zip(*chunks)
+    )
+
+    keep = ~np.isnan(viewers)
+    channel, sid, date, times, viewers = (
+        a[keep] for a in (channel, sid, date, times, viewers)
+    )
+    if len(sid) == 0:
+        return None
+
+    second = second_of_day(times)
+    day = np.asarray(date, dtype="datetime64[D]").astype(np.int64)
+    slot = second // 60 // bucket.minutes
+
+    sids, sid_idx = np.unique(sid, return_inverse=True)
+    n_sid = len(sids)
+
+    day0 = day.min()
+    keys = ((day - day0) * bucket.per_day + slot) * n_sid + sid_idx
+
+    groups, counts, out = aggregate(keys, viewers, second, bucket.agg)
+
+    # 每個分組裡出現過的頻道各一筆
+    channels, ch_idx = np.unique(channel.astype(str), return_inverse=True)
+    pairs = np.unique(np.searchsorted(groups, keys) * len(channels) + ch_idx)
+    g = pairs // len(channels)
+
+    g_slot = (groups[g] // n_sid) % bucket.per_day
+    g_day = groups[g] // n_sid // bucket.per_day + day0
+    slot_min = g_slot * bucket.minutes
+
+    return {
+        "stream_id": sids[groups[g] % n_sid],
+        "channel": channels[pairs % len(channels)],
+        "date": np.datetime_as_string(g_day.astype("datetime64[D]")),
+        "time": np.char.add(
+            np.char.add(np.char.zfill((slot_min // 60).astype(str), 2), ":"),
+            np.char.zfill((slot_min % 60).astype(str), 2),
+        ),
+        "viewers": out[g],
+        "points": counts[g],
+    }
+
+
+def resample(src_db, out_db, bucket):
+    """
+    src_db 的 main → OUT 的 viewers（每個 stream × 頻道 × 日期 × 區塊一筆）+ 區塊定義
+    """
+    src = stage_db.connect(src_db)
+    try:
+        platforms.register(src)
+        total = {}
+        for k, p in enumerate(platforms.PLATFORMS, 1):
+            cur = src.execute("""
+                SELECT channel, stream_id, date, time, viewers
+                FROM obs
+                WHERE k = ?
+                ORDER BY id
+            """, (k,))
+            chunks = []
+            while rows := cur.fetchmany(CHUNK_ROWS):
+                channel, sid, date, times, viewers = zip(*rows)
+                chunks.append((
+                    np.array(channel, dtype=object),
+                    np.array(sid, dtype=np.int64),
+                    np.array(date),
+                    np.array(times),
+                    np.array(viewers, dtype=float),
+                ))
+            total[p.label] = resample_platform(chunks, bucket) if chunks else None
+    finally:
+        src.close()
+
+    out = sqlite3.connect(out_db)
+    try:
+        bucket.write_tables(out)
+        out.execute("""
+        CREATE TABLE viewers (
+            platform TEXT NOT NULL,
+            stream_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            viewers REAL NOT NULL,
+            points INTEGER NOT NULL,      -- 區塊內原本有幾筆
+            PRIMARY KEY (platform, stream_id, channel, date, time)
+        );
+        """)
+
+        for platform, cols in total.items():
+            if cols is None:
+                continue
+            out.executemany(
+                "INSERT INTO viewers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip(
+                    [platform] * len(cols["stream_id"]),
+                    cols["stream_id"].tolist(),
+                    cols["channel"].tolist(),
+                    cols["date"].tolist(),
+                    cols["time"].tolist(),
+                    cols["viewers"].tolist(),
+                    cols["points"].tolist(),
+                )
+            )
+            print(f"  ✅ {platform}：{len(cols['stream_id']):,} 個區塊")
+        out.commit()
+    finally:
+        out.close()
+
+
+def check(out_db, stage):
+    """
+    OUT 的 viewers 跟 stage 檔（1_1 之後）main 有開台的 (stream, 頻道, 日期, 區塊, 人數) 比對
+    return: (只在 OUT 的筆數, 只在 stage 的筆數)
+    """
+    conn = stage_db.connect(stage)
+    try:
+        built = Bucket.read(conn)
+        conn.execute("ATTACH DATABASE ? AS out", (stage_db._ro_uri(out_db),))
+        mine = Bucket.read(conn, "out")
+        if built != mine:
+            raise ValueError(f"{Path(stage).name} 是 {built}，{Path(out_db).name} 是 {mine}，無法比對")
+
+        platforms.register(conn)
+        cols = "label AS platform, stream_id, channel, date, time, CAST(viewers AS REAL)"
+        out_cols = "platform, stream_id, channel, date, time, viewers"
+        only_out, only_stage = (
+            conn.execute(f"SELECT COUNT(*) FROM (SELECT {a} FROM {x} EXCEPT SELECT {b} FROM {y})").fetchone()[0]
+            for a, x, b, y in (
+                (out_cols, "out.viewers", cols, "obs"),
+                (cols, "obs", out_cols, "out.viewers"),
+            )
+        )
+    finally:
+        conn.close()
+    return only_out, only_stage
+
+
+def main():
+    ver1 = Path(__file__).resolve().parent.parent / "ver_1"
+    parser = argparse.ArgumentParser(description="NumPy 重取樣（探索用，不經過 pipeline）")
+    parser.add_argument("out", help="輸出的 .db")
+    parser.add_argument("--src", default=str(ver1 / "data_1_0.db"), help="1_1 的輸入（1_0 過濾之後）")
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--agg", default=DEFAULT_AGG, choices=AGGS)
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--check", nargs="?", const=str(ver1 / "data_1_1.db"), metavar="STAGE_DB",
+                        help="跑完跟同樣區塊設定的 stage 檔比對（預設 data_1_1.db）")
+    opts = parser.parse_args()
+
+    out = Path(opts.out)
+    if out.exists():
+        if not opts.overwrite:
+            raise FileExistsError(f"{out} 已存在（要覆蓋請加 --overwrite）")
+        out.unlink()
+
+    bucket = Bucket(opts.minutes, opts.agg)
+    print(f"🕒 重取樣 {opts.src} → {out}（{bucket}）")
+    t0 = time.perf_counter()
+    resample(opts.src, out, bucket)
+    print(f"🎉 完成（{time.perf_counter() - t0:.1f}s）")
+
+    if opts.check:
+        only_out, only_stage = check(out, opts.check)
+        if only_out or only_stage:
+            raise SystemExit(
+                f"❌ 跟 {opts.check} 不一致：只在 {out.name} {only_out:,} 筆，只在 stage {only_stage:,} 筆"
+            )
+        print(f"✅ 跟 {opts.check} 一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+星期 × 時段的可合併統計（weekday_slot_acc）
+
+time_profile 只分時段；要問「週末晚上」「平日中午」就得再掃一次 main。
+weekday_slot_acc 把 main 累加在 (頻道, 平台, 月份, 星期, 時段) 這個粒度：
+
+    n, sum, sum_sq     觀看數的筆數 / 總和 / 平方和
+    ln_n, ln_sum       觀看數 > 0 的 ln 筆數 / 總和（幾何平均用）
+
+這些都可以直接相加，所以
+    增量更新：新資料依同一個粒度 GROUP BY 之後 ON CONFLICT 加上去，新的月份就是新的列
+    rollup：   任意幾個維度 GROUP BY 再 SUM，平均 / 標準差 / 幾何平均最後才算，
+              不用回頭讀 main
+
+weekday 是 0 = 週日 … 6 = 週六（同 SQLite strftime('%w')），由 ts 直接算：
+1970-01-01 是週四，所以是 (ts / 1440 + 4) % 7。
+"""
+from pipeline import platforms
+
+TABLE = "weekday_slot_acc"
+
+DIMENSIONS = ("channel_id", "platform", "month", "weekday", "slot")
+
+WEEKDAY_NAMES = ("週日", "週一", "週二", "週三", "週四", "週五", "週六")
+
+FIELDS = ("n", "sum", "sum_sq", "ln_n", "ln_sum")
+
+WEEKDAY_SQL = "(ts / 1440 + 4) % 7"
+
+
+def create(conn):
+    """
+    建立 weekday_slot_acc 和星期的維度表 weekdays
+    """
+    conn.execute(f"""
+    CREATE TABLE {TABLE} (
+        channel_id TEXT NOT NULL,
+        platform   TEXT NOT NULL,      -- 平台 key（yt / tw）
+        month      TEXT NOT NULL,      -- YYYY-MM
+        weekday    INTEGER NOT NULL,   -- 0 = 週日
+        slot       INTEGER NOT NULL,
+
+        n      INTEGER NOT NULL,
+        sum    REAL NOT NULL,
+        sum_sq REAL NOT NULL,
+        ln_n   INTEGER NOT NULL,
+        ln_sum REAL NOT NULL,
+
+        PRIMARY KEY (channel_id, platform, month, weekday, slot)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE weekdays (
+        weekday INTEGER PRIMARY KEY,
+        name    TEXT NOT NULL
+    );
+    """)
+    conn.executemany(
+        "INSERT INTO weekdays (weekday, name) VALUES (?, ?)",
+        enumerate(WEEKDAY_NAMES)
+    )
+
+
+def accumulate(conn, window):
+    """
+    把 window 內 main 的資料依 (頻道, 月份, 星期, 時段) 加進 weekday_slot_acc
+    所有平台在同一次掃描裡一起算（每個平台一組 CASE 欄位）
+    """
+    cols = []
+    for p in platforms.PLATFORMS:
+        v = platforms.value_sql(p)
+        cols += [
+            f"COUNT({v}) AS {p.key}_n",
+            f"TOTAL({v}) AS {p.key}_sum",
+            f"TOTAL(({v}) * ({v})) AS {p.key}_sum_sq",
+            f"COUNT(ln({v})) AS {p.key}_ln_n",
+            f"TOTAL(ln({v})) AS {p.key}_ln_sum",
+        ]
+    on_any = " OR ".join(f"{p.stream_id} != 0" for p in platforms.PLATFORMS)
+
+    conn.execute("DROP TABLE IF EXISTS temp.weekday_part")
+    conn.execute(f"""
+    CREATE TEMP TABLE weekday_part AS
+    SELECT
+        channel,
+        substr(date, 1, 7) AS month,
+        {WEEKDAY_SQL} AS weekday,
+        slot,
+        {", ".join(cols)}
+    FROM main
+    WHERE ({on_any}) AND {window.where_ts()}
+    GROUP BY channel, month, weekday, slot
+    """)
+
+    for p in platforms.PLATFORMS:
+        conn.execute(f"""
+        INSERT INTO {TABLE} (channel_id, platform, month, weekday, slot, {", ".join(FIELDS)})
+        SELECT channel, '{p.key}', month, weekday, slot, {", ".join(f"{p.key}_{f}" for f in FIELDS)}
+        FROM temp.weekday_part
+        WHERE {p.key}_n > 0
+        ON CONFLICT (channel_id, platform, month, weekday, slot) DO UPDATE SET
+            {", ".join(f"{f} = {f} + excluded.{f}" for f in FIELDS)}
+        """)
+
+    conn.execute("DROP TABLE temp.weekday_part")
+
+
+def rollup_sql(dims, where="1"):
+    """
+    依 dims（DIMENSIONS 的子集，可以是空的 = 全部加總）彙總的 SELECT：
+    dims 各欄 + n / avg_viewers / std_viewers / geo_avg_viewers
+    where 是 weekday_slot_acc 上的條件（例如 "platform = 'yt' AND weekday IN (0, 6)"）
+    """
+    for d in dims:
+        if d not in DIMENSIONS:
+            raise ValueError(f"沒有這個維度：{d}（可用：{', '.join(DIMENSIONS)}）")
+
+    keys = "".join(f"{d}, " for d in dims)
+    group = f"GROUP BY {', '.join(dims)} ORDER BY {', '.join(dims)}" if dims else ""
+    return f"""
+    SELECT
+        {keys}SUM(n) AS n,
+        SUM(sum) / SUM(n) AS avg_viewers,
+        sqrt(max(SUM(sum_sq) / SUM(n) - (SUM(sum) / SUM(n)) * (SUM(sum) / SUM(n)), 0))
+            AS std_viewers,
+        exp(SUM(ln_sum) / NULLIF(SUM(ln_n), 0)) AS geo_avg_viewers
+    FROM {TABLE}
+    WHERE {where}
+    {group}
+    """
+
+
+def rollup(conn, dims, where="1", params=()):
+    """
+    rollup_sql 的結果（cursor）；dashboard / notebook 直接用：
+
+        weekday_slot.rollup(conn, ["weekday", "slot"], "platform = ?", ("yt",))
+    """
+    return conn.execute(rollup_sql(dims, where), params)
+
+
+def materialize(conn, name, dims):
+    """
+    把常用的 rollup 存成表 name（整張重建；只讀 weekday_slot_acc，很快）
+    """
+    conn.execute(f"DROP TABLE IF EXISTS main.{name}")
+    conn.execute(f"CREATE TABLE main.{name} AS {rollup_sql(dims)}")
@@ -1,11 +1,13 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 VER3_PATH = TOP_PATH.parent / "ver_3"
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import stage_db
+
 SRC_DB = VER3_PATH / "data_3_2.db"
 DST_DB = TOP_PATH / "data_4_0.db"
 # =======================
@@ -15,16 +17,13 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_4_0.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # 1️⃣ 建立 stage 檔：上游唯讀 ATTACH，只寫本 stage 產生的表
+    #    要改上游的表（UPDATE / DELETE）先 conn.take("表名")
+    #    要依自然鍵去重複用 conn.take("表名", unique=[欄位, ...])
+    #    要重建上游已有的表先 conn.rebuild("表名")
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 已建立 data_4_0.db")
 
     cur.executescript("""
         
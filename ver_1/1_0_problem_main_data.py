@@ -1,27 +1,27 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db
+
 SRC_DB = TOP_PATH.parent / Path("data.db")        # 原始資料庫
 DST_DB = TOP_PATH / Path("data_1_0.db")    # 清洗後資料庫
 
-DELETE_SQL = """
-DELETE FROM "main"
-WHERE
-    (yt_number = 0 AND tw_number = 0)
+# 要刪掉的資料（搬 main 進 data_1_0.db 時直接略過）
+# 所有平台都沒開台，或所有平台的觀看數都 < 10
+DELETE_WHERE = f"""
+    ({" AND ".join(f"{p.stream_id} = 0" for p in platforms.PLATFORMS)})
     OR
-    (youtube < 10 AND twitch < 10);
+    ({" AND ".join(f"{p.viewers} < 10" for p in platforms.PLATFORMS)})
 """
 
-COUNT_SQL = """
+COUNT_SQL = f"""
 SELECT COUNT(*) FROM "main"
 WHERE
-    (yt_number = 0 AND tw_number = 0)
-    OR
-    (youtube < 10 AND twitch < 10);
+{DELETE_WHERE};
 """
 # ==================
 
@@ -30,35 +30,55 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_1_0.db（準備去重複）")
-
-    # 2️⃣ 連線新資料庫
-    conn = sqlite3.connect(DST_DB)
+    # 1️⃣ 建立 data_1_0.db（原始 DB 唯讀 ATTACH，不再整份複製）
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 已建立 data_1_0.db（準備去重複）")
 
     # 3️⃣ 先看看會刪幾筆
     cur.execute(COUNT_SQL)
     delete_count = cur.fetchone()[0]
     print(f"🧹 預計刪除筆數：{delete_count}")
 
-    # 4️⃣ 執行刪除
-    cur.execute(DELETE_SQL)
-    conn.commit()
+    # 4️⃣ 只把要留下的 main 寫進 data_1_0.db
+    # 原始資料最新一筆所在的區塊可能還沒收完，跟增量更新的 hi 一樣先不收，
+    # watermark 就是那個區塊的開頭，下次增量更新從那裡接著處理
+    latest = incremental.latest_bucket(conn, conn.upstream_table("main"))
+    done = incremental.Window(hi=latest)
+    conn.take("main", drop_where=f"({DELETE_WHERE}) OR NOT ({done.where()})")
 
     # 5️⃣ 剩餘筆數
     cur.execute('SELECT COUNT(*) FROM "main"')
     remain = cur.fetchone()[0]
     print(f"📊 刪除後剩餘 main 筆數：{remain}")
 
+    # 6️⃣ 記錄處理到哪裡
+    if latest is not None:
+        incremental.mark_full_run(conn, latest)
+
     conn.close()
     print("🎉 清洗完成")
 
 
+def update(hi):
+    """
+    增量更新：只把 [watermark, hi) 的新資料清洗後接到 main 後面
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    cur = conn.execute(f"""
+        INSERT INTO main."main"
+        SELECT * FROM {conn.upstream_table("main")}
+        WHERE
+            {window.where()}
+            AND ({DELETE_WHERE}) IS NOT 1
+    """)
+    print(f"📥 新增 main 筆數：{cur.rowcount}")
+
+    incremental.finish_update(conn, window)
+
+
 if __name__ == "__main__":
     main()
@@ -1,160 +1,142 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
-from datetime import datetime
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db, timeslot
+
 SRC_DB = TOP_PATH / "data_1_0.db"
 DST_DB = TOP_PATH / "data_1_1.db"
 
 
-def to_15min_block_hhmm(time_str: str) -> str:
-    """
-    time_str: HH:MM:SS
-    return:   HH:MM  (MM ∈ {00,15,30,45})
+def resample(conn, bucket, window):
     """
-    h, m, s = map(int, time_str.split(":"))
-    block_min = (m // 15) * 15
-    return f"{h:02d}:{block_min:02d}"
-
-
-
-def main():
-    if not SRC_DB.exists():
-        raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
-
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
+    window 內的資料：時間離散到區塊開頭，同區塊同 stream 的人數設為區塊值
+    （平均 / 最大 / 最後一筆），並填好整數的 ts / slot
+    window 依 ts 挑資料：完整跑是 ALL，增量更新時新資料搬進來就先填好 ts
 
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_1_1.db（準備去重複）")
-    
-    conn = sqlite3.connect(DST_DB)
-    cur = conn.cursor()
-
-    # 1️⃣ 先算所有資料的 time_block
-    cur.execute('SELECT id, time FROM "main"')
-    rows = cur.fetchall()
-    total = len(rows)
-
-    print(f"🕒 開始時間離散化，共 {total} 筆")
-    
-    for i, (rid, time_str) in enumerate(rows, 1):
-        new_time = to_15min_block_hhmm(time_str)
-        cur.execute(
-            'UPDATE "main" SET time = ? WHERE id = ?',
-            (new_time, rid)
-        )
-        
-        if i % 2000 == 0 or i == total:
-            print(f"  ⏳ 已處理 {i}/{total} 筆")
+    1. 掃一次 main：window function 同時算出所有平台的區塊值，放進 tmp_block
+    2. 一句 UPDATE ... FROM 依 id（rowid）把時間、各平台人數、ts、slot 一起寫回去
+    """
+    print(f"🕒 開始重取樣（{bucket}）")
+
+    # 每個平台：有開台的那幾筆換成同區塊同 stream 的值
+    values = ",\n        ".join(
+        f"CASE WHEN {p.stream_id} != 0 "
+        f"THEN {bucket.window_sql(p.viewers, f'date, time, {p.stream_id}', 'raw_time')} "
+        f"ELSE {p.viewers} END AS {p.viewers}"
+        for p in platforms.PLATFORMS
+    )
+    raw = ", ".join(f"{p.stream_id}, {p.viewers}" for p in platforms.PLATFORMS)
+    assign = ", ".join(f"{p.viewers} = b.{p.viewers}" for p in platforms.PLATFORMS)
 
-    conn.commit()
-    
-    print("✅ 時間離散化完成")
-    
-    # 2️⃣ 建立 index 加速後續運算
-    print("⚙️ 建立 index（YouTube / Twitch）")
-
-    cur.execute("""
-    CREATE INDEX IF NOT EXISTS idx_main_yt
-    ON "main"(date, time, yt_number);
+    conn.execute("DROP TABLE IF EXISTS tmp_block;")
+    conn.execute(f"""
+    CREATE TEMP TABLE tmp_block AS
+    SELECT
+        id,
+        time,
+        {bucket.ts_sql("date", "time")} AS ts,
+        {bucket.slot_sql("time")} AS slot,
+        {values}
+    FROM (
+        SELECT
+            id,
+            date,
+            {bucket.sql("time")} AS time,
+            time AS raw_time,
+            {raw}
+        FROM "main"
+        WHERE {window.where_ts()}
+    );
     """)
 
-    cur.execute("""
-    CREATE INDEX IF NOT EXISTS idx_main_tw
-    ON "main"(date, time, tw_number);
+    cur = conn.execute(f"""
+    UPDATE "main"
+    SET
+        time = b.time,
+        {assign},
+        ts = b.ts,
+        slot = b.slot
+    FROM tmp_block b
+    WHERE "main".id = b.id;
     """)
-
+    conn.execute("DROP TABLE tmp_block;")
     conn.commit()
-    print("✅ index 建立完成")
-
-    cur.execute("ANALYZE;")
-    conn.commit()
-    print("📊 ANALYZE 完成")
 
+    print(f"✅ 重取樣完成，共 {cur.rowcount} 筆（{' / '.join(p.name for p in platforms.PLATFORMS)} 同一次掃描）")
 
-    # =========================
-    # YouTube 平均（穩定版）
-    # =========================
-    print("📊 開始計算 YouTube 平均（穩定版）")
 
-    cur.execute("""
-    DROP TABLE IF EXISTS tmp_yt_avg;
-    """)
-
-    cur.execute("""
-    CREATE TEMP TABLE tmp_yt_avg AS
-    SELECT
-        date,
-        time,
-        yt_number,
-        CAST(AVG(youtube) AS INTEGER) AS avg_youtube
-    FROM "main"
-    WHERE yt_number != 0
-    GROUP BY date, time, yt_number;
-    """)
+def main():
+    if not SRC_DB.exists():
+        raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    cur.execute("""
-    UPDATE "main"
-    SET youtube = (
-        SELECT avg_youtube
-        FROM tmp_yt_avg t
-        WHERE
-            t.date = "main".date
-            AND t.time = "main".time
-            AND t.yt_number = "main".yt_number
-    )
-    WHERE yt_number != 0;
-    """)
+    # 1️⃣ 建立 data_1_1.db，main 要整份改時間，先搬進來
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
+    conn.take("main")
+    timeslot.migrate(conn)      # main 加上 ts / slot
+    print("✅ 已建立 data_1_1.db（準備去重複）")
 
+    # 區塊定義寫進 stage，下游都讀這份
+    bucket = timeslot.current()
+    bucket.register(conn)
+    bucket.write_tables(conn)
+
+    resample(conn, bucket, incremental.ALL)
+
+    # 整數時間 index 建在這裡：1_2 增量更新從這份 main 依 ts 挑新資料
+    # 各平台原本的 (date, time, stream id) index 也留著
+    print("⚙️ 建立 index")
+    timeslot.index_main(conn)
+    for p in platforms.PLATFORMS:
+        conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS main.idx_main_{p.key}
+        ON "main"(date, time, {p.stream_id});
+        """)
     conn.commit()
-    print("✅ YouTube 平均完成（保證一致）")
-
-
-    # =========================
-    # Twitch 平均（穩定版）
-    # =========================
-    print("📊 開始計算 Twitch 平均（穩定版）")
+    print("✅ index 建立完成")
 
-    cur.execute("""
-    DROP TABLE IF EXISTS tmp_tw_avg;
-    """)
+    incremental.mark_full_run(conn)
+    conn.close()
+    print(f"✅ {bucket.minutes} 分鐘重取樣完成")
 
-    cur.execute("""
-    CREATE TEMP TABLE tmp_tw_avg AS
-    SELECT
-        date,
-        time,
-        tw_number,
-        CAST(AVG(twitch) AS INTEGER) AS avg_twitch
-    FROM "main"
-    WHERE tw_number != 0
-    GROUP BY date, time, tw_number;
-    """)
 
-    cur.execute("""
-    UPDATE "main"
-    SET twitch = (
-        SELECT avg_twitch
-        FROM tmp_tw_avg t
-        WHERE
-            t.date = "main".date
-            AND t.time = "main".time
-            AND t.tw_number = "main".tw_number
+def update(hi):
+    """
+    增量更新：新區塊的資料搬進來後只對它們做離散化 / 平均
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    # 上游的 main 沒有 ts / slot，依欄位名稱接上，slot 由 resample 填
+    if timeslot.missing_columns(conn):
+        raise RuntimeError(f"{DST_DB.name} 的 main 沒有 ts / slot，請完整跑一次 pipeline")
+
+    bucket = timeslot.Bucket.read(conn)
+    bucket.register(conn)
+
+    # 上游沒有 ts，這裡只能用字串比較挑；搬進來時先填好區塊的 ts，
+    # resample 就能走 idx_main_ts 只處理新的這段
+    cols = ", ".join(
+        f'"{row[1]}"'
+        for row in conn.execute(
+            f'PRAGMA {conn.upstream["main"]}.table_info("main")'
+        )
     )
-    WHERE tw_number != 0;
+    cur = conn.execute(f"""
+        INSERT INTO main."main" ({cols}, ts)
+        SELECT {cols}, {bucket.ts_sql("date", bucket.sql("time"))}
+        FROM {conn.upstream_table("main")}
+        WHERE {window.where()}
     """)
+    print(f"📥 新增 main 筆數：{cur.rowcount}")
 
-    conn.commit()
-    print("✅ Twitch 平均完成（保證一致）")
+    resample(conn, bucket, window)
 
-    conn.close()
-    print("✅ 15 分鐘重取樣完成")
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,25 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db, timeslot
+
 SRC_DB = TOP_PATH / "data_1_1.db"
 DST_DB = TOP_PATH / "data_1_2.db"
+
+# 去重複的自然鍵（data_1_2.db 的 main 上有這組 UNIQUE INDEX）
+# 各平台的 stream id（yt_number / tw_number）可以是 NULL，UNIQUE INDEX 會把 NULL 當成互不相同，
+# 包一層 IFNULL(…, '') 讓 NULL 跟 GROUP BY 一樣算同一組（'' 不會等於任何整數）
+DEDUP_KEY = [
+    "date",
+    "time",
+    "channel",
+    *(f"IFNULL({p.stream_id}, '')" for p in platforms.PLATFORMS),
+    *(p.viewers for p in platforms.PLATFORMS),
+]
 # =======================
 
 
@@ -14,64 +27,56 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_1_2.db（準備去重複）")
-
-    conn = sqlite3.connect(DST_DB)
+    # 1️⃣ 建立 data_1_2.db（data_1_1.db 唯讀 ATTACH）
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 已建立 data_1_2.db（準備去重複）")
 
-    # 2️⃣ 先看看會刪掉幾筆（安心用）
-    cur.execute("""
-        SELECT COUNT(*)
-        FROM "main"
-        WHERE id NOT IN (
-            SELECT MIN(id)
-            FROM "main"
-            GROUP BY
-                date,
-                time,
-                channel,
-                yt_number,
-                tw_number,
-                youtube,
-                twitch
-        );
-    """)
-    delete_count = cur.fetchone()[0]
-    print(f"🧹 預計刪除重複筆數：{delete_count}")
-
-    # 3️⃣ 刪除重複資料（核心）
-    cur.execute("""
-        DELETE FROM "main"
-        WHERE id NOT IN (
-            SELECT MIN(id)
-            FROM "main"
-            GROUP BY
-                date,
-                time,
-                channel,
-                yt_number,
-                tw_number,
-                youtube,
-                twitch
-        );
-    """)
+    cur.execute('SELECT COUNT(*) FROM "main"')
+    total = cur.fetchone()[0]
 
-    conn.commit()
+    # 2️⃣ 去重複（核心）：先建自然鍵的 UNIQUE INDEX，再依 id 順序 INSERT OR IGNORE，
+    #    每組只留 id 最小的那筆，一次掃完
+    remain = conn.take("main", unique=DEDUP_KEY)
+    print(f"🧹 刪除重複筆數：{total - remain}")
 
-    # 4️⃣ 剩餘筆數
-    cur.execute('SELECT COUNT(*) FROM "main"')
-    remain = cur.fetchone()[0]
+    # 3️⃣ 剩餘筆數
     print(f"📊 去重後剩餘 main 筆數：{remain}")
 
+    # 4️⃣ 下游（1_3 ~ 2_x / stream_ana / 3_0）用的整數時間 index
+    #    1_4 只做軟刪除，之後的 stage 讀的 main 都是這份
+    timeslot.index_main(conn)
+
+    incremental.mark_full_run(conn)
     conn.close()
     print("🎉 去重複完成，data_1_2.db 準備好分析")
 
 
+def update(hi):
+    """
+    增量更新：新資料直接 INSERT OR IGNORE，撞到自然鍵（不管是新區塊內還是
+    跟舊資料重複）的就不進來，舊資料不用再整張去重複
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    has_key = conn.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'index' AND name = 'uq_main_key'"
+    ).fetchone()
+    if not has_key:
+        raise RuntimeError(f"{DST_DB.name} 的 main 沒有去重複的 UNIQUE INDEX，請完整跑一次 pipeline")
+
+    cur = conn.execute(f"""
+        INSERT OR IGNORE INTO main."main"
+        SELECT * FROM {conn.upstream_table("main")}
+        WHERE {window.where_ts()}
+        ORDER BY id
+    """)
+    print(f"📥 新增 main 筆數（已去重）：{cur.rowcount}")
+
+    incremental.finish_update(conn, window)
+
+
 if __name__ == "__main__":
     main()
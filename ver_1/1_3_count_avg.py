@@ -1,9 +1,11 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import channel_stats, incremental, quantiles, stage_db
+
 SRC_DB = TOP_PATH / "data_1_2.db"
 DST_DB = TOP_PATH / "data_1_3.db"
 
@@ -12,15 +14,10 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_1_2.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_2_0.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # main / streamer 都只讀，data_1_3.db 裡只放 channel_avg / channel_acc / channel_sketch
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 建立 data_1_3.db")
 
     cur.executescript("""
 
@@ -40,6 +37,15 @@ CREATE TABLE channel_avg (
     yt_ln_avg  REAL,   -- ln 空間平均 = avg(ln(x))
     yt_ln_std  REAL,   -- ln 空間標準差
 
+    -- YouTube（分位數，t-digest 估計；觀看數 > 0）
+    yt_p5        REAL,   -- 人數
+    yt_p50       REAL,
+    yt_p95       REAL,
+    yt_ln_median REAL,   -- ln 空間中位數
+    yt_ln_mad    REAL,   -- ln 空間 MAD
+    yt_mad_min   REAL,   -- median ± 2.5 × 1.4826 × MAD → 人數
+    yt_mad_max   REAL,
+
     -- Twitch（raw）
     tw_avg     REAL,
     tw_std     REAL,
@@ -48,69 +54,47 @@ CREATE TABLE channel_avg (
 
     -- Twitch（ln）
     tw_ln_avg  REAL,
-    tw_ln_std  REAL
+    tw_ln_std  REAL,
+
+    -- Twitch（分位數）
+    tw_p5        REAL,
+    tw_p50       REAL,
+    tw_p95       REAL,
+    tw_ln_median REAL,
+    tw_ln_mad    REAL,
+    tw_mad_min   REAL,
+    tw_mad_max   REAL
 );
 
     """)
 
+    print("📊 累加 channel_acc / channel_sketch（各頻道的平均、離均差平方和 / 分位數）")
+    channel_stats.create_acc(conn)
+    quantiles.create_sketch(conn)
+    sketch = quantiles.Sketch(conn)
+    channel_stats.accumulate(conn, incremental.ALL, on_chunk=sketch.add)
+    sketch.save()
+
     print("📊 建立 channel_avg（以 streamer 順序）")
+    finalize(conn)
+
+    conn.commit()
+    print("✅ channel_avg 建立完成（順序與 streamer 一致）")
+
+    incremental.mark_full_run(conn)
+    conn.close()
+    print("\n🎉 data_1_3 完成（已對應 streamer）")
+
+
+def finalize(conn):
+    """
+    由 channel_acc 重算 channel_avg（表很小，每次整張重寫）
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM channel_avg")
+
+    cur.execute(f"""
 
-    cur.execute("""
-
-WITH base AS (
-    SELECT
-        s.id AS streamer_id,
-        s.channel_id,
-        s.channel_name,
-
-        -- raw stats
-        AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END) AS yt_mean,
-        AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END)  AS tw_mean,
-
-        AVG(CASE WHEN m.yt_number != 0 THEN m.youtube * m.youtube END) AS yt_mean2,
-        AVG(CASE WHEN m.tw_number != 0 THEN m.twitch * m.twitch END)   AS tw_mean2
-
-    FROM streamer s
-    LEFT JOIN main m
-        ON m.channel = s.channel_id
-    GROUP BY s.id,s.channel_id, s.channel_name
-),
-ln_part AS (
-    SELECT
-        b.streamer_id,
-        b.channel_id,
-        b.channel_name,
-        b.yt_mean,
-        b.yt_mean2,
-        b.tw_mean,
-        b.tw_mean2,
-
-        -- ln stats
-        AVG(CASE
-                WHEN m.yt_number != 0 AND m.youtube > 0
-                THEN ln(m.youtube)
-            END) AS yt_ln_mean,
-
-        AVG(CASE
-                WHEN m.tw_number != 0 AND m.twitch > 0
-                THEN ln(m.twitch)
-            END) AS tw_ln_mean,
-
-        AVG(CASE
-                WHEN m.yt_number != 0 AND m.youtube > 0
-                THEN ln(m.youtube) * ln(m.youtube)
-            END) AS yt_ln_mean2,
-
-        AVG(CASE
-                WHEN m.tw_number != 0 AND m.twitch > 0
-                THEN ln(m.twitch) * ln(m.twitch)
-            END) AS tw_ln_mean2
-
-    FROM base b
-    LEFT JOIN main m
-        ON m.channel = b.channel_id
-    GROUP BY b.streamer_id,b.channel_id, b.channel_name
-)
 INSERT INTO channel_avg (
     channel_id, channel_name,
 
@@ -120,103 +104,87 @@ INSERT INTO channel_avg (
 
     tw_avg, tw_std,
     tw_ln_avg, tw_ln_std,
-    tw_min, tw_max
+    tw_min, tw_max,
+
+    yt_p5, yt_p50, yt_p95,
+    yt_ln_median, yt_ln_mad,
+    yt_mad_min, yt_mad_max,
+
+    tw_p5, tw_p50, tw_p95,
+    tw_ln_median, tw_ln_mad,
+    tw_mad_min, tw_mad_max
 )
 SELECT
-    channel_id,
-    channel_name,
+    s.channel_id,
+    s.channel_name,
 
     -- YT raw
-    ROUND(yt_mean, 1),
-    ROUND(
-        sqrt(
-            CASE
-                WHEN yt_mean2 - yt_mean * yt_mean < 0 THEN 0
-                ELSE yt_mean2 - yt_mean * yt_mean
-            END
-        ), 1
-    ),
+    ROUND(a.yt_mean, 1),
+    ROUND(a.yt_std, 1),
 
     -- YT ln
-    ROUND(yt_ln_mean, 3),
-    ROUND(
-        sqrt(
-            CASE
-                WHEN yt_ln_mean2 - yt_ln_mean * yt_ln_mean < 0 THEN 0
-                ELSE yt_ln_mean2 - yt_ln_mean * yt_ln_mean
-            END
-        ), 3
-    ),
+    ROUND(a.yt_ln_mean, 3),
+    ROUND(a.yt_ln_std, 3),
 
     -- YT ±2.5σ → raw
-    ROUND(exp(yt_ln_mean - 2.5 * 
-        sqrt(
-            CASE
-                WHEN yt_ln_mean2 - yt_ln_mean * yt_ln_mean < 0 THEN 0
-                ELSE yt_ln_mean2 - yt_ln_mean * yt_ln_mean
-            END
-        )
-    ), 1),
-    ROUND(exp(yt_ln_mean + 2.5 * 
-        sqrt(
-            CASE
-                WHEN yt_ln_mean2 - yt_ln_mean * yt_ln_mean < 0 THEN 0
-                ELSE yt_ln_mean2 - yt_ln_mean * yt_ln_mean
-            END
-        )
-    ), 1),
+    ROUND(exp(a.yt_ln_mean - 2.5 * a.yt_ln_std), 1),
+    ROUND(exp(a.yt_ln_mean + 2.5 * a.yt_ln_std), 1),
 
     -- TW raw
-    ROUND(tw_mean, 1),
-    ROUND(
-        sqrt(
-            CASE
-                WHEN tw_mean2 - tw_mean * tw_mean < 0 THEN 0
-                ELSE tw_mean2 - tw_mean * tw_mean
-            END
-        ), 1
-    ),
+    ROUND(a.tw_mean, 1),
+    ROUND(a.tw_std, 1),
 
     -- TW ln
-    ROUND(tw_ln_mean, 3),
-    ROUND(
-        sqrt(
-            CASE
-                WHEN tw_ln_mean2 - tw_ln_mean * tw_ln_mean < 0 THEN 0
-                ELSE tw_ln_mean2 - tw_ln_mean * tw_ln_mean
-            END
-        ), 3
-    ),
+    ROUND(a.tw_ln_mean, 3),
+    ROUND(a.tw_ln_std, 3),
 
     -- TW ±2.5σ → raw
-    ROUND(exp(tw_ln_mean - 2.5 *
-        sqrt(
-            CASE
-                WHEN tw_ln_mean2 - tw_ln_mean * tw_ln_mean < 0 THEN 0
-                ELSE tw_ln_mean2 - tw_ln_mean * tw_ln_mean
-            END
-        )
-    ), 1),
-    ROUND(exp(tw_ln_mean + 2.5 *
-        sqrt(
-            CASE
-                WHEN tw_ln_mean2 - tw_ln_mean * tw_ln_mean < 0 THEN 0
-                ELSE tw_ln_mean2 - tw_ln_mean * tw_ln_mean
-            END
-        )
-    ), 1)
-
-FROM ln_part
-ORDER BY streamer_id;
-
+    ROUND(exp(a.tw_ln_mean - 2.5 * a.tw_ln_std), 1),
+    ROUND(exp(a.tw_ln_mean + 2.5 * a.tw_ln_std), 1),
+
+    -- YT 分位數 / median ± 2.5 MAD → raw
+    ROUND(q.yt_p5, 1),
+    ROUND(q.yt_p50, 1),
+    ROUND(q.yt_p95, 1),
+    ROUND(q.yt_ln_median, 3),
+    ROUND(q.yt_ln_mad, 3),
+    ROUND(exp(q.yt_ln_median - 2.5 * {quantiles.MAD_SCALE} * q.yt_ln_mad), 1),
+    ROUND(exp(q.yt_ln_median + 2.5 * {quantiles.MAD_SCALE} * q.yt_ln_mad), 1),
+
+    -- TW 分位數 / median ± 2.5 MAD → raw
+    ROUND(q.tw_p5, 1),
+    ROUND(q.tw_p50, 1),
+    ROUND(q.tw_p95, 1),
+    ROUND(q.tw_ln_median, 3),
+    ROUND(q.tw_ln_mad, 3),
+    ROUND(exp(q.tw_ln_median - 2.5 * {quantiles.MAD_SCALE} * q.tw_ln_mad), 1),
+    ROUND(exp(q.tw_ln_median + 2.5 * {quantiles.MAD_SCALE} * q.tw_ln_mad), 1)
+
+-- raw / ln stats / 分位數（沒資料 → NULL）
+FROM streamer s
+LEFT JOIN ({channel_stats.STATS_SQL}) a
+    ON a.channel_id = s.channel_id
+LEFT JOIN channel_quantile q
+    ON q.channel_id = s.channel_id
+ORDER BY s.id;
 
     """)
 
-    conn.commit()
-    print("✅ channel_avg 建立完成（順序與 streamer 一致）")
 
-    conn.close()
-    print("\n🎉 data_1_3 完成（已對應 streamer）")
+def update(hi):
+    """
+    增量更新：新資料的統計量加進 channel_acc / channel_sketch，再重算 channel_avg
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    sketch = quantiles.Sketch(conn)
+    channel_stats.accumulate(conn, window, on_chunk=sketch.add)
+    sketch.save()
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
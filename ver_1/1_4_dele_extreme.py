@@ -1,9 +1,11 @@
-import sqlite3
-import shutil       
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import channel_stats, flags, incremental, stage_db
+
 SRC_DB = TOP_PATH / "data_1_3.db"
 DST_DB = TOP_PATH / "data_1_4.db"
 
@@ -12,65 +14,54 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_1_3.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
+    # main / channel_avg 都只讀，異常值記在 data_1_4.db 的 main_flags（軟刪除），
+    # 下游接到的 main 會自動排除；main 不用整張搬進來，沿用 1_2 的 index
+    # channel_acc 複製 1_3 的，標記的資料直接扣掉（1_5 用這份重算 channel_avg）
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
+    conn.soft_delete("main")
+    channel_stats.copy_acc(conn)
     print("✅ 建立 data_1_4.db")
 
-    conn = sqlite3.connect(DST_DB)
-    cur = conn.cursor()
-
-
-
-    print("🧹 刪除 YT 超過 ±2.5σ（ln）的資料")
-
-    cur.execute("""
-        DELETE FROM main
-        WHERE id IN (
-            SELECT
-                m.id
-            FROM main m
-            JOIN channel_avg c
-                ON c.channel_id = m.channel
-            WHERE
-                m.youtube > 0
-                AND c.yt_ln_std > 0
-                AND ABS(
-                    (ln(m.youtube) - c.yt_ln_avg) / c.yt_ln_std
-                ) > 2.5
-        );
-    """)
-
-    print(f"   → 影響筆數（YT）：{cur.rowcount}")
-
-
-    print("🧹 刪除 TW 超過 ±2.5σ（ln）的資料")
-
-    cur.execute("""
-        DELETE FROM main
-        WHERE id IN (
-            SELECT
-                m.id
-            FROM main m
-            JOIN channel_avg c
-                ON c.channel_id = m.channel
-            WHERE
-                m.twitch > 0
-                AND c.tw_ln_std > 0
-                AND ABS(
-                    (ln(m.twitch) - c.tw_ln_avg) / c.tw_ln_std
-                ) > 2.5
-        );
-    """)
-
-    print(f"   → 影響筆數（TW）：{cur.rowcount}")
+    delete_extreme(conn, incremental.ALL)
 
-    conn.commit()
+    incremental.mark_full_run(conn)
     conn.close()
 
-    print("\n✅ 1_4 main 異常值刪除完成")
+    print("\n✅ 1_4 main 異常值標記完成")
+
+
+def delete_extreme(conn, window):
+    """
+    標記 window 內超過 ±2.5σ（ln）的資料（σ 用 data_1_3 的 channel_avg）
+    YT / TW 在同一次掃描裡判斷，標記的同時從 channel_acc 扣掉
+    """
+    print("🧹 標記 YT / TW 超過 ±2.5σ（ln）的資料")
+
+    counts, rows = flags.mark(conn, window, "channel_avg", [
+        (flags.YT_SIGMA_25, "yt", "ABS({z}) > 2.5"),
+        (flags.TW_SIGMA_25, "tw", "ABS({z}) > 2.5"),
+    ])
+    if rows:
+        channel_stats.subtract(conn, rows)
+    conn.commit()
+
+    print(f"   → 影響筆數（YT）：{counts[flags.YT_SIGMA_25]}")
+    print(f"   → 影響筆數（TW）：{counts[flags.TW_SIGMA_25]}")
+
+
+def update(hi):
+    """
+    增量更新：新資料照目前的 channel_avg 判斷異常值（舊資料維持上次的判斷）
+    main 直接接 1_2 的，新資料先併進 channel_acc，標記的再扣掉
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    channel_stats.accumulate(conn, window)
+    delete_extreme(conn, window)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import channel_stats, incremental, stage_db
+
 SRC_DB = TOP_PATH / "data_1_4.db"
 DST_DB = TOP_PATH / "data_1_5.db"
 
@@ -12,22 +14,18 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_1_3.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_1_4.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # main / channel_acc 只讀（channel_acc 是 1_4 扣掉異常值後的），
+    # data_1_5.db 裡只放新的 channel_avg
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 建立 data_1_5.db")
 
     print("🧹 重新建立 channel_avg（cleaned main）")
 
     # ─────────────────────────────
     # 重建表
     # ─────────────────────────────
-    cur.execute("DROP TABLE IF EXISTS channel_avg")
+    conn.rebuild("channel_avg")
     cur.execute("""
 
     CREATE TABLE channel_avg (
@@ -48,11 +46,25 @@ def main():
     """)
 
     print("📊 重新計算 avg / std")
+    finalize(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+
+    print("✅ 1_5 channel_avg 重新計算完成（cleaned）")
+
+
+def finalize(conn):
+    """
+    由 channel_acc 重算 channel_avg（表很小，每次整張重寫）
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM channel_avg")
 
     # ─────────────────────────────
     # 重新計算（母體標準差）
     # ─────────────────────────────
-    cur.execute("""
+    cur.execute(f"""
     INSERT INTO channel_avg (
         channel_id, channel_name,
 
@@ -69,100 +81,51 @@ def main():
         -- ───────── YT ─────────
 
         -- 算術平均
-        COALESCE(
-            ROUND(AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END), 1),
-            0
-        ) AS yt_avg,
+        COALESCE(ROUND(a.yt_mean, 1), 0) AS yt_avg,
 
         -- 母體標準差
-        COALESCE(
-            ROUND(
-                sqrt(
-                    AVG(CASE WHEN m.yt_number != 0 THEN m.youtube * m.youtube END)
-                  - AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END)
-                    * AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END)
-                ),
-                1
-            ),
-            0
-        ) AS yt_std,
+        COALESCE(ROUND(a.yt_std, 1), 0) AS yt_std,
 
         -- 幾何平均（log-space）
-        COALESCE(
-            ROUND(
-                AVG(CASE WHEN m.yt_number != 0 AND m.youtube > 0
-                         THEN ln(m.youtube) END),
-                6
-            ),
-            NULL
-        ) AS yt_log_geo_avg,
+        COALESCE(ROUND(a.yt_ln_mean, 6), NULL) AS yt_log_geo_avg,
 
         -- 幾何平均（還原）
-        COALESCE(
-            ROUND(
-                exp(
-                    AVG(CASE WHEN m.yt_number != 0 AND m.youtube > 0
-                             THEN ln(m.youtube) END)
-                ),
-                1
-            ),
-            0
-        ) AS yt_geo_avg,
+        COALESCE(ROUND(a.yt_geo_mean, 1), 0) AS yt_geo_avg,
 
         -- ───────── TW ─────────
 
         -- 算術平均
-        COALESCE(
-            ROUND(AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END), 1),
-            0
-        ) AS tw_avg,
+        COALESCE(ROUND(a.tw_mean, 1), 0) AS tw_avg,
 
         -- 母體標準差
-        COALESCE(
-            ROUND(
-                sqrt(
-                    AVG(CASE WHEN m.tw_number != 0 THEN m.twitch * m.twitch END)
-                  - AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END)
-                    * AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END)
-                ),
-                1
-            ),
-            0
-        ) AS tw_std,
+        COALESCE(ROUND(a.tw_std, 1), 0) AS tw_std,
 
         -- 幾何平均（log-space）
-        COALESCE(
-            ROUND(
-                AVG(CASE WHEN m.tw_number != 0 AND m.twitch > 0
-                         THEN ln(m.twitch) END),
-                6
-            ),
-            NULL
-        ) AS tw_log_geo_avg,
+        COALESCE(ROUND(a.tw_ln_mean, 6), NULL) AS tw_log_geo_avg,
 
         -- 幾何平均（還原）
-        COALESCE(
-            ROUND(
-                exp(
-                    AVG(CASE WHEN m.tw_number != 0 AND m.twitch > 0
-                             THEN ln(m.twitch) END)
-                ),
-                1
-            ),
-            0
-        ) AS tw_geo_avg
+        COALESCE(ROUND(a.tw_geo_mean, 1), 0) AS tw_geo_avg
 
     FROM streamer s
-    LEFT JOIN main m
-        ON m.channel = s.channel_id
-    GROUP BY s.channel_id, s.channel_name
+    LEFT JOIN ({channel_stats.STATS_SQL}) a
+        ON a.channel_id = s.channel_id
     ORDER BY s.id;
 """)
 
     conn.commit()
-    conn.close()
 
-    print("✅ 1_5 channel_avg 重新計算完成（cleaned）")
+
+def update(hi):
+    """
+    增量更新：1_4 已經把新資料併進 channel_acc，這裡只重算 channel_avg
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
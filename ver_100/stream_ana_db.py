@@ -1,119 +1,146 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
-from datetime import datetime
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 VER1_PATH = TOP_PATH.parent / "ver_1"
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db, stream_stats, timeslot
+
 SRC_DB = VER1_PATH / "data_1_2.db"
 DST_DB = TOP_PATH / "data_3_0.db"
 # =======================
 
 
-def to_dt(date_str, time_str):
-    return datetime.strptime(f"{date_str} {time_str}", "%Y-%m-%d %H:%M")
+def process_platform(cur, k, window=None):
+    """
+    k      = 第幾個平台（platforms.PLATFORMS，從 1 開始，也就是 obs 的 k）
+    window = 只重算在這段時間內有資料的 stream（None = 全部）
 
+    從長格式的 obs 讀這個平台，依 (stream, 頻道, 時間) 排序後分批讀，
+    每批讀完就把完整的那幾場寫進 stream_analysis，記憶體只跟 CHUNK_ROWS 有關，跟 main 有多大無關
+    --stream-jobs N（N > 1）時頻道分給 N 個 process 一起算，結果跟單一 process 一樣
 
-def expected_points(start_dt, end_dt):
-    minutes = int((end_dt - start_dt).total_seconds() // 60)
-    return minutes // 15 + 1
+    平台一個一個排序：排序佔了大部分時間，分平台排兩次比把 obs 整個
+    依 (平台, stream, 頻道, 時間) 排一次快（SQL 都是同一句）
+    """
+    platform = platforms.PLATFORMS[k - 1].label
 
+    print(f"\n📊 開始分析 {platform}")
 
-def process_platform(cur, platform):
-    """
-    platform = 'YT' or 'TW'
+    # 應有筆數依 1_1 的區塊寬度算
+    bucket = timeslot.Bucket.read(cur)
+
+    stream_filter = "1"
+    if window is not None:
+        # 新資料碰到的 stream 要拿整場（含舊資料）重算，舊的結果先刪掉
+        touched = f"""
+            SELECT DISTINCT stream_id
+            FROM obs
+            WHERE k = {k} AND {window.where_ts()}
+        """
+        stream_filter = f"stream_id IN ({touched})"
+        for table in ("stream_analysis", "stream_gaps"):
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE platform = ? AND stream_id IN ({touched})
+            """, (platform,))
+
+    # 時間直接用整數 ts（epoch 分鐘）；依 stream、頻道、時間排好，同一場是連續的一段
+    # （排序交給 SQLite，資料大的時候會自己分段寫暫存檔）
+    sql = f"""
+        SELECT stream_id, channel, ts, viewers
+        FROM obs
+        WHERE k = {k} AND {stream_filter} {{partition}}
+        ORDER BY stream_id, channel, ts
     """
-    if platform == "YT":
-        id_col = "yt_number"
-        view_col = "youtube"
+
+    total = 0
+    n_jobs = stream_stats.jobs()
+    if n_jobs > 1:
+        # 頻道分給好幾個 process 讀 / 算，這裡依 (stream, 頻道) 排好一次寫入
+        print(f"  ⚙️ 分成 {n_jobs} 個 process")
+        result = stream_stats.scan_parallel(
+            cur.connection, SRC_DB,
+            sql.format(partition="AND channel BETWEEN ? AND ?"),
+            bucket.minutes, n_jobs
+        )
+        if result is not None:
+            total = insert_streams(cur, platform, bucket, *result)
     else:
-        id_col = "tw_number"
-        view_col = "twitch"
+        # 分批讀，每批讀完就把完整的那幾場寫進去
+        reader = cur.connection.execute(sql.format(partition=""))
+        for streams, gaps in stream_stats.scan(reader, bucket.minutes):
+            total += insert_streams(cur, platform, bucket, streams, gaps)
+            print(f"    ⏳ {total} streams 完成")
 
-    print(f"\n📊 開始分析 {platform}")
+    print(f"  🔍 共 {total} 個 stream")
+    print(f"✅ {platform} 分析完成")
 
-    cur.execute(f"""
-        SELECT channel, {id_col}, date, time, {view_col}
-        FROM main
-        WHERE {id_col} != 0
-        ORDER BY  {id_col}, channel, date, time
-    """)
-    rows = cur.fetchall()
-
-    streams = {}
-    for channel, sid, d, t, v in rows:
-        streams.setdefault((channel, sid), []).append((d, t, v))
-
-    print(f"  🔍 找到 {len(streams)} 個 stream")
-
-    for i, ((channel, sid), records) in enumerate(streams.items(), 1):
-        dts = [(to_dt(d, t), v) for d, t, v in records]
-
-        times = [dt for dt, _ in dts]
-        viewers = [v for _, v in dts]
-
-        start_dt = min(times)
-        end_dt = max(times)
-
-        avg_v = round(sum(viewers) / len(viewers), 1)
-
-        max_v = max(viewers)
-        min_v = min(viewers)
-
-        max_time = min(dt for dt, v in dts if v == max_v)
-        min_time = min(dt for dt, v in dts if v == min_v)
-
-        actual = len(dts)
-        expect = expected_points(start_dt, end_dt)
-        missing = expect - actual
-
-        cur.execute("""
-            INSERT INTO stream_analysis (
-                platform, stream_id, channel,
-                start_time, end_time,
-                avg_viewers,
-                max_viewers, max_time,
-                min_viewers, min_time,
-                expected_points, actual_points, missing_points
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            platform,
-            sid,
-            channel,
-            start_dt.strftime("%Y-%m-%d %H:%M"),
-            end_dt.strftime("%Y-%m-%d %H:%M"),
-            avg_v,
-            max_v,
-            max_time.strftime("%Y-%m-%d %H:%M"),
-            min_v,
-            min_time.strftime("%Y-%m-%d %H:%M"),
-            expect,
-            actual,
-            missing
-        ))
-
-        if i % 100 == 0 or i == len(streams):
-            print(f"    ⏳ {i}/{len(streams)} streams 完成")
 
-    print(f"✅ {platform} 分析完成")
+def insert_streams(cur, platform, bucket, cols, gaps):
+    """
+    stream_stats 算好的每場統計 / 每段缺漏 → 各一次 executemany
+    寫進 stream_analysis / stream_gaps
+    return: stream 數
+    """
+    points = cols["points"]
+    expect = bucket.expected_points(cols["start_ts"], cols["end_ts"])
+    missing = expect - points
+
+    cur.executemany("""
+        INSERT INTO stream_analysis (
+            platform, stream_id, channel,
+            start_time, end_time,
+            avg_viewers,
+            max_viewers, max_time,
+            min_viewers, min_time,
+            expected_points, actual_points, missing_points
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, zip(
+        [platform] * len(points),
+        cols["stream_id"].tolist(),
+        cols["channel"].tolist(),
+        timeslot.from_ts_array(cols["start_ts"]).tolist(),
+        timeslot.from_ts_array(cols["end_ts"]).tolist(),
+        [round(s / n, 1) for s, n in zip(cols["sum"].tolist(), points.tolist())],
+        cols["max"].tolist(),
+        timeslot.from_ts_array(cols["max_ts"]).tolist(),
+        cols["min"].tolist(),
+        timeslot.from_ts_array(cols["min_ts"]).tolist(),
+        expect.tolist(),
+        points.tolist(),
+        missing.tolist(),
+    ))
+
+    cur.executemany("""
+        INSERT INTO stream_gaps (
+            platform, stream_id, channel,
+            gap_start, gap_end, missing_points
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, zip(
+        [platform] * len(gaps["points"]),
+        gaps["stream_id"].tolist(),
+        gaps["channel"].tolist(),
+        timeslot.from_ts_array(gaps["start_ts"]).tolist(),
+        timeslot.from_ts_array(gaps["end_ts"]).tolist(),
+        gaps["points"].tolist(),
+    ))
+
+    return len(points)
 
 
 def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_1_2.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_2_0.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # main 只讀，這裡只放 stream_analysis / stream_gaps
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 建立 data_3_0.db")
 
     cur.execute("""
     CREATE TABLE IF NOT EXISTS stream_analysis (
@@ -133,15 +160,56 @@ def main():
         missing_points  INTEGER NOT NULL
     );
     """)
+
+    # 每場中間連續缺漏的區塊，一段一筆（加起來就是 stream_analysis 的 missing_points）
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS stream_gaps (
+        platform TEXT NOT NULL,
+        stream_id INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        gap_start TEXT NOT NULL,        -- 第一個缺的區塊
+        gap_end   TEXT NOT NULL,        -- 最後一個缺的區塊
+        missing_points INTEGER NOT NULL
+    );
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_stream_gaps_stream
+    ON stream_gaps(platform, stream_id);
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_stream_gaps_start
+    ON stream_gaps(gap_start);
+    """)
     conn.commit()
 
-    process_platform(cur, "YT")
-    process_platform(cur, "TW")
+    platforms.register(conn)
+    for k in range(1, len(platforms.PLATFORMS) + 1):
+        process_platform(cur, k)
 
     conn.commit()
+    incremental.mark_full_run(conn)
     conn.close()
 
-    print("\n🎉 data_2_0 分析完成，stream_analysis 可直接使用")
+    print("\n🎉 data_2_0 分析完成，stream_analysis / stream_gaps 可直接使用")
+
+
+def update(hi):
+    """
+    增量更新：只重算新資料碰到的 stream
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    if "stream_gaps" not in conn.local:
+        raise RuntimeError("data_3_0.db 沒有 stream_gaps，請完整跑一次 pipeline")
+
+    cur = conn.cursor()
+    platforms.register(conn)
+    for k in range(1, len(platforms.PLATFORMS) + 1):
+        process_platform(cur, k, window)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
@@ -1,42 +1,25 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 VER2_PATH = TOP_PATH
+VER1_PATH = TOP_PATH.parent / "ver_1"
 
-SRC_DB = VER2_PATH / "data_2_1.db"   # 來源：已有 channel_avg
-DST_DB = VER2_PATH / "data_2_2.db"   # 輸出：2.2 結果（同一個 DB）
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, stage_db, time_profile
+
+SRC_DB = VER1_PATH / "data_1_5.db"   # 來源：已有 channel_avg（跟 2_1 同一個，可以一起跑）
+DST_DB = VER2_PATH / "data_2_2.db"   # 輸出：2.2 結果
 
 def main():
     if not SRC_DB.exists():
-        raise FileNotFoundError("找不到 data_2_2.db")
-
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_2_2.db")
+        raise FileNotFoundError("找不到 data_1_5.db")
 
-    conn = sqlite3.connect(DST_DB)
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 建立 data_2_2.db")
 
-    # === 建 time_slots（若已存在不會重建）===
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS time_slots (
-        time TEXT PRIMARY KEY
-    );
-    """)
-
-    cur.execute("SELECT COUNT(*) FROM time_slots;")
-    if cur.fetchone()[0] == 0:
-        for h in range(24):
-            for m in (0, 15, 30, 45):
-                cur.execute(
-                    "INSERT INTO time_slots VALUES (?)",
-                    (f"{h:02d}:{m:02d}",)
-                )
+    # time_slots 是 1_1 依區塊設定建的（pipeline/timeslot），這裡直接用
 
     # === 建 tw_time_profile ===
     cur.execute("""
@@ -53,7 +36,31 @@ def main():
     );
     """)
 
+    # 可累加的 (頻道, 時段) 統計量
+    time_profile.create_acc(conn, ["tw"])
+
     print("📊 計算 2.2 TW 時間分佈（含差異百分比）")
+    accumulate(conn, incremental.ALL)
+    finalize(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+    print("🎉 data_2_2 完成（TW 時間分佈）")
+
+
+def accumulate(conn, window):
+    """
+    把 window 內的 TW 資料加進 tw_time_acc
+    """
+    time_profile.accumulate(conn, window, ["tw"])
+
+
+def finalize(conn):
+    """
+    由 tw_time_acc + channel_avg 重算 tw_time_profile（沒開台的時段補 0）
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM tw_time_profile")
 
     cur.execute("""
     INSERT OR REPLACE INTO tw_time_profile
@@ -62,13 +69,13 @@ def main():
         c.channel_name,
         t.time,
 
-        COUNT(m.twitch) AS live_count,
-        COALESCE(ROUND(AVG(m.twitch), 1), 0) AS avg_viewers,
+        COALESCE(a.n, 0) AS live_count,
+        COALESCE(ROUND(a.sum / a.n, 1), 0) AS avg_viewers,
 
         CASE
             WHEN c.tw_avg = 0 THEN 0
             ELSE ROUND(
-                (COALESCE(AVG(m.twitch), 0) - c.tw_avg)
+                (COALESCE(a.sum / a.n, 0) - c.tw_avg)
                 / c.tw_avg * 100,
                 2
             )
@@ -76,20 +83,28 @@ def main():
 
     FROM channel_avg c
     CROSS JOIN time_slots t
-    LEFT JOIN main m
-        ON m.channel = c.channel_id
-       AND m.time = t.time
-       AND m.tw_number != 0
+    LEFT JOIN tw_time_acc a
+        ON a.channel_id = c.channel_id
+       AND a.slot = t.slot
     WHERE c.tw_avg <> 0
-    GROUP BY c.channel_id, c.channel_name, t.time
     ORDER BY c.channel_id, t.time;
     """)
 
     conn.commit()
-    conn.close()
 
-    print("🎉 data_2_2 完成（TW 時間分佈）")
 
+def update(hi):
+    """
+    增量更新：新資料加進 tw_time_acc，再用新的 channel_avg 重算 tw_time_profile
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    accumulate(conn, window)
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
 
 if __name__ == "__main__":
     main()
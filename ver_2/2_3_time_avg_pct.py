@@ -1,26 +1,24 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 VER2_PATH = TOP_PATH
 
-SRC_DB = VER2_PATH / "data_2_2.db"
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, stage_db
+
+# 2_1（YT）、2_2（TW）各自獨立，兩份都接上
+SRC_DBS = [VER2_PATH / "data_2_1.db", VER2_PATH / "data_2_2.db"]
 DST_DB = VER2_PATH / "data_2_3.db"
 
 def main():
-    if not SRC_DB.exists():
-        raise FileNotFoundError("找不到 data_2_2.db")
-
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
+    for src in SRC_DBS:
+        if not src.exists():
+            raise FileNotFoundError(f"找不到 {src.name}")
 
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_2_3.db")
-
-    conn = sqlite3.connect(DST_DB)
+    conn = stage_db.open_stage(DST_DB, *SRC_DBS)
     cur = conn.cursor()
+    print("✅ 建立 data_2_3.db")
 
     # 建表
     cur.execute("""
@@ -32,6 +30,20 @@ def main():
     );
     """)
 
+    compute(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+
+    print("🎉 data_2_3 完成（YT / TW / ALL）")
+
+
+def compute(conn):
+    """
+    由兩張 time_profile 算加權平均（INSERT OR REPLACE，重跑會整張蓋掉）
+    """
+    cur = conn.cursor()
+
     print("📊 計算 2.3（YT / TW / ALL 加權平均）")
 
     cur.execute("""
@@ -86,9 +98,19 @@ def main():
     """)
 
     conn.commit()
-    conn.close()
 
-    print("🎉 data_2_3 完成（YT / TW / ALL）")
+
+def update(hi):
+    """
+    增量更新：time_profile 很小，直接重算
+    """
+    conn, window = incremental.open_update(DST_DB, *SRC_DBS, hi=hi)
+    if conn is None:
+        return
+
+    compute(conn)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
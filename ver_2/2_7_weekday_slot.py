@@ -0,0 +1,64 @@
+import sys
+from pathlib import Path
+
+TOP_PATH = Path(__file__).resolve().parent
+VER2_PATH = TOP_PATH
+VER1_PATH = TOP_PATH.parent / "ver_1"
+
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, stage_db, weekday_slot
+
+SRC_DB = VER1_PATH / "data_1_5.db"   # 來源：過濾異常值之後的 main
+DST_DB = VER2_PATH / "data_2_7.db"   # 輸出：星期 × 時段
+
+# 先算好的 rollup（表名: 維度）；其他組合用 weekday_slot.rollup 直接查 weekday_slot_acc
+ROLLUPS = {
+    "weekday_slot_profile": ("platform", "weekday", "slot"),
+    "channel_weekday_profile": ("channel_id", "platform", "weekday"),
+    "month_weekday_profile": ("platform", "month", "weekday"),
+}
+
+
+def main():
+    if not SRC_DB.exists():
+        raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
+
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
+    print("✅ 建立 data_2_7.db")
+
+    # (頻道, 平台, 月份, 星期, 時段) 的可合併統計
+    weekday_slot.create(conn)
+
+    print("📊 計算星期 × 時段的統計")
+    weekday_slot.accumulate(conn, incremental.ALL)
+    finalize(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+    print("🎉 data_2_7 完成（星期 × 時段）")
+
+
+def finalize(conn):
+    """
+    由 weekday_slot_acc 重建 ROLLUPS 的表
+    """
+    for name, dims in ROLLUPS.items():
+        weekday_slot.materialize(conn, name, dims)
+    conn.commit()
+
+
+def update(hi):
+    """
+    增量更新：新資料加進 weekday_slot_acc（新的月份就是新的列），再重建 rollup
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    weekday_slot.accumulate(conn, window)
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
+
+if __name__ == "__main__":
+    main()
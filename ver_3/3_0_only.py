@@ -1,13 +1,21 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 VER1_PATH = TOP_PATH.parent / "ver_1"
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, stage_db, timeslot
+
 SRC_DB = VER1_PATH / "data_1_3.db"
 DST_DB = TOP_PATH / "data_3_0.db"
+
+ONLY_CHANNELS_SQL = """
+    SELECT channel_id
+    FROM {streamer}
+    WHERE "group" = '子午'
+"""
 # =======================
 
 
@@ -15,50 +23,66 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
+    # 1️⃣ 建立 data_3_0.db，只搬子午的資料進來
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     print("✅ 已建立 data_3_0.db")
 
-    conn = sqlite3.connect(DST_DB)
-    cur = conn.cursor()
-
-    cur.executescript("""
-
-CREATE TABLE main_only AS
-SELECT m.*
-FROM main m
-JOIN streamer s
-    ON m.channel = s.channel_id
-WHERE s."group" = '子午';
+    conn.take("main", drop_where=f"""
+        channel NOT IN ({ONLY_CHANNELS_SQL.format(streamer="streamer")})
+    """)
 
-DROP TABLE main;
+    conn.take("streamer", drop_where="""
+        "group" != '子午'
+    """)
 
-ALTER TABLE main_only RENAME TO main;
+    # 下游（3_1 ~ 4_x）用的整數時間 index；3_1 只做軟刪除，讀的都是這份 main
+    timeslot.index_main(conn)
 
+    conn.take("channel_avg", drop_where="""
+        channel_id NOT IN (
+            SELECT DISTINCT channel
+            FROM main
+        )
     """)
 
-    conn.commit()
-    
-    cur.executescript("""
+    incremental.mark_full_run(conn)
+    conn.close()
 
-DELETE FROM streamer
-WHERE "group" != '子午';
+    print("🎉 已完成只保留子午資料！")
 
-DELETE FROM channel_avg
-WHERE channel_id NOT IN (
-    SELECT DISTINCT channel
-    FROM main
-);
 
+def update(hi):
+    """
+    增量更新：子午的新資料接到 main 後面，channel_avg 換成上游最新的
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    only_channels = ONLY_CHANNELS_SQL.format(
+        streamer=conn.upstream_table("streamer")
+    )
+
+    cur = conn.execute(f"""
+        INSERT INTO main."main"
+        SELECT * FROM {conn.upstream_table("main")}
+        WHERE
+            {window.where_ts()}
+            AND channel IN ({only_channels})
+    """)
+    print(f"📥 新增 main 筆數：{cur.rowcount}")
+
+    conn.execute("DELETE FROM main.channel_avg")
+    conn.execute(f"""
+        INSERT INTO main.channel_avg
+        SELECT * FROM {conn.upstream_table("channel_avg")}
+        WHERE channel_id IN (
+            SELECT DISTINCT channel
+            FROM main
+        )
     """)
 
-    conn.close()
-
-    print("🎉 已完成只保留子午資料！")
+    incremental.finish_update(conn, window)
 
 if __name__ == "__main__":
     main()
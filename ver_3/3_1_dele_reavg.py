@@ -1,9 +1,11 @@
-import sqlite3
-import shutil       
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import channel_stats, flags, incremental, stage_db
+
 SRC_DB = TOP_PATH / "data_3_0.db"
 DST_DB = TOP_PATH / "data_3_1.db"
 
@@ -12,76 +14,24 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_3_0.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
+    # main 只讀，異常值記在 data_3_1.db 的 main_flags（軟刪除），下游接到的 main 會自動排除
+    # channel_acc 複製 1_3 的（只留 main 裡有的頻道，也就是子午），標記的資料直接扣掉
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
+    conn.soft_delete("main")
+    channel_stats.copy_acc(conn, where="channel_id IN (SELECT DISTINCT channel FROM main)")
     print("✅ 建立 data_3_1.db")
 
-    conn = sqlite3.connect(DST_DB)
-    cur = conn.cursor()
-
-
-
-    print("🧹 刪除 YT 超過 -3σ（ln）的資料")
-
-    cur.execute("""
-
-DELETE FROM main
-WHERE id IN (
-    SELECT
-        m.id
-    FROM main m
-    JOIN channel_avg c
-        ON c.channel_id = m.channel
-    WHERE
-        m.youtube > 0
-        AND c.yt_ln_std > 0
-        AND (
-            (ln(m.youtube) - c.yt_ln_avg) / c.yt_ln_std
-        ) < -3
-);
-
-    """)
-
-    print(f"   → 影響筆數（YT）：{cur.rowcount}")
-
-
-    print("🧹 刪除 TW 超過 -3σ（ln）的資料")
-
-    cur.execute("""
-                
-DELETE FROM main
-WHERE id IN (
-    SELECT
-        m.id
-    FROM main m
-    JOIN channel_avg c
-        ON c.channel_id = m.channel
-    WHERE
-        m.twitch > 0
-        AND c.tw_ln_std > 0
-        AND (
-            (ln(m.twitch) - c.tw_ln_avg) / c.tw_ln_std
-        ) < -3
-);
-
-    """)
-
-    print(f"   → 影響筆數（TW）：{cur.rowcount}")
+    delete_extreme(conn, incremental.ALL)
 
-    conn.commit()
-
-    print("\n✅ 3_1 main 異常值刪除完成")
+    print("\n✅ 3_1 main 異常值標記完成")
     
     print("🧹 重新建立 channel_avg（cleaned main）")
 
     # ─────────────────────────────
     # 重建表
     # ─────────────────────────────
-    cur.execute("DROP TABLE IF EXISTS channel_avg")
-    cur.execute("""
+    conn.rebuild("channel_avg")
+    conn.execute("""
         CREATE TABLE channel_avg (
             channel_id   TEXT PRIMARY KEY,
             channel_name TEXT,
@@ -97,11 +47,45 @@ WHERE id IN (
     """)
 
     print("📊 重新計算 avg / std")
+    finalize(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+
+    print("✅ 3_1 channel_avg 重新計算完成（cleaned）")
+
+
+def delete_extreme(conn, window):
+    """
+    標記 window 內低於 -3σ（ln）的資料
+    門檻用上游（3_0）的 channel_avg；本 stage 重建的 channel_avg 沒有 ln_std
+    YT / TW 在同一次掃描裡判斷，標記的同時從 channel_acc 扣掉
+    """
+    print("🧹 標記 YT / TW 低於 -3σ（ln）的資料")
+
+    counts, rows = flags.mark(conn, window, conn.upstream_table("channel_avg"), [
+        (flags.YT_LOW_3, "yt", "{z} < -3"),
+        (flags.TW_LOW_3, "tw", "{z} < -3"),
+    ])
+    if rows:
+        channel_stats.subtract(conn, rows)
+    conn.commit()
+
+    print(f"   → 影響筆數（YT）：{counts[flags.YT_LOW_3]}")
+    print(f"   → 影響筆數（TW）：{counts[flags.TW_LOW_3]}")
+
+
+def finalize(conn):
+    """
+    由 channel_acc 重算 channel_avg（表很小，每次整張重寫）
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM channel_avg")
 
     # ─────────────────────────────
     # 重新計算（母體標準差）
     # ─────────────────────────────
-    cur.execute("""
+    cur.execute(f"""
     INSERT INTO channel_avg (
         channel_id, channel_name,
 
@@ -115,78 +99,48 @@ WHERE id IN (
         -- ───────── YT ─────────
 
         -- 算術平均
-        COALESCE(
-            ROUND(AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END), 1),
-            0
-        ) AS yt_avg,
+        COALESCE(ROUND(a.yt_mean, 1), 0) AS yt_avg,
 
         -- 母體標準差
-        COALESCE(
-            ROUND(
-                sqrt(
-                    AVG(CASE WHEN m.yt_number != 0 THEN m.youtube * m.youtube END)
-                  - AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END)
-                    * AVG(CASE WHEN m.yt_number != 0 THEN m.youtube END)
-                ),
-                1
-            ),
-            0
-        ) AS yt_std,
+        COALESCE(ROUND(a.yt_std, 1), 0) AS yt_std,
 
         -- 幾何平均（log-space）
-        COALESCE(
-            AVG(
-                CASE
-                    WHEN m.yt_number != 0 AND m.youtube > 0
-                    THEN ln(m.youtube)
-                END
-            ),
-            NULL
-        ) AS yt_log_geo_avg,
+        a.yt_ln_mean AS yt_log_geo_avg,
 
         -- ───────── TW ─────────
 
         -- 算術平均
-        COALESCE(
-            ROUND(AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END), 1),
-            0
-        ) AS tw_avg,
+        COALESCE(ROUND(a.tw_mean, 1), 0) AS tw_avg,
 
         -- 母體標準差
-        COALESCE(
-            ROUND(
-                sqrt(
-                    AVG(CASE WHEN m.tw_number != 0 THEN m.twitch * m.twitch END)
-                  - AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END)
-                    * AVG(CASE WHEN m.tw_number != 0 THEN m.twitch END)
-                ),
-                1
-            ),
-            0
-        ) AS tw_std,
+        COALESCE(ROUND(a.tw_std, 1), 0) AS tw_std,
 
         -- 幾何平均（log-space）
-        COALESCE(
-            AVG(
-                CASE
-                    WHEN m.tw_number != 0 AND m.twitch > 0
-                    THEN ln(m.twitch)
-                END
-            ),
-            NULL
-        ) AS tw_log_geo_avg
+        a.tw_ln_mean AS tw_log_geo_avg
 
     FROM streamer s
-    LEFT JOIN main m
-        ON m.channel = s.channel_id
-    GROUP BY s.channel_id, s.channel_name
+    LEFT JOIN ({channel_stats.STATS_SQL}) a
+        ON a.channel_id = s.channel_id
     ORDER BY s.id;
 """)
 
     conn.commit()
-    conn.close()
 
-    print("✅ 3_1 channel_avg 重新計算完成（cleaned）")
+
+def update(hi):
+    """
+    增量更新：main 直接接 3_0 的，新資料先併進 channel_acc，
+    只對新資料標記異常值（標記的再扣掉），再重算 channel_avg
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    channel_stats.accumulate(conn, window)
+    delete_extreme(conn, window)
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
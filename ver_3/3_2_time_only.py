@@ -1,9 +1,11 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 TOP_PATH = Path(__file__).resolve().parent
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db, time_profile
+
 SRC_DB = TOP_PATH / "data_3_1.db"   # 來源：已有 channel_avg
 DST_DB = TOP_PATH / "data_3_2.db"   # 輸出：2.1 結果
 
@@ -11,230 +13,171 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError("找不到 data_2_0.db")
 
-    if DST_DB.exists():
-        DST_DB.unlink()
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 建立 data_3_2.db")
-
-    conn = sqlite3.connect(DST_DB)
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 建立 data_3_2.db")
 
-    # === 建 time_slots ===
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS time_slots (
-        time TEXT PRIMARY KEY
-    );
-    """)
-
-    cur.execute("SELECT COUNT(*) FROM time_slots;")
-    if cur.fetchone()[0] == 0:
-        for h in range(24):
-            for m in (0, 15, 30, 45):
-                cur.execute(
-                    "INSERT INTO time_slots VALUES (?)",
-                    (f"{h:02d}:{m:02d}",)
-                )
+    # time_slots 是 1_1 依區塊設定建的（pipeline/timeslot），這裡直接用
 
-    # === 建 yt_time_profile ===
-    # =========================
-    # 建立 2.1 YT 分析表
-    # =========================
-    cur.executescript("""
-    CREATE TABLE yt_time_profile (
-        channel_id TEXT,
-        channel_name TEXT,
-        time TEXT,
-
-        live_count INTEGER,
-        avg_viewers REAL,
-        diff_percent REAL,
-
-        PRIMARY KEY (channel_id, time)
-    );
-    CREATE TABLE tw_time_profile (
-        channel_id TEXT,
-        channel_name TEXT,
-        time TEXT,
-
-        live_count INTEGER,
-        avg_viewers REAL,
-        diff_percent REAL,
-
-        PRIMARY KEY (channel_id, time)
-    );
-    """)
+    # 每個平台一張 *_time_profile
+    for p in platforms.PLATFORMS:
+        cur.execute(f"""
+        CREATE TABLE {p.key}_time_profile (
+            channel_id TEXT,
+            channel_name TEXT,
+            time TEXT,
 
-    print("📊 計算 3.2 YT 時間分佈（含差異百分比）")
+            live_count INTEGER,
+            avg_viewers REAL,
+            diff_percent REAL,
 
-    cur.execute("""
-    INSERT OR REPLACE INTO yt_time_profile
-    SELECT
-        c.channel_id,
-        c.channel_name,
-        t.time,
+            PRIMARY KEY (channel_id, time)
+        );
+        """)
 
-        COUNT(m.youtube) AS live_count,
-        COALESCE(ROUND(AVG(m.youtube), 1), 0) AS avg_viewers,
+    # 可累加的 (頻道, 時段) 統計量；ln_n / ln_sum 只算觀看數 > 0 的
+    time_profile.create_acc(conn, platforms.KEYS, ln=True)
 
-        CASE
-            WHEN c.yt_avg <= 0 THEN 0
-            WHEN AVG(m.youtube) <= 0 THEN 0
-            ELSE ROUND(
-                (
-                    exp(
-                        AVG(ln(m.youtube)) - c.yt_log_geo_avg
-                    ) - 1
-                ) * 100,
-                2
-            )
-        END AS diff_percent
-
-    FROM channel_avg c
-    CROSS JOIN time_slots t
-    LEFT JOIN main m
-        ON m.channel = c.channel_id
-    AND m.time = t.time
-    AND m.yt_number != 0
-    WHERE c.yt_avg <> 0
-    GROUP BY c.channel_id, c.channel_name, t.time
-    ORDER BY c.channel_id, t.time;
-    """)
+    accumulate(conn, incremental.ALL)
+    finalize(conn)
 
-    conn.commit()
-    
-    print("🎉 完成（YT 時間分佈）")
-    
+    incremental.mark_full_run(conn)
+    conn.close()
     
-    print("📊 計算 3.2 TW 時間分佈（含差異百分比）")
-    cur.execute("""
-    INSERT OR REPLACE INTO tw_time_profile
-    SELECT
-        c.channel_id,
-        c.channel_name,
-        t.time,
+    print("🎉 data_3_2 完成（YT & TW 時間分佈）")
 
-        COUNT(m.twitch) AS live_count,
-        COALESCE(ROUND(AVG(m.twitch), 1), 0) AS avg_viewers,
 
-        CASE
-            WHEN c.tw_avg <= 0 THEN 0
-            WHEN AVG(m.twitch) <= 0 THEN 0
-            ELSE ROUND(
-                (
-                    exp(
-                        AVG(ln(m.twitch)) - c.tw_log_geo_avg
-                    ) - 1
-                ) * 100,
-                2
-            )
-        END AS diff_percent
-
-    FROM channel_avg c
-    CROSS JOIN time_slots t
-    LEFT JOIN main m
-        ON m.channel = c.channel_id
-        AND m.time = t.time
-        AND m.tw_number != 0
-    WHERE c.tw_avg <> 0
-    GROUP BY c.channel_id, c.channel_name, t.time
-    ORDER BY c.channel_id, t.time;
-    """)
+def accumulate(conn, window):
+    """
+    把 window 內的資料加進各平台的 *_time_acc（所有平台同一次掃描）
+    """
+    time_profile.accumulate(conn, window, platforms.KEYS, ln=True)
 
-    conn.commit()
-    print("🎉 完成（TW 時間分佈）")
-    
-    cur.executescript("""
 
-CREATE TABLE time_global_profile AS
-WITH yt AS (
+def finalize(conn):
+    """
+    由 time_acc + channel_avg 重算各平台的 time_profile 與 time_global_profile
+    """
+    cur = conn.cursor()
+
+    for p in platforms.PLATFORMS:
+        cur.execute(f"DELETE FROM {p.key}_time_profile")
+
+        print(f"📊 計算 3.2 {p.label} 時間分佈（含差異百分比）")
+
+        cur.execute(f"""
+        INSERT OR REPLACE INTO {p.key}_time_profile
+        SELECT
+            c.channel_id,
+            c.channel_name,
+            t.time,
+
+            COALESCE(a.n, 0) AS live_count,
+            COALESCE(ROUND(a.sum / a.n, 1), 0) AS avg_viewers,
+
+            CASE
+                WHEN c.{p.key}_avg <= 0 THEN 0
+                WHEN a.sum / a.n <= 0 THEN 0
+                ELSE ROUND(
+                    (
+                        exp(
+                            a.ln_sum / NULLIF(a.ln_n, 0) - c.{p.key}_log_geo_avg
+                        ) - 1
+                    ) * 100,
+                    2
+                )
+            END AS diff_percent
+
+        FROM channel_avg c
+        CROSS JOIN time_slots t
+        LEFT JOIN {p.key}_time_acc a
+            ON a.channel_id = c.channel_id
+            AND a.slot = t.slot
+        WHERE c.{p.key}_avg <> 0
+        ORDER BY c.channel_id, t.time;
+        """)
+
+        conn.commit()
+        print(f"🎉 完成（{p.label} 時間分佈）")
+
+    # 每個平台：依時段加總筆數 / 人數 / 還原的 diff_log
+    sums = ",\n".join(f"""
+{p.key} AS (
     SELECT
         time,
-        SUM(live_count) AS yt_sum,
-        SUM(avg_viewers * live_count) AS yt_avg_wsum,
+        SUM(live_count) AS {p.key}_sum,
+        SUM(avg_viewers * live_count) AS {p.key}_avg_wsum,
 
         -- 🔑 即時還原 diff_log
         SUM(
             ln(1 + diff_percent / 100.0) * live_count
-        ) AS yt_diff_log_wsum
-    FROM yt_time_profile
+        ) AS {p.key}_diff_log_wsum
+    FROM {p.key}_time_profile
     GROUP BY time
-),
-tw AS (
-    SELECT
-        time,
-        SUM(live_count) AS tw_sum,
-        SUM(avg_viewers * live_count) AS tw_avg_wsum,
-        SUM(
-            ln(1 + diff_percent / 100.0) * live_count
-        ) AS tw_diff_log_wsum
-    FROM tw_time_profile
-    GROUP BY time
-),
-all_time AS (
-    SELECT time FROM yt
-    UNION
-    SELECT time FROM tw
-)
-SELECT
-    a.time,
+)""" for p in platforms.PLATFORMS)
 
-    -- ───────── YT ─────────
-    yt.yt_sum,
+    all_time = "\n    UNION\n".join(
+        f"    SELECT time FROM {p.key}" for p in platforms.PLATFORMS
+    )
+
+    weighted = ",\n".join(f"""
+    -- ───────── {p.label} ─────────
+    {p.key}.{p.key}_sum,
 
     ROUND(
         CASE
-            WHEN yt.yt_sum > 0
-            THEN yt.yt_avg_wsum / yt.yt_sum
+            WHEN {p.key}.{p.key}_sum > 0
+            THEN {p.key}.{p.key}_avg_wsum / {p.key}.{p.key}_sum
             ELSE NULL
         END
-    , 2) AS yt_weighted_avg,
+    , 2) AS {p.key}_weighted_avg,
 
     ROUND(
         CASE
-            WHEN yt.yt_sum > 0
+            WHEN {p.key}.{p.key}_sum > 0
             THEN (
-                exp(yt.yt_diff_log_wsum * 1.0 / yt.yt_sum) - 1
+                exp({p.key}.{p.key}_diff_log_wsum * 1.0 / {p.key}.{p.key}_sum) - 1
             ) * 100
             ELSE NULL
         END
-    , 2) AS yt_weighted_diff,
+    , 2) AS {p.key}_weighted_diff""" for p in platforms.PLATFORMS)
 
-    -- ───────── TW ─────────
-    tw.tw_sum,
+    joins = "\n".join(
+        f"LEFT JOIN {p.key} ON {p.key}.time = a.time" for p in platforms.PLATFORMS
+    )
 
-    ROUND(
-        CASE
-            WHEN tw.tw_sum > 0
-            THEN tw.tw_avg_wsum / tw.tw_sum
-            ELSE NULL
-        END
-    , 2) AS tw_weighted_avg,
+    cur.executescript(f"""
 
-    ROUND(
-        CASE
-            WHEN tw.tw_sum > 0
-            THEN (
-                exp(tw.tw_diff_log_wsum * 1.0 / tw.tw_sum) - 1
-            ) * 100
-            ELSE NULL
-        END
-    , 2) AS tw_weighted_diff
+DROP TABLE IF EXISTS time_global_profile;
+
+CREATE TABLE time_global_profile AS
+WITH {sums},
+all_time AS (
+{all_time}
+)
+SELECT
+    a.time,
+{weighted}
 
 FROM all_time a
-LEFT JOIN yt ON yt.time = a.time
-LEFT JOIN tw ON tw.time = a.time
+{joins}
 ORDER BY a.time;
 
-
     """)
-    
-    
-    conn.close()
-    
-    print("🎉 data_3_2 完成（YT & TW 時間分佈）")
-    
+
+
+def update(hi):
+    """
+    增量更新：新資料加進 time_acc，再用新的 channel_avg 重算
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    accumulate(conn, window)
+    finalize(conn)
+
+    incremental.finish_update(conn, window)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-import sqlite3
+import sys
 import pandas as pd
 import streamlit as st
 from pathlib import Path
@@ -10,22 +10,18 @@ st.set_page_config(page_title="YT / TW 時段分析", layout="wide")
 
 DB_PATH = Path(__file__).parent / "data_3_2.db"
 
-#streamlit run ver_3/3_3_time_graph.py
-
-# ─────────────────────────────
-# 工具：時間排序
-# ─────────────────────────────
-def time_sort_key(t):
-    hour = int(t.split(":")[0])
-    return hour if hour >= 12 else hour + 24
+# time_slots 在上游的 stage 檔，用 stage_db.connect 接起來
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from pipeline import stage_db
 
+#streamlit run ver_3/3_3_time_graph.py
 
 # ─────────────────────────────
 # 讀頻道清單
 # ─────────────────────────────
 @st.cache_data
 def load_channels():
-    with sqlite3.connect(DB_PATH) as conn:
+    with stage_db.connect(DB_PATH) as conn:
         df = pd.read_sql("""
             SELECT DISTINCT channel_id, channel_name
             FROM yt_time_profile
@@ -40,14 +36,18 @@ def load_channels():
 
 @st.cache_data
 def load_time_profile(table, channel_id):
-    with sqlite3.connect(DB_PATH) as conn:
+    # sort_key：時間軸從中午開始（12:00 → 隔天 11:xx），用整數 slot 算
+    with stage_db.connect(DB_PATH) as conn:
         df = pd.read_sql(f"""
             SELECT
-                time,
-                live_count,
-                avg_viewers
-            FROM {table}
-            WHERE channel_id = ?
+                p.time,
+                (s.slot * b.minutes + 720) % 1440 AS sort_key,
+                p.live_count,
+                p.avg_viewers
+            FROM {table} p
+            JOIN time_slots s ON s.time = p.time
+            CROSS JOIN time_bucket b
+            WHERE p.channel_id = ?
         """, conn, params=(channel_id,))
     return df
 
@@ -87,8 +87,6 @@ def prepare_df(df, prefix):
                                      f"{prefix}_avg"])
 
     df = df.copy()
-    df["sort_key"] = df["time"].apply(time_sort_key)
-
     df = df[["time", "sort_key", "live_count", "avg_viewers"]]
     df.rename(columns={
         "live_count": f"{prefix}_live",
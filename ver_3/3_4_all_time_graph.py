@@ -1,4 +1,4 @@
-import sqlite3
+import sys
 import pandas as pd
 import streamlit as st
 from pathlib import Path
@@ -12,12 +12,9 @@ st.set_page_config(page_title="全體時段分析（Global）", layout="wide")
 
 DB_PATH = Path(__file__).parent / "data_3_2.db"
 
-# ─────────────────────────────
-# 工具：時間排序（12:00 → 23:45 → 00:00 → 11:45）
-# ─────────────────────────────
-def time_sort_key(t):
-    hour, minute = map(int, t.split(":"))
-    return hour * 60 + minute + (1440 if hour < 12 else 0)
+# time_slots 在上游的 stage 檔，用 stage_db.connect 接起來
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from pipeline import stage_db
 
 
 # ─────────────────────────────
@@ -25,17 +22,22 @@ def time_sort_key(t):
 # ─────────────────────────────
 @st.cache_data
 def load_global_time_profile():
-    with sqlite3.connect(DB_PATH) as conn:
+    # hour / sort_key 用整數 slot 算（sort_key：12:00 → 23:45 → 00:00 → 11:45）
+    with stage_db.connect(DB_PATH) as conn:
         df = pd.read_sql("""
             SELECT
-                time,
-                yt_sum,
-                yt_weighted_avg,
-                yt_weighted_diff,
-                tw_sum,
-                tw_weighted_avg,
-                tw_weighted_diff
-            FROM time_global_profile
+                g.time,
+                s.slot * b.minutes / 60 AS hour,
+                (s.slot * b.minutes + 720) % 1440 AS sort_key,
+                g.yt_sum,
+                g.yt_weighted_avg,
+                g.yt_weighted_diff,
+                g.tw_sum,
+                g.tw_weighted_avg,
+                g.tw_weighted_diff
+            FROM time_global_profile g
+            JOIN time_slots s ON s.time = g.time
+            CROSS JOIN time_bucket b
         """, conn)
     return df
 
@@ -54,11 +56,6 @@ if global_df.empty:
 # None → 0
 global_df = global_df.fillna(0)
 
-# 取出 hour
-global_df["hour"] = global_df["time"].apply(
-    lambda t: int(t.split(":")[0])
-)
-
 # 只保留 18:00 ~ 05:00
 global_df = global_df[
     (global_df["hour"] >= 18) |
@@ -70,7 +67,6 @@ if global_df.empty:
     st.stop()
 
 # 時間排序（中午邏輯仍適用）
-global_df["sort_key"] = global_df["time"].apply(time_sort_key)
 global_df.sort_values("sort_key", inplace=True)
 
 
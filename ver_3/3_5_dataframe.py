@@ -1,4 +1,4 @@
-import sqlite3
+import sys
 import pandas as pd
 import streamlit as st
 from pathlib import Path
@@ -16,6 +16,10 @@ st.set_page_config(page_title="個人 × 時段 Diff Heatmap", layout="wide")
 
 DB_PATH = Path(__file__).parent / "data_3_2.db"
 
+# streamer 在上游的 stage 檔，用 stage_db.connect 接起來
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from pipeline import stage_db
+
 
 
 def diff_to_color(v):
@@ -58,16 +62,9 @@ RED_WHITE_GREEN = LinearSegmentedColormap.from_list(
 
 
 
-# ─────────────────────────────
-# 工具：時間排序（12:00 → 23:45 → 00:00 → 11:45）
-# ─────────────────────────────
-def time_sort_key(t):
-    hour, minute = map(int, t.split(":"))
-    return hour * 60 + minute + (1440 if hour < 12 else 0)
-
 @st.cache_data
 def load_streamer_order():
-    with sqlite3.connect(DB_PATH) as conn:
+    with stage_db.connect(DB_PATH) as conn:
         df = pd.read_sql("""
             SELECT channel_id, channel_name, id
             FROM streamer
@@ -83,22 +80,25 @@ def load_streamer_order():
 # ─────────────────────────────
 @st.cache_data
 def load_platform_df(table, diff_col_name):
-    with sqlite3.connect(DB_PATH) as conn:
+    with stage_db.connect(DB_PATH) as conn:
         
+        # sort_key：12:00 → 23:45 → 00:00 → 11:45，用整數 slot 算
         df = pd.read_sql(f"""
             SELECT
-                channel_id,
-                channel_name,
-                time,
-                ROUND(diff_percent, 2) AS {diff_col_name}
-            FROM {table}
+                p.channel_id,
+                p.channel_name,
+                p.time,
+                (s.slot * b.minutes + 720) % 1440 AS sort_key,
+                ROUND(p.diff_percent, 2) AS {diff_col_name}
+            FROM {table} p
+            JOIN time_slots s ON s.time = p.time
+            CROSS JOIN time_bucket b
         """, conn)
 
     # 缺值補 0
     df = df.fillna(0)
 
     # 時間排序
-    df["sort_key"] = df["time"].apply(time_sort_key)
     df.sort_values("sort_key", inplace=True)
 
     # pivot 成 heatmap 形式
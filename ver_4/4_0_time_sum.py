@@ -1,11 +1,13 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 VER3_PATH = TOP_PATH.parent / "ver_3"
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, platforms, stage_db
+
 SRC_DB = VER3_PATH / "data_3_2.db"
 DST_DB = TOP_PATH / "data_4_0.db"
 # =======================
@@ -15,22 +17,17 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_4_0.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # 1️⃣ 建立 data_4_0.db（上游唯讀 ATTACH）
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 已建立 data_4_0.db")
 
     cur.executescript("""
 
 CREATE TABLE IF NOT EXISTS live_concurrent (
     date TEXT NOT NULL,
     time TEXT NOT NULL,
+    ts INTEGER NOT NULL,        -- 時段開頭的 epoch 分鐘（main.ts）
     live_count INTEGER NOT NULL,
     id_list TEXT NOT NULL,
 
@@ -52,11 +49,34 @@ CREATE TABLE concurrent_effect (
     """)
 
     conn.commit()
-    
-    cur.executescript("""
+
+    add_concurrent(conn, incremental.ALL)
+    compute_effect(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+
+    print("🎉 已完成只保留子午資料！")
+
+
+def add_concurrent(conn, window):
+    """
+    把 window 內每個時段的同時直播數加進 live_concurrent
+    表現用第一個有開台（且觀看數 > 0）的平台，順序同 platforms.PLATFORMS
+    """
+    perf = "\n                    ".join(
+        f"WHEN m.{p.stream_id} != 0 AND m.{p.viewers} > 0 "
+        f"THEN ln(m.{p.viewers}) - c.{p.key}_log_geo_avg"
+        for p in platforms.PLATFORMS
+    )
+    any_live = "\n        OR ".join(
+        f"m.{p.stream_id} IS NOT NULL" for p in platforms.PLATFORMS
+    )
+
+    conn.execute(f"""
 
 INSERT INTO live_concurrent (
-    date, time,
+    date, time, ts,
     live_count,
     id_list,
     geo_perf_percent
@@ -64,6 +84,7 @@ INSERT INTO live_concurrent (
 SELECT
     m.date,
     m.time,
+    m.ts,
 
     COUNT(m.id) AS live_count,
     GROUP_CONCAT(m.id) AS id_list,
@@ -73,10 +94,7 @@ SELECT
         exp(
             AVG(
                 CASE
-                    WHEN m.yt_number != 0 AND m.youtube > 0
-                        THEN ln(m.youtube) - c.yt_log_geo_avg
-                    WHEN m.tw_number != 0 AND m.twitch > 0
-                        THEN ln(m.twitch) - c.tw_log_geo_avg
+                    {perf}
                 END
             )
         ) - 1
@@ -86,16 +104,25 @@ FROM main m
 JOIN channel_avg c
     ON m.channel = c.channel_id
 WHERE
-    m.yt_number IS NOT NULL
-    OR m.tw_number IS NOT NULL
+    (
+        {any_live}
+    )
+    AND {window.where_ts("m.")}
 GROUP BY
-    m.date, m.time;
+    m.ts;
 
 
     """)
     conn.commit()
-    
-    cur.executescript("""
+
+
+def compute_effect(conn):
+    """
+    由 live_concurrent 重算 concurrent_effect（表很小，每次整張重寫）
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM concurrent_effect")
+    cur.execute("""
     
 INSERT INTO concurrent_effect (
     live_count,
@@ -117,9 +144,22 @@ ORDER BY live_count;
 
     
     """)
-    conn.close()
+    conn.commit()
 
-    print("🎉 已完成只保留子午資料！")
+
+def update(hi):
+    """
+    增量更新：新時段加進 live_concurrent，再重算 concurrent_effect
+    已經算過的時段不會跟著新的 channel_avg 重算，要完全一致請完整重跑
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    add_concurrent(conn, window)
+    compute_effect(conn)
+
+    incremental.finish_update(conn, window)
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,19 @@
-import sqlite3
-import shutil
+import sys
 from pathlib import Path
 
 # ====== Path 設定 ======
 TOP_PATH = Path(__file__).resolve().parent
 VER3_PATH = TOP_PATH.parent / "ver_3"
 
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import incremental, stage_db, timeslot
+
 SRC_DB = TOP_PATH / "data_4_0.db"
 DST_DB = TOP_PATH / "data_4_1.db"
+
+# 統計期間 [開始, 結束)，共 180 天
+PERIOD_START = "2025-06-29 12:00"
+PERIOD_END = "2025-12-26 12:00"
 # =======================
 
 
@@ -15,16 +21,10 @@ def main():
     if not SRC_DB.exists():
         raise FileNotFoundError(f"找不到來源資料庫：{SRC_DB}")
 
-    if DST_DB.exists():
-        DST_DB.unlink()   # 直接刪掉舊檔
-        print(f"⚠️ 已刪除舊的 {DST_DB.name}")
-
-    # 1️⃣ 複製 DB
-    shutil.copyfile(SRC_DB, DST_DB)
-    print("✅ 已建立 data_4_0.db")
-
-    conn = sqlite3.connect(DST_DB)
+    # 1️⃣ 建立 data_4_1.db（上游唯讀 ATTACH）
+    conn = stage_db.open_stage(DST_DB, SRC_DB)
     cur = conn.cursor()
+    print("✅ 已建立 data_4_1.db")
 
     cur.executescript("""
 
@@ -47,8 +47,20 @@ CREATE TABLE IF NOT EXISTS live_count_by_time (
     """)
 
     conn.commit()
-    
-    cur.executescript("""
+
+    compute(conn)
+
+    incremental.mark_full_run(conn)
+    conn.close()
+
+    print("🎉 已完成只保留子午資料！")
+
+
+def compute(conn):
+    """
+    由 live_concurrent 算各時段的同時直播數分佈（INSERT OR REPLACE，重跑會蓋掉）
+    """
+    conn.executescript(f"""
 
 INSERT OR REPLACE INTO live_count_by_time (
     time,
@@ -73,11 +85,8 @@ WITH dist AS (
         SUM(CASE WHEN live_count = 10 THEN 1 ELSE 0 END) AS cnt_10
     FROM live_concurrent
     WHERE
-        (date = '2025-06-29' AND time >= '12:00')
-        OR
-        (date > '2025-06-29' AND date < '2025-12-26')
-        OR
-        (date = '2025-12-26' AND time < '12:00')
+        ts >= {timeslot.to_ts(PERIOD_START)}
+        AND ts < {timeslot.to_ts(PERIOD_END)}
     GROUP BY time
 )
 SELECT
@@ -122,9 +131,18 @@ FROM dist d;
 
     """)
 
-    conn.close()
 
-    print("🎉 已完成只保留子午資料！")
+def update(hi):
+    """
+    增量更新：live_count_by_time 很小，直接重算
+    """
+    conn, window = incremental.open_update(DST_DB, SRC_DB, hi=hi)
+    if conn is None:
+        return
+
+    compute(conn)
+
+    incremental.finish_update(conn, window)
 
 if __name__ == "__main__":
     main()
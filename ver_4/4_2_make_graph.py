@@ -1,4 +1,4 @@
-import sqlite3
+import sys
 import pandas as pd
 import streamlit as st
 import matplotlib.pyplot as plt
@@ -15,9 +15,13 @@ st.set_page_config(
 TOP_PATH = Path(__file__).resolve().parent
 DB_PATH = TOP_PATH / "data_4_1.db"
 
+# concurrent_effect 在 data_4_0.db，用 stage_db.connect 接起來
+sys.path.append(str(TOP_PATH.parent))
+from pipeline import stage_db
+
 
 def load_df(query):
-    with sqlite3.connect(DB_PATH) as conn:
+    with stage_db.connect(DB_PATH) as conn:
         return pd.read_sql_query(query, conn)
 
 